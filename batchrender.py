@@ -0,0 +1,122 @@
+"""
+Render the outputs of several cases that share an input in one invocation.
+
+Before the first test runs, every selected case registers the ffmpeg and
+oiiotool renders it will need (see ociotest.register_renders). When a case
+asks for one of them, all still pending renders of the same input are made
+by a single command, so the input is decoded and the tool started once:
+
+    ffmpeg -y -i input <output options 1> out1 <output options 2> out2 ...
+    oiiotool input --dup <args 1> -o out1 --pop --dup <args 2> -o out2 --pop ...
+
+Each output lands in the work unit the case would have rendered on its own
+(see workunits), oiiotool outputs also go into the reference cache under
+their own keys, so the cases pick them up unchanged. If a batch fails, the
+cases fall back to rendering one by one.
+"""
+import os
+import threading
+
+import cmdrunner
+import refcache
+import workunits
+
+# Set by conftest from --no-batch.
+ENABLED = True
+FFMPEG_BIN = "ffmpeg"
+# Threads of one batch command (ffmpeg -threads/-filter_threads, oiiotool --threads), set by
+# ociotest. 0 leaves the tools' defaults.
+THREADS = 0
+
+# (tool, group) -> {unit key: render}, where a render is a dict with the
+# input file, the tool arguments, the output extension and for oiiotool the
+# reference cache key.
+_PLANS = {}
+_GROUP_LOCKS = {}
+_LOCK = threading.Lock()
+
+
+def register(tool, group, key, render):
+    with _LOCK:
+        _PLANS.setdefault((tool, group), {})[key] = render
+
+
+def oiiotool_group(input_file, oiio_args):
+    """
+    oiiotool renders can only be chained when they set their own config and
+    output data type, since both persist along an oiiotool command line.
+    Returns None for renders that must run on their own.
+    """
+    if "--colorconfig" not in oiio_args or "-d" not in oiio_args:
+        return None
+    return (input_file, oiio_args[oiio_args.index("--colorconfig") + 1])
+
+
+def ffmpeg_command(input_file, outputs):
+    """outputs: list of (output options, output path)."""
+    threads = f"-threads {THREADS} -filter_threads {THREADS} " if THREADS else ""
+    return f"{FFMPEG_BIN} -y {threads}-i {input_file} " + " ".join(f"{args.strip()} {path}" for args, path in outputs)
+
+
+def oiiotool_command(input_file, outputs):
+    """outputs: list of (oiiotool argument list, output path)."""
+    chain = " ".join(f"--dup {' '.join(args)} -o {path} --pop" for args, path in outputs)
+    threads = f"--threads {THREADS} " if THREADS else ""
+    return f"{refcache.OIIOTOOL_BIN} {threads}{input_file} {chain}"
+
+
+def ensure(tool, group, key, run_cmd, log_file=None):
+    """
+    Render every pending unit of the batch that contains key with one
+    command (run through run_cmd). Returns True if key has been rendered.
+    """
+    if not ENABLED or group is None:
+        return False
+    with _LOCK:
+        group_lock = _GROUP_LOCKS.setdefault((tool, group), threading.Lock())
+
+    with group_lock:
+        # Read under the group lock: a batch that failed meanwhile has been dropped.
+        with _LOCK:
+            plan = dict(_PLANS.get((tool, group), {}))
+        if key not in plan or len(plan) < 2:
+            return False
+        pending = {k: r for k, r in plan.items() if not workunits.is_done(k, r["ext"])}
+        if key not in pending:
+            return True
+
+        def produce(paths):
+            outputs = []
+            for k in sorted(paths):
+                render = pending[k]
+                # References cached by an earlier run don't need rendering again.
+                if tool == "oiiotool" and not refcache.REFRESH and refcache.fetch(render["refkey"], paths[k]):
+                    continue
+                outputs.append((render["args"], paths[k]))
+            if not outputs:
+                return
+            input_file = next(iter(pending.values()))["input_file"]
+            if tool == "ffmpeg":
+                run_cmd(ffmpeg_command(input_file, outputs), log_file)
+            else:
+                run_cmd(oiiotool_command(input_file, outputs), log_file)
+                for k, path in paths.items():
+                    refcache.store(pending[k]["refkey"], path)
+
+        _log(f"Batch rendering {len(pending)} {tool} outputs of {pending[key]['input_file']}\n", log_file)
+        try:
+            workunits.shared_outputs({k: r["ext"] for k, r in pending.items()}, produce, log_file)
+        except AssertionError as exc:
+            _log(f"Batch render failed, rendering the cases one by one: {exc}\n", log_file)
+            # Don't try this batch again in this process.
+            with _LOCK:
+                _PLANS.pop((tool, group), None)
+            return False
+    return True
+
+
+def _log(msg, log_file):
+    print(msg, file=os.sys.stderr)
+    if log_file:
+        with cmdrunner.LOG_LOCK, open(log_file, "a") as f:
+            f.write(msg)
@@ -0,0 +1,420 @@
+"""
+Throughput benchmark for the ffmpeg ocio filter.
+
+Sweeps the ocio filter's threads=, its format= (pixel format), the encoder,
+the resolution and the sequence length, runs every configuration with
+warmup and repeated measurements, and writes the results as JSON and CSV.
+
+Only software encoders are used. When no source sequence is given (or it
+does not exist) a synthetic float EXR sequence of the requested resolution is
+generated with mediagen.
+
+Memory is measured as well: the peak RSS of every run (the larger of
+wait4's and the /proc samples, see cmdrunner), the size of one frame in
+the ocio format= and the peak in frames. Configurations whose peak exceeds
+--memory-budget fail the sweep.
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import cmdrunner
+import imagereaders
+import mediagen
+
+FFMPEG_BIN = "ffmpeg"
+OCIO_CONFIG = "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio"
+INPUT_SPACE = "ACEScg"
+DISPLAY = "Rec.2100-PQ - Display"
+VIEW = "ACES 1.1 - HDR Video (1000 nits & Rec.2020 lim)"
+SCALE = "scale=in_range=full:in_color_matrix=bt2020:out_range=tv:out_color_matrix=bt2020"
+BASELINE = os.environ.get("OCIOTEST_BASELINE", "benchmarks/baseline.json")
+# Set by conftest from --update-baseline: the regression test stores its sweep instead of failing.
+UPDATE_BASELINE = False
+# Seconds between RSS samples of the benchmark runs (see cmdrunner), 0 for wait4's peak only.
+RSS_INTERVAL = float(os.environ.get("OCIOTEST_RSS_INTERVAL", "0.1"))
+# Peak RSS allowed per configuration in MiB, 0 for no limit.
+MEMORY_BUDGET_MB = float(os.environ.get("OCIOTEST_MEMORY_BUDGET_MB", "0"))
+
+# A configuration regresses when its median fps drops by more than the larger of
+# REL_TOLERANCE of the baseline and MAD_FACTOR robust standard deviations.
+REL_TOLERANCE = 0.05
+MAD_FACTOR = 3.0
+
+# Encoder arguments and container for each codec the sweep knows about.
+CODECS = {
+    "prores_ks": ("-c:v prores_ks -profile:v 3 -pix_fmt yuv422p10le -vendor apl0", "mov"),
+    "ffv1": ("-c:v ffv1 -level 3 -pix_fmt yuv444p10le", "mkv"),
+    "libx265": ("-c:v libx265 -pix_fmt yuv444p10le -x265-params lossless=1:log-level=error", "mp4"),
+    "null": ("-pix_fmt yuv444p10le -f null", None),
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def synthetic_sequence(width, height, frames, pattern="mixed"):
+    """
+    Generate (once) a float EXR sequence of a mediagen pattern and return
+    its '#' pattern and first frame.
+    """
+    path = mediagen.generate(pattern=pattern, width=width, height=height, frames=frames, format="exr", depth="float")
+    return path, mediagen.FIRST_FRAME
+
+
+def ffmpeg_command(source, first, frames, threads, pix_fmt, codec, resolution, output):
+    codec_args, _ = CODECS[codec]
+    filters = []
+    if resolution:
+        filters.append(f"scale={resolution.replace('x', ':')}")
+    filters.append(
+        f"ocio=config={OCIO_CONFIG}:input={INPUT_SPACE}:display={DISPLAY}:view={VIEW}:"
+        f"format={pix_fmt}:threads={threads}"
+    )
+    filters.append(SCALE)
+    return (
+        [FFMPEG_BIN, "-y", "-nostats", "-progress", "pipe:1", "-stats_period", "0.05",
+         "-framerate", "24", "-start_number", str(first), "-i", source.replace("#", "%05d"),
+         "-frames:v", str(frames), "-vf", ",".join(filters)]
+        + codec_args.split()
+        + [output]
+    )
+
+
+def run_ffmpeg(cmd, log_file=None):
+    """
+    Run ffmpeg with -progress on stdout and measure it. Per-frame latency is
+    derived from the progress updates: each update's elapsed time is spread
+    over the frames it reports.
+    """
+    latencies = []
+    progress = {"frames": 0, "last_time": time.perf_counter()}
+
+    def on_line(stream, line):
+        key, _, value = line.strip().partition("=")
+        if stream == "stdout" and key == "frame" and int(value) > progress["frames"]:
+            now = time.perf_counter()
+            new = int(value) - progress["frames"]
+            latencies.extend([(now - progress["last_time"]) / new] * new)
+            progress["frames"] += new
+            progress["last_time"] = now
+
+    result = cmdrunner.run(cmd, log_file, on_line=on_line, progress_interval=1.0, rss_interval=RSS_INTERVAL)
+    wall = result.elapsed
+    frames = progress["frames"]
+    cpu = result.cpu_user + result.cpu_sys
+    return {
+        "wall": wall,
+        "frames_done": frames,
+        "fps": frames / wall if wall else 0.0,
+        "latency_median": statistics.median(latencies) if latencies else None,
+        "latency_p95": percentile(latencies, 95) if latencies else None,
+        "cpu_user": result.cpu_user,
+        "cpu_sys": result.cpu_sys,
+        # Average number of busy cores, and that as a fraction of the machine.
+        "cpu_cores": cpu / wall if wall else 0.0,
+        "cpu_utilization": cpu / wall / (os.cpu_count() or 1) if wall else 0.0,
+        "max_rss_kib": max(result.max_rss_kib, result.sampled_peak_rss_kib or 0),
+        "rss_timeline": cmdrunner.downsample_rss(result.rss_samples),
+    }
+
+
+def frame_size(source, first, resolution):
+    """Width and height of the frames the ocio filter sees."""
+    if resolution and resolution != "native":
+        width, height = (int(v) for v in resolution.split("x"))
+        return width, height
+    height, width = imagereaders.read_image(source.replace("#", f"{first:05d}"), FFMPEG_BIN).pixels.shape[:2]
+    return width, height
+
+
+def summarize(reps):
+    """Median of the repetitions for every measured value."""
+    summary = {}
+    for key in reps[0]:
+        if key == "rss_timeline":
+            continue
+        values = [r[key] for r in reps if r[key] is not None]
+        summary[key] = statistics.median(values) if values else None
+    summary["fps_min"] = min(r["fps"] for r in reps)
+    summary["fps_max"] = max(r["fps"] for r in reps)
+    return summary
+
+
+def mad(values):
+    """Median absolute deviation, scaled to estimate a standard deviation."""
+    center = statistics.median(values)
+    return 1.4826 * statistics.median(abs(v - center) for v in values)
+
+
+def config_key(config):
+    """Stable name for a benchmark configuration, used to match results across runs."""
+    return "{codec}/{pix_fmt}/t{threads}/{resolution}/{frames}f".format(**config)
+
+
+def run_sweep(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    log_file = os.path.join(args.output_dir, "benchmark.log")
+    results = []
+    for resolution, frames in itertools.product(args.resolutions, args.frames):
+        if args.source and os.path.exists(args.source.replace("#", f"{args.first:05d}")):
+            source, first = args.source, args.first
+            scale_to = None if resolution == "native" else resolution
+        else:
+            if resolution == "native":
+                resolution = "1920x1080"
+            width, height = (int(v) for v in resolution.split("x"))
+            source, first = synthetic_sequence(width, height, max(args.frames), args.pattern)
+            scale_to = None
+        width, height = frame_size(source, first, scale_to or resolution)
+
+        for codec, pix_fmt, threads in itertools.product(args.codecs, args.pix_fmts, args.threads):
+            config = {
+                "codec": codec, "pix_fmt": pix_fmt, "threads": threads,
+                "resolution": resolution, "frames": frames, "source": source,
+            }
+            ext = CODECS[codec][1]
+            output = os.path.join(args.output_dir, f"bench.{ext}") if ext else "-"
+            cmd = ffmpeg_command(source, first, frames, threads, pix_fmt, codec, scale_to, output)
+            for _ in range(args.warmup):
+                run_ffmpeg(cmd, log_file)
+            reps = [run_ffmpeg(cmd, log_file) for _ in range(args.repeat)]
+            summary = summarize(reps)
+            summary["max_rss_kib"] = max(r["max_rss_kib"] for r in reps)
+            summary["frame_bytes"] = imagereaders.frame_bytes(width, height, imagereaders.rawvideo_pix_fmt(pix_fmt))
+            summary["rss_frames"] = summary["max_rss_kib"] * 1024 / summary["frame_bytes"]
+            print(
+                f"{config_key(config)}: {summary['fps']:.2f} fps "
+                f"(median latency {summary['latency_median'] or 0:.4f}s, "
+                f"p95 {summary['latency_p95'] or 0:.4f}s, {summary['cpu_cores']:.1f} cores, "
+                f"peak rss {summary['max_rss_kib'] / 1024:.0f} MiB)"
+            )
+            results.append({"key": config_key(config), "config": config, "summary": summary, "reps": reps})
+    return results
+
+
+def over_budget(results, budget_mb):
+    """The results whose peak RSS exceeds budget_mb (none when budget_mb is 0)."""
+    if not budget_mb:
+        return []
+    return [r for r in results if r["summary"]["max_rss_kib"] / 1024 > budget_mb]
+
+
+def format_memory(results, budget_mb=0):
+    """Peak RSS per configuration, with the size of one frame and the peak in frames."""
+    header = ("Configuration", "Frame MiB", "Peak RSS MiB", "Peak / frame", "Budget")
+    rows = []
+    for r in results:
+        summary = r["summary"]
+        peak_mb = summary["max_rss_kib"] / 1024
+        rows.append((
+            r["key"],
+            f"{summary['frame_bytes'] / 2 ** 20:.1f}",
+            f"{peak_mb:.0f}",
+            f"{summary['rss_frames']:.1f}",
+            "-" if not budget_mb else ("OVER" if peak_mb > budget_mb else "ok"),
+        ))
+    widths = [max(len(v) for v in column) for column in zip(header, *rows)]
+    lines = ["  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip() for row in [header] + rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return "\n".join(lines)
+
+
+def host_info():
+    version = subprocess.run([FFMPEG_BIN, "-version"], capture_output=True, text=True).stdout.splitlines()
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": FFMPEG_BIN,
+        "ffmpeg_version": version[0] if version else "",
+    }
+
+
+def write_results(results, output_dir, name):
+    """Write the sweep as <name>.json (everything) and <name>.csv (one row per configuration)."""
+    json_path = os.path.join(output_dir, f"{name}.json")
+    with open(json_path, "w") as f:
+        json.dump({"host": host_info(), "results": results}, f, indent=2)
+
+    csv_path = os.path.join(output_dir, f"{name}.csv")
+    config_fields = ["codec", "pix_fmt", "threads", "resolution", "frames"]
+    summary_fields = list(results[0]["summary"]) if results else []
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["key"] + config_fields + summary_fields)
+        for r in results:
+            writer.writerow([r["key"]] + [r["config"][k] for k in config_fields] + [r["summary"][k] for k in summary_fields])
+    return json_path, csv_path
+
+
+def load_baseline(path=BASELINE):
+    if not os.path.exists(path):
+        return {"host": None, "results": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def baseline_host(baseline):
+    """The machine a baseline was recorded on, None when it doesn't say."""
+    return (baseline["host"] or {}).get("host")
+
+
+def same_host(baseline):
+    """True when the baseline was recorded on this machine; fps from other hosts can't be compared."""
+    return baseline_host(baseline) == platform.node()
+
+
+def update_baseline(results, path=BASELINE):
+    """Store the median fps/latency and fps spread of every configuration in results."""
+    baseline = load_baseline(path)
+    baseline["host"] = host_info()
+    for r in results:
+        fps = [rep["fps"] for rep in r["reps"]]
+        baseline["results"][r["key"]] = {
+            "fps": statistics.median(fps),
+            "fps_mad": mad(fps),
+            "latency_median": r["summary"]["latency_median"],
+            "repeat": len(fps),
+        }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    return baseline
+
+
+def compare_to_baseline(results, baseline):
+    """
+    Compare a sweep against the baseline. Returns one row per configuration
+    with the old and new median fps, the allowed drop and the verdict
+    ("ok", "faster", "REGRESSED" or "new" when the baseline has no entry).
+    """
+    rows = []
+    for r in results:
+        fps = [rep["fps"] for rep in r["reps"]]
+        new = statistics.median(fps)
+        row = {
+            "key": r["key"],
+            "old_fps": None,
+            "new_fps": new,
+            "change": None,
+            "tolerance": None,
+            "old_latency": None,
+            "new_latency": r["summary"]["latency_median"],
+            "status": "new",
+        }
+        old = baseline["results"].get(r["key"])
+        if old:
+            tolerance = max(REL_TOLERANCE * old["fps"], MAD_FACTOR * max(old["fps_mad"], mad(fps)))
+            row.update(
+                old_fps=old["fps"],
+                change=(new - old["fps"]) / old["fps"] if old["fps"] else 0.0,
+                tolerance=tolerance,
+                old_latency=old["latency_median"],
+            )
+            if new < old["fps"] - tolerance:
+                row["status"] = "REGRESSED"
+            elif new > old["fps"] + tolerance:
+                row["status"] = "faster"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+
+def format_comparison(rows):
+    """Old vs new table for compare_to_baseline() rows."""
+
+    def num(value, fmt):
+        return "-" if value is None else format(value, fmt)
+
+    header = ("Configuration", "Old fps", "New fps", "Change", "Tolerance", "Old latency", "New latency", "Result")
+    table = [
+        (
+            r["key"],
+            num(r["old_fps"], ".2f"),
+            num(r["new_fps"], ".2f"),
+            num(r["change"], "+.1%"),
+            num(r["tolerance"], ".2f"),
+            num(r["old_latency"], ".4f"),
+            num(r["new_latency"], ".4f"),
+            r["status"],
+        )
+        for r in rows
+    ]
+    widths = [max(len(v) for v in column) for column in zip(header, *table)]
+    lines = ["  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip() for row in [header] + table]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=os.environ.get("OCIOTEST_SPARKS_EXRS"),
+                        help="EXR sequence with '#' for the frame number (default: synthetic)")
+    parser.add_argument("--first", type=int, default=6100, help="First frame of --source")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="ocio threads= values")
+    parser.add_argument("--pix-fmts", nargs="+", default=["rgb48", "gbrpf32le", "gbrapf32le", "rgb24"],
+                        help="ocio format= values")
+    parser.add_argument("--codecs", nargs="+", default=["prores_ks", "ffv1", "libx265"], choices=sorted(CODECS))
+    parser.add_argument("--resolutions", nargs="+", default=["native"],
+                        help="WIDTHxHEIGHT values, 'native' for the source size")
+    parser.add_argument("--frames", type=int, nargs="+", default=[48], help="Sequence lengths")
+    parser.add_argument("--pattern", default="mixed", choices=sorted(mediagen.PATTERNS),
+                        help="mediagen pattern of the synthetic source used without --source")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output-dir", default="./outputbenchmark")
+    parser.add_argument("--name", default=None, help="Result file name (default: bench-<timestamp>)")
+    parser.add_argument("--ffmpeg", default=FFMPEG_BIN)
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline file to compare against")
+    parser.add_argument("--compare", action="store_true", help="Compare the sweep against --baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the sweep in --baseline")
+    parser.add_argument("--memory-budget", type=float, default=MEMORY_BUDGET_MB, metavar="MIB",
+                        help="Fail configurations whose peak RSS exceeds this many MiB (0: no limit)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global FFMPEG_BIN
+    args = parse_args(argv)
+    FFMPEG_BIN = args.ffmpeg
+    results = run_sweep(args)
+    name = args.name or f"bench-{time.strftime('%Y%m%d-%H%M%S')}"
+    json_path, csv_path = write_results(results, args.output_dir, name)
+    print(f"Wrote {json_path} and {csv_path}")
+    print(format_memory(results, args.memory_budget))
+    status = 0
+    over = over_budget(results, args.memory_budget)
+    if over:
+        print(f"Over the {args.memory_budget:.0f} MiB memory budget: {', '.join(r['key'] for r in over)}")
+        status = 1
+    if args.compare:
+        baseline = load_baseline(args.baseline)
+        rows = compare_to_baseline(results, baseline)
+        print(format_comparison(rows))
+        if not same_host(baseline):
+            print(f"Not gating: {args.baseline} was recorded on {baseline_host(baseline)}, not {platform.node()}")
+        elif any(r["status"] == "REGRESSED" for r in rows):
+            status = 1
+    if args.update_baseline:
+        update_baseline(results, args.baseline)
+        print(f"Updated {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
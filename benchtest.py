@@ -0,0 +1,51 @@
+"""
+Performance regression gate for the ocio filter.
+
+Runs a small benchmark.py sweep and compares the median fps of every
+configuration against benchmarks/baseline.json. Configurations over the
+memory budget (OCIOTEST_MEMORY_BUDGET_MB) fail as well. Run with --update-baseline
+to (re)record the baseline on the benchmark machine; on any other host the
+fps comparison is skipped.
+"""
+import os
+import shlex
+
+import pytest
+
+import benchmark
+
+# The sweep the gate runs, override with OCIOTEST_BENCH_ARGS (benchmark.py arguments).
+GATE_ARGS = "--codecs null --pix-fmts rgb48 gbrpf32le --threads 1 4 --frames 48 --warmup 1 --repeat 5"
+
+
+def test_benchmark_regression():
+    args = benchmark.parse_args(shlex.split(os.environ.get("OCIOTEST_BENCH_ARGS", GATE_ARGS)))
+    benchmark.FFMPEG_BIN = args.ffmpeg
+    results = benchmark.run_sweep(args)
+    benchmark.write_results(results, args.output_dir, "regression")
+    print(benchmark.format_memory(results, args.memory_budget))
+    over = benchmark.over_budget(results, args.memory_budget)
+    assert not over, f"Over the {args.memory_budget:.0f} MiB memory budget: " + ", ".join(
+        f"{r['key']} {r['summary']['max_rss_kib'] / 1024:.0f} MiB" for r in over
+    )
+
+    if benchmark.UPDATE_BASELINE:
+        benchmark.update_baseline(results)
+        pytest.skip(f"Baseline updated in {benchmark.BASELINE}")
+
+    baseline = benchmark.load_baseline()
+    if not baseline["results"]:
+        pytest.skip(f"No baseline in {benchmark.BASELINE}, run with --update-baseline first")
+
+    rows = benchmark.compare_to_baseline(results, baseline)
+    print(benchmark.format_comparison(rows))
+    # fps is only comparable on the machine the baseline was recorded on.
+    if not benchmark.same_host(baseline):
+        pytest.skip(
+            f"Baseline in {benchmark.BASELINE} was recorded on {benchmark.baseline_host(baseline)}, "
+            f"record one on this machine with --update-baseline"
+        )
+    regressed = [r for r in rows if r["status"] == "REGRESSED"]
+    assert not regressed, "Throughput regressed: " + ", ".join(
+        f"{r['key']} {r['old_fps']:.2f} -> {r['new_fps']:.2f} fps" for r in regressed
+    )
@@ -0,0 +1,259 @@
+"""
+Shared command runner for the tests and the timing scripts.
+
+Commands are started with subprocess.Popen and their stdout/stderr are read
+by an asyncio event loop, so both streams are consumed as they are produced
+without a reader thread per pipe. Lines can be echoed live, handed to a
+callback (e.g. to parse ffmpeg -progress output) and are logged through one
+file handle in a single write once the command is done. ffmpeg's progress
+lines can be throttled in the echo and the log. Each command gets a timeout,
+is killed when the caller is cancelled, and its own resource usage (user and
+system CPU, max RSS) is collected with os.wait4(). Where there is a /proc,
+the resident set size of the command's process tree can also be sampled
+every rss_interval seconds while it runs; that is off by default (the test
+suite relies on wait4's max RSS) and turned on by benchmark.py.
+"""
+import asyncio
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# Serializes the log blocks of commands that run concurrently (see jobgraph).
+LOG_LOCK = threading.Lock()
+
+# Default seconds between RSS samples, 0 disables sampling.
+RSS_INTERVAL = float(os.environ.get("OCIOTEST_RSS_INTERVAL", "0"))
+_PAGE_KIB = os.sysconf("SC_PAGE_SIZE") // 1024 if hasattr(os, "sysconf") else 4
+
+# ffmpeg -stats lines ("frame=  120 fps= 45 ...") and -progress key=value lines.
+PROGRESS_RE = re.compile(
+    r"^\s*(frame=|fps=|stream_\d+_\d+_q=|bitrate=|total_size=|out_time|dup_frames=|drop_frames=|speed=|progress=)"
+)
+LINE_SPLIT_RE = re.compile(rb"\r\n|\r|\n")
+
+
+class CommandResult(subprocess.CompletedProcess):
+    """
+    CompletedProcess with the wall time and resource usage of the command.
+    rss_samples is the sampled RSS timeline, a list of (seconds, KiB).
+    """
+
+    def __init__(self, args, returncode, stdout, stderr, elapsed, cpu_user, cpu_sys, max_rss_kib, rss_samples=None):
+        super().__init__(args, returncode, stdout, stderr)
+        self.elapsed = elapsed
+        self.cpu_user = cpu_user
+        self.cpu_sys = cpu_sys
+        self.max_rss_kib = max_rss_kib
+        self.rss_samples = rss_samples or []
+
+    @property
+    def sampled_peak_rss_kib(self):
+        """Peak of the sampled RSS of the whole process tree (e.g. both sides of a shell pipe)."""
+        return max((kib for _, kib in self.rss_samples), default=None)
+
+
+def command_string(cmd):
+    return cmd if isinstance(cmd, str) else subprocess.list2cmdline(cmd)
+
+
+class _StreamState:
+    """Line splitting, throttling and capture for one of the command's pipes."""
+
+    def __init__(self, name, lines, echo, log, progress_interval, on_line):
+        self.name = name
+        self.lines = lines
+        self.echo = echo
+        self.log = log
+        self.progress_interval = progress_interval
+        self.on_line = on_line
+        self.captured = bytearray()
+        self.pending = b""
+        self.last_progress = None
+        self.held_progress = {}
+
+    def feed(self, data):
+        self.captured += data
+        if not self.lines:
+            return
+        parts = LINE_SPLIT_RE.split(self.pending + data)
+        self.pending = parts.pop()
+        for part in parts:
+            self._line(part.decode(errors="replace"))
+
+    def close(self):
+        if self.lines and self.pending:
+            self._line(self.pending.decode(errors="replace"))
+        self.pending = b""
+        # Always keep the final progress state.
+        for line in self.held_progress.values():
+            self._emit(line)
+        self.held_progress = {}
+
+    def _line(self, line):
+        if self.on_line:
+            self.on_line(self.name, line)
+        if self.progress_interval is not None and PROGRESS_RE.match(line):
+            now = time.monotonic()
+            if self.last_progress is not None and now - self.last_progress < self.progress_interval:
+                # Only the latest value of each progress key is kept until the next emit.
+                self.held_progress[line.split("=", 1)[0].strip()] = line
+                return
+            self.last_progress = now
+            self.held_progress.pop(line.split("=", 1)[0].strip(), None)
+        self._emit(line)
+
+    def _emit(self, line):
+        if self.echo:
+            print(line, file=sys.stderr)
+        self.log.append(f"{self.name.upper()}: {line}\n")
+
+
+def tree_rss_kib(pid):
+    """
+    Total resident set size of a process and its descendants, from /proc.
+    Only the tree is read (through each thread's children file), not every
+    process on the machine.
+    """
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            tasks = os.listdir(f"/proc/{pid}/task")
+        except OSError:
+            continue
+        # fields[0] is the state, so rss (pages) is fields[21].
+        total += int(fields[21]) * _PAGE_KIB
+        for tid in tasks:
+            try:
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+            except OSError:
+                continue
+    return total
+
+
+def downsample_rss(samples, points=200):
+    """At most points samples of an RSS timeline, keeping the peak of each bucket."""
+    if len(samples) <= points:
+        return list(samples)
+    size = -(-len(samples) // points)
+    return [max(samples[i:i + size], key=lambda s: s[1]) for i in range(0, len(samples), size)]
+
+
+async def _sample_rss(pid, samples, start, interval):
+    while True:
+        kib = tree_rss_kib(pid)
+        if kib:
+            samples.append((round(time.perf_counter() - start, 3), kib))
+        await asyncio.sleep(interval)
+
+
+def _kill(popen):
+    """Kill the command and anything it started (shell commands run in their own process group)."""
+    try:
+        os.killpg(popen.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def _pump(loop, pipe, state):
+    reader = asyncio.StreamReader(limit=2 ** 20)
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    try:
+        while True:
+            data = await reader.read(2 ** 16)
+            if not data:
+                break
+            state.feed(data)
+    finally:
+        transport.close()
+        state.close()
+
+
+async def run_async(cmd, log_file=None, timeout=None, echo=False, log_stdout=True, stdout_lines=True,
+                    progress_interval=None, on_line=None, check=True, env=None, cwd=None, rss_interval=None):
+    """
+    Run cmd (a shell string or an argument list) and return a CommandResult
+    with stdout/stderr as bytes. With stdout_lines=False stdout is captured
+    as raw bytes only (e.g. rawvideo), without line handling. rss_interval
+    (default RSS_INTERVAL) is the seconds between RSS samples, 0 for none.
+    """
+    loop = asyncio.get_running_loop()
+    cmd_str = command_string(cmd)
+    msg = f"Running command: {cmd_str}\n"
+    print(msg, file=sys.stderr)
+
+    log = []
+    stdout = _StreamState("stdout", stdout_lines, echo and stdout_lines, log, progress_interval, on_line)
+    stderr = _StreamState("stderr", True, echo, log, progress_interval, on_line)
+
+    start = time.perf_counter()
+    popen = subprocess.Popen(cmd, shell=isinstance(cmd, str), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             stdin=subprocess.DEVNULL, env=env, cwd=cwd, start_new_session=True)
+    # Reap the child ourselves so its rusage is per command rather than accumulated over all children.
+    waiter = loop.run_in_executor(None, os.wait4, popen.pid, 0)
+    pumps = asyncio.gather(_pump(loop, popen.stdout, stdout), _pump(loop, popen.stderr, stderr))
+    rss_samples = []
+    sampler = None
+    if rss_interval is None:
+        rss_interval = RSS_INTERVAL
+    if rss_interval > 0 and os.path.isdir("/proc"):
+        sampler = asyncio.ensure_future(_sample_rss(popen.pid, rss_samples, start, rss_interval))
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.shield(pumps), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        _kill(popen)
+        await pumps
+    except BaseException:
+        # Cancelled (or interrupted): don't leave the command running.
+        _kill(popen)
+        await asyncio.shield(waiter)
+        popen.returncode = -9
+        raise
+    finally:
+        if sampler:
+            sampler.cancel()
+    _, status, usage = await waiter
+    popen.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    max_rss_kib = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    result = CommandResult(
+        cmd, popen.returncode, bytes(stdout.captured), bytes(stderr.captured),
+        elapsed, usage.ru_utime, usage.ru_stime, max_rss_kib, rss_samples,
+    )
+
+    if log_file:
+        if not log_stdout:
+            log = [line for line in log if not line.startswith("STDOUT: ")]
+            log.insert(0, f"STDOUT: <{len(result.stdout)} bytes>\n")
+        block = (
+            msg + "".join(log)
+            + f"Return Code: {result.returncode} (wall {elapsed:.2f}s, user {result.cpu_user:.2f}s, "
+            f"sys {result.cpu_sys:.2f}s, max rss {max_rss_kib} KiB"
+            + (f", sampled peak {result.sampled_peak_rss_kib} KiB" if rss_samples else "")
+            + ")\n"
+        )
+        with LOG_LOCK, open(log_file, "a") as f:
+            f.write(block)
+
+    if timed_out:
+        raise subprocess.TimeoutExpired(cmd_str, timeout, result.stdout, result.stderr)
+    if check:
+        assert result.returncode == 0, f"Command failed: {cmd_str}\n{result.stderr.decode(errors='replace')}"
+    return result
+
+
+def run(cmd, log_file=None, **kwargs):
+    """Blocking wrapper around run_async(), safe to call from several threads at once."""
+    return asyncio.run(run_async(cmd, log_file, **kwargs))
@@ -0,0 +1,207 @@
+import os
+import tempfile
+
+import pytest
+
+import batchrender
+import benchmark
+import depmanifest
+import jobgraph
+import ocioref
+import ocioworker
+import refcache
+import results
+import resultsdb
+import workunits
+
+# Case ordering, --smoke and --abort-after.
+pytest_plugins = ["ociosched"]
+
+# CPUs one test case keeps busy when it runs its oiiotool and ffmpeg jobs side by side,
+# used to size the pytest-xdist worker pool for "-n auto".
+CASE_CPUS = int(os.environ.get("OCIOTEST_CASE_CPUS", "4"))
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("ociotest")
+    group.addoption(
+        "--refresh-references",
+        action="store_true",
+        default=False,
+        help="Ignore cached oiiotool reference renders and regenerate them.",
+    )
+    group.addoption(
+        "--psnr-crosscheck",
+        action="store_true",
+        default=False,
+        help="Also run FFmpeg's psnr filter and check it agrees with the in-process comparison.",
+    )
+    group.addoption(
+        "--in-memory",
+        action="store_true",
+        default=False,
+        help="Read ffmpeg output from a pipe and write references to tmpfs, only saving renders on failure.",
+    )
+    group.addoption(
+        "--no-batch",
+        action="store_true",
+        default=False,
+        help="Render every case on its own instead of batching renders that share an input.",
+    )
+    group.addoption(
+        "--update-baseline",
+        action="store_true",
+        default=False,
+        help="Store the benchmark results as the new performance baseline instead of comparing.",
+    )
+    group.addoption(
+        "--changed-only",
+        action="store_true",
+        default=False,
+        help="Skip cases whose binaries, media, configs, LUTs and parameters are unchanged since they last passed.",
+    )
+    group.addoption(
+        "--ocio-worker",
+        action="store_true",
+        default=False,
+        help="Render references in a persistent PyOpenColorIO/OpenImageIO worker instead of starting oiiotool per case.",
+    )
+    group.addoption(
+        "--reference",
+        choices=["oiiotool", "ocioref"],
+        default=None,
+        help="Render the references of every case with this backend, overriding the matrix (ocioref: in-process PyOpenColorIO).",
+    )
+    group.addoption(
+        "--ocio-optimization",
+        choices=sorted(ocioref.OPTIMIZATIONS),
+        default=None,
+        help="OCIO optimization level of the ocioref reference processors (default: OCIO's default).",
+    )
+    group.addoption(
+        "--shard",
+        default=None,
+        metavar="I/N",
+        help="Only run the I-th of N deterministic shards of the test matrix (1-based).",
+    )
+
+
+def pytest_configure(config):
+    refcache.REFRESH = config.getoption("--refresh-references")
+    benchmark.UPDATE_BASELINE = config.getoption("--update-baseline")
+    batchrender.ENABLED = not config.getoption("--no-batch")
+    if config.getoption("--psnr-crosscheck"):
+        os.environ["OCIOTEST_PSNR_CROSSCHECK"] = "1"
+    if config.getoption("--in-memory"):
+        os.environ["OCIOTEST_IN_MEMORY"] = "1"
+    if config.getoption("--reference"):
+        os.environ["OCIOTEST_REFERENCE"] = config.getoption("--reference")
+    if config.getoption("--ocio-optimization"):
+        ocioref.OPTIMIZATION = config.getoption("--ocio-optimization")
+
+    workerinput = getattr(config, "workerinput", None)
+    if workerinput is None:
+        # Controller (or a plain single process run): start a fresh run id before workers are spawned.
+        os.environ.pop("OCIOTEST_RUN_ID", None)
+        results.run_id()
+        if config.getoption("--ocio-worker") and not ocioworker.SOCKET:
+            start_ocio_worker(config)
+    elif "OCIOTEST_CPU_BUDGET" not in os.environ:
+        # Split the machine between the workers so concurrent ffmpeg jobs don't oversubscribe it.
+        jobgraph.CPU_BUDGET = max(1, (os.cpu_count() or 1) // workerinput["workercount"])
+
+
+def start_ocio_worker(config):
+    """Start the reference worker for this session; the xdist workers find it through the environment."""
+    os.makedirs(results.OUTPUT_DIR, exist_ok=True)
+    log_file = os.path.join(results.OUTPUT_DIR, "ocioworker.log")
+    # Unix socket paths are limited to ~100 characters, so not under the output directory.
+    socket_path = os.path.join(tempfile.gettempdir(), f"ocioworker-{results.run_id()}.sock")
+    config._ocio_worker = ocioworker.start(socket_path, log_file)
+    if config._ocio_worker is None:
+        print(f"--ocio-worker: the worker did not start (see {log_file}), references use oiiotool", file=os.sys.stderr)
+        return
+    os.environ["OCIOTEST_WORKER_SOCKET"] = socket_path
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_auto_num_workers(config):
+    return max(1, (os.cpu_count() or 1) // CASE_CPUS)
+
+
+def pytest_collection_modifyitems(config, items):
+    select_shard(config, items)
+    track_dependencies(config, items)
+
+
+def select_shard(config, items):
+    shard = config.getoption("--shard")
+    if not shard:
+        return
+    index, count = (int(v) for v in shard.split("/"))
+    if not 1 <= index <= count:
+        raise pytest.UsageError(f"--shard {shard}: expected I/N with 1 <= I <= N")
+    # Round robin over the sorted node ids so every CI node agrees on the split.
+    order = {nodeid: i for i, nodeid in enumerate(sorted(item.nodeid for item in items))}
+    selected = [item for item in items if order[item.nodeid] % count == index - 1]
+    deselected = [item for item in items if order[item.nodeid] % count != index - 1]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def track_dependencies(config, items):
+    """
+    Attach the dependency hashes of every parametrized case to its reports,
+    so the controller can write them to the manifest, and with
+    --changed-only skip the cases that are unchanged since they last passed.
+    """
+    manifest = depmanifest.load()
+    files = manifest["files"]
+    code_files = {}
+    code = depmanifest.code_hash(str(config.rootpath), files, code_files)
+    changed_only = config.getoption("--changed-only")
+    skipped = 0
+    for item in items:
+        if not hasattr(item, "callspec"):
+            continue
+        used = dict(code_files)
+        ffmpeg_bin = getattr(item.module, "FFMPEG_BIN", "ffmpeg")
+        deps = depmanifest.case_deps(item.callspec.params, files, ffmpeg_bin, code, used)
+        item.user_properties.append(("ocio_deps", deps))
+        item.user_properties.append(("ocio_files", used))
+        item.user_properties.append(("ffmpeg_bin", ffmpeg_bin))
+        if changed_only and depmanifest.unchanged(manifest, item.nodeid, deps):
+            item.add_marker(pytest.mark.skip(reason="unchanged since it last passed (--changed-only)"))
+            skipped += 1
+    if changed_only:
+        print(f"--changed-only: {skipped} of {len(items)} cases unchanged since they last passed", file=os.sys.stderr)
+
+
+def pytest_runtest_logreport(report):
+    if os.environ.get("PYTEST_XDIST_WORKER"):
+        return
+    depmanifest.record_report(report)
+    resultsdb.record_report(report)
+
+
+def pytest_sessionfinish(session):
+    if hasattr(session.config, "workerinput"):
+        return
+    if getattr(session.config, "_ocio_worker", None):
+        ocioworker.stop(session.config._ocio_worker)
+    depmanifest.update()
+    # Every case has linked the shared renders it used into its own directory.
+    workunits.cleanup()
+    merged = results.collect()
+    session.config._ocio_results = merged
+    if merged:
+        results.write_summary(merged, os.path.join(results.OUTPUT_DIR, "psnr_summary.json"))
+    resultsdb.store_session(merged, results.collect_commands())
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    merged = getattr(config, "_ocio_results", None)
+    if merged:
+        terminalreporter.section("PSNR summary")
+        terminalreporter.write_line(results.format_table(merged))
@@ -0,0 +1,175 @@
+"""
+Dependency manifest for incremental (--changed-only) runs.
+
+At the end of every run the manifest (output/manifest.json) records, per
+test id, a hash of everything the case depends on and whether it passed:
+
+- the ffmpeg and oiiotool binaries,
+- every file named in the case's parameters (input media and all frames of
+  a '#' sequence, OCIO configs, LUTs), with the files an OCIO config pulls
+  in resolved through its search_path (see refcache.config_files). Media
+  generated by mediagen isn't hashed: it is written when the case runs, and
+  its path already hashes its parameters (mediagen.py is in the code hash),
+- the case's parameters themselves and the repository's Python modules,
+- how its reference is rendered: the effective backend (after --reference),
+  --ocio-worker, --ocio-optimization, --in-memory and the PyOpenColorIO
+  version.
+
+With --changed-only a case is skipped when all of those hash the same as
+when it last passed. File hashes are memoized on (size, mtime) in the
+manifest, so an unchanged tree costs one stat() per file.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import mediagen
+import ocioref
+import ocioworker
+import refcache
+import results
+
+MANIFEST = os.environ.get("OCIOTEST_MANIFEST", os.path.join(results.OUTPUT_DIR, "manifest.json"))
+
+# nodeid -> {"deps": ..., "files": ..., "ran": bool, "passed": bool} for this session.
+_OUTCOMES = {}
+
+# Paths inside option strings, e.g. ocio=config=path.ocio:input=...
+_TOKEN_SPLIT = re.compile(r"[\s\"'=:,]+")
+
+
+def load(path=None):
+    path = path or MANIFEST
+    if not os.path.exists(path):
+        return {"files": {}, "cases": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(manifest, path=None):
+    path = path or MANIFEST
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def file_hash(path, files, used=None):
+    """
+    sha256 of a file, reusing its entry in the files memo (updated in place)
+    while its size and mtime match. The entry is also copied to used.
+    """
+    path = os.path.abspath(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    entry = files.get(path)
+    if not (entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns):
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": refcache.file_digest(path)}
+        files[path] = entry
+    if used is not None:
+        used[path] = entry
+    return entry["sha256"]
+
+
+def binary_hash(binary, files, used=None):
+    return file_hash(shutil.which(binary) or binary, files, used)
+
+
+def _strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _strings(item)
+
+
+def referenced_files(params):
+    """The files a case's parameters name, with '#' sequences expanded and OCIO configs followed."""
+    found = []
+    for value in params.values():
+        for text in _strings(value):
+            for token in [text] + _TOKEN_SPLIT.split(text):
+                if "#" in token:
+                    found.extend(sorted(glob.glob(token.replace("#", "[0-9]" * 5))))
+                elif token and os.path.isfile(token):
+                    found.append(token)
+    for path in list(found):
+        if path.endswith(".ocio"):
+            found.extend(refcache.config_files(path))
+    generated = os.path.abspath(mediagen.MEDIA_DIR) + os.sep
+    return sorted({path for path in found if not os.path.abspath(path).startswith(generated)})
+
+
+def code_hash(rootdir, files, used=None):
+    """Hash of the repository's Python modules (the tests and their helpers)."""
+    h = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(rootdir, "*.py"))):
+        h.update(f"{os.path.basename(path)}:{file_hash(path, files, used)}\n".encode())
+    return h.hexdigest()
+
+
+def render_settings(params):
+    """The settings outside a case's parameters that change how its reference is rendered."""
+    return {
+        # As ociotest.reference_backend(): --reference overrides the matrix.
+        "reference": os.environ.get("OCIOTEST_REFERENCE") or params.get("reference") or "oiiotool",
+        "ocio_worker": ocioworker.active(),
+        "ocio_optimization": ocioref.OPTIMIZATION,
+        "in_memory": bool(os.environ.get("OCIOTEST_IN_MEMORY")),
+        "PyOpenColorIO": ocioref.version(),
+    }
+
+
+def case_deps(params, files, ffmpeg_bin, code="", used=None):
+    """The dependency hashes of one case (name -> hash), given its parameters and the code_hash()."""
+    deps = {
+        "ffmpeg": binary_hash(ffmpeg_bin, files, used),
+        "oiiotool": binary_hash(refcache.OIIOTOOL_BIN, files, used),
+        "code": code,
+        "params": hashlib.sha256(json.dumps(params, sort_keys=True, default=repr).encode()).hexdigest(),
+        "env:OCIO": os.environ.get("OCIO", ""),
+    }
+    for name, value in render_settings(params).items():
+        deps[f"render:{name}"] = value
+    for path in referenced_files(params):
+        deps[f"file:{path}"] = file_hash(path, files, used) if os.path.isfile(path) else "unresolved"
+    return deps
+
+
+def unchanged(manifest, nodeid, deps):
+    """True when the case passed last time it ran, with the same dependencies."""
+    entry = manifest["cases"].get(nodeid)
+    return bool(entry and entry["passed"] and entry["deps"] == deps)
+
+
+def record_report(report):
+    """Track the outcome of every case that carries its dependencies (see conftest)."""
+    props = dict(report.user_properties)
+    if "ocio_deps" not in props:
+        return
+    outcome = _OUTCOMES.setdefault(
+        report.nodeid, {"deps": props["ocio_deps"], "files": props.get("ocio_files", {}), "ran": False, "passed": True}
+    )
+    if report.when == "call":
+        outcome["ran"] = True
+    if report.failed or (report.when == "call" and report.skipped):
+        outcome["passed"] = False
+
+
+def update(path=None):
+    """Merge this session's outcomes into the manifest. Cases that didn't run keep their entry."""
+    if not _OUTCOMES:
+        return
+    manifest = load(path)
+    for nodeid, outcome in _OUTCOMES.items():
+        manifest["files"].update(outcome["files"])
+        if outcome["ran"]:
+            manifest["cases"][nodeid] = {"deps": outcome["deps"], "passed": outcome["passed"]}
+    save(manifest, path)
+    _OUTCOMES.clear()
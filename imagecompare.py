@@ -0,0 +1,365 @@
+"""
+Vectorized image comparison used in place of the ffmpeg psnr filter.
+
+For failing comparisons, write_error_map() localizes the error: per tile
+and channel statistics (a heatmap PNG and the worst tiles as JSON) and the
+error binned by the input image's code values, which points straight at
+LUT interpolation or shaper precision problems in a range of input levels.
+
+precision_curve() is the exhaustive version of the latter for an integer
+input: the maximum error for every single input code value, meant for a
+mediagen code-ramp that holds each code value once.
+"""
+import json
+import math
+
+import numpy as np
+
+import mediagen
+
+# Histogram bucket edges for the absolute error, in code values for integer
+# images and in normalized units for float images.
+CODE_ERROR_EDGES = [0, 0.5, 1.5, 2.5, 4.5, 8.5, 16.5, 32.5, 64.5, math.inf]
+FLOAT_ERROR_EDGES = [0, 1e-9, 1e-8, 1e-7, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, math.inf]
+
+TILE_SIZE = 64
+WORST_TILES = 10
+# Input levels the error is binned by, e.g. every code of a 10-bit input.
+CODE_BINS = 1024
+# PSNR range the heatmap spans, from black (and identical tiles) to white.
+HEATMAP_PSNR = (100.0, 20.0)
+
+
+def psnr_from_mse(mse):
+    """PSNR for normalized data, identical images give inf rather than a divide by zero."""
+    if mse == 0:
+        return math.inf
+    return 10.0 * math.log10(1.0 / mse)
+
+
+def normalized(image):
+    """Return the pixels of an imagereaders.Image as float64 in the 0-1 range."""
+    pixels = image.pixels.astype(np.float64)
+    if image.maxval != 1.0:
+        pixels /= image.maxval
+    return pixels
+
+
+def abs_difference(reference, test):
+    """The normalized absolute difference of two imagereaders.Image as a (height, width, channels) array."""
+    a = normalized(reference)
+    b = normalized(test)
+    assert a.shape[:2] == b.shape[:2], (
+        f"Image sizes differ: {a.shape[1]}x{a.shape[0]} vs {b.shape[1]}x{b.shape[0]}"
+    )
+    # Only compare the channels both images have (e.g. an RGB reference against an RGBA render).
+    nchannels = min(a.shape[2], b.shape[2])
+    diff = a[:, :, :nchannels]
+    diff -= b[:, :, :nchannels]
+    np.abs(diff, out=diff)
+    return diff
+
+
+def compare_images(reference, test):
+    """
+    Compare two imagereaders.Image objects channel by channel.
+
+    Returns a dict with the average PSNR/MSE (the same figures the ffmpeg
+    psnr filter reports as average/mse_avg), the per channel MSE, PSNR and
+    maximum absolute error, and an error histogram per channel.
+    """
+    diff = abs_difference(reference, test)
+    nchannels = diff.shape[2]
+
+    flat = diff.reshape(-1, nchannels)
+    mse = np.einsum("ij,ij->j", flat, flat) / flat.shape[0]
+    max_error = flat.max(axis=0)
+
+    if reference.maxval == 1.0 and test.maxval == 1.0:
+        edges = FLOAT_ERROR_EDGES
+        scale = 1.0
+    else:
+        edges = CODE_ERROR_EDGES
+        scale = max(reference.maxval, test.maxval)
+    histograms = [np.histogram(flat[:, c] * scale, bins=edges)[0].tolist() for c in range(nchannels)]
+
+    mse_avg = float(mse.mean())
+    return {
+        "psnr": psnr_from_mse(mse_avg),
+        "mse": mse_avg,
+        "identical": mse_avg == 0,
+        "width": diff.shape[1],
+        "height": diff.shape[0],
+        "channels": [
+            {
+                "mse": float(mse[c]),
+                "psnr": psnr_from_mse(float(mse[c])),
+                "max_abs_error": float(max_error[c]),
+                "max_abs_error_codes": float(max_error[c]) * scale,
+                "histogram": histograms[c],
+            }
+            for c in range(nchannels)
+        ],
+        "histogram_edges": edges,
+        "code_scale": scale,
+    }
+
+
+def format_report(stats):
+    """Human readable per channel summary of a compare_images result."""
+    lines = [f"Average PSNR: {stats['psnr']:.4f} dB (mse {stats['mse']:.6g})"]
+    edges = stats["histogram_edges"]
+    labels = [f"<{edges[i + 1]:g}" for i in range(len(edges) - 2)] + [f">={edges[-2]:g}"]
+    for c, channel in enumerate(stats["channels"]):
+        codes = f" ({channel['max_abs_error_codes']:.3f} codes)" if stats["code_scale"] != 1.0 else ""
+        lines.append(
+            f"  channel {c}: psnr {channel['psnr']:.4f} dB, mse {channel['mse']:.6g}, "
+            f"max abs error {channel['max_abs_error']:.6g}{codes}"
+        )
+        counts = ", ".join(f"{label}:{count}" for label, count in zip(labels, channel["histogram"]) if count)
+        lines.append(f"    error histogram {counts}")
+    return "\n".join(lines) + "\n"
+
+
+def _code_scale(reference, test):
+    return 1.0 if reference.maxval == 1.0 and test.maxval == 1.0 else max(reference.maxval, test.maxval)
+
+
+def _block_reduce(a, tile, reduce):
+    """
+    reduce(blocks) of every tile x tile block of a (height, width, channels)
+    array, where blocks is a (rows, tile, cols, tile, channels) reshaped view
+    of a and reduce collapses axes 1 and 3. The edge tiles on the right and
+    bottom may be smaller; they are reduced as separate views.
+    """
+    height, width, channels = a.shape
+    full_y, full_x = height // tile * tile, width // tile * tile
+    out = np.empty((-(-height // tile), -(-width // tile), channels))
+    for y0, y1 in ((0, full_y), (full_y, height)):
+        for x0, x1 in ((0, full_x), (full_x, width)):
+            if y1 == y0 or x1 == x0:
+                continue
+            ty, tx = min(tile, y1 - y0), min(tile, x1 - x0)
+            blocks = a[y0:y1, x0:x1].reshape((y1 - y0) // ty, ty, (x1 - x0) // tx, tx, channels)
+            out[y0 // tile:-(-y1 // tile), x0 // tile:-(-x1 // tile)] = reduce(blocks)
+    return out
+
+
+def tile_errors(reference, test, tile=TILE_SIZE):
+    """
+    Per tile, per channel error statistics of two imagereaders.Image:
+    (rows, cols, channels) arrays of the MSE, mean and maximum absolute
+    error, computed on views of the difference image without copying it.
+    """
+    diff = abs_difference(reference, test)
+    height, width = diff.shape[:2]
+    ys = np.minimum(np.arange(0, height, tile) + tile, height) - np.arange(0, height, tile)
+    xs = np.minimum(np.arange(0, width, tile) + tile, width) - np.arange(0, width, tile)
+    pixels = (ys[:, None] * xs[None, :])[:, :, None]
+    return {
+        "tile": tile,
+        "width": width,
+        "height": height,
+        "code_scale": _code_scale(reference, test),
+        "mse": _block_reduce(diff, tile, lambda b: np.einsum("aybxc,aybxc->abc", b, b)) / pixels,
+        "mean_abs_error": _block_reduce(diff, tile, lambda b: b.sum(axis=(1, 3))) / pixels,
+        "max_abs_error": _block_reduce(diff, tile, lambda b: b.max(axis=(1, 3))),
+    }
+
+
+def worst_tiles(tiles, count=WORST_TILES):
+    """The count tiles with the highest MSE (averaged over the channels), worst first."""
+    tile = tiles["tile"]
+    mse = tiles["mse"].mean(axis=2)
+    order = np.argsort(mse, axis=None)[::-1][:count]
+    worst = []
+    for row, col in zip(*np.unravel_index(order, mse.shape)):
+        if mse[row, col] == 0:
+            break
+        worst.append({
+            "x": int(col) * tile,
+            "y": int(row) * tile,
+            "width": min(tile, tiles["width"] - int(col) * tile),
+            "height": min(tile, tiles["height"] - int(row) * tile),
+            "psnr": psnr_from_mse(float(mse[row, col])),
+            "channels": [
+                {
+                    "mse": float(tiles["mse"][row, col, c]),
+                    "mean_abs_error": float(tiles["mean_abs_error"][row, col, c]),
+                    "max_abs_error_codes": float(tiles["max_abs_error"][row, col, c]) * tiles["code_scale"],
+                }
+                for c in range(tiles["mse"].shape[2])
+            ],
+        })
+    return worst
+
+
+def input_levels(image, bins=CODE_BINS):
+    """
+    The input level bin of every pixel and channel of an imagereaders.Image:
+    its code value for integer images with up to bins levels, the code value
+    scaled down to bins levels for deeper ones, and 0-1 split into bins for
+    float images. Returns (levels array, input code values per bin).
+    """
+    if image.maxval == 1.0:
+        levels = np.rint(np.clip(image.pixels, 0.0, 1.0) * (bins - 1)).astype(np.intp)
+        return levels, 1.0 / (bins - 1)
+    codes = int(image.maxval) + 1
+    if codes <= bins:
+        return image.pixels.astype(np.intp), 1.0
+    return (image.pixels.astype(np.intp) * bins) // codes, codes / bins
+
+
+def code_value_errors(input_image, reference, test, bins=CODE_BINS):
+    """
+    The error of every channel binned by the input image's level in the same
+    channel: pixel count, mean and maximum absolute error (in output code
+    values) per input level. Only levels present in the input are listed.
+    """
+    diff = abs_difference(reference, test) * _code_scale(reference, test)
+    levels, step = input_levels(input_image, bins)
+    channels = []
+    for c in range(min(diff.shape[2], levels.shape[2])):
+        index = levels[:, :, c].ravel()
+        error = diff[:, :, c].ravel()
+        count = np.bincount(index)
+        total = np.bincount(index, weights=error, minlength=len(count))
+        peak = np.zeros(len(count))
+        np.maximum.at(peak, index, error)
+        present = np.nonzero(count)[0]
+        channels.append({
+            "level": present.tolist(),
+            "count": count[present].tolist(),
+            "mean_abs_error_codes": (total[present] / count[present]).tolist(),
+            "max_abs_error_codes": peak[present].tolist(),
+        })
+    return {"input_maxval": input_image.maxval, "level_step": step, "channels": channels}
+
+
+def precision_curve(input_image, reference, test):
+    """
+    The maximum absolute error (in output code values) of every code value
+    of an integer input image, per channel: a (levels, channels) array
+    indexed by the input code value, NaN for codes the input doesn't hold.
+    """
+    assert input_image.maxval != 1.0, "A precision curve needs an integer input image"
+    diff = abs_difference(reference, test) * _code_scale(reference, test)
+    nchannels = min(diff.shape[2], input_image.pixels.shape[2])
+    codes = input_image.pixels[:, :, :nchannels].reshape(-1, nchannels).astype(np.intp)
+    errors = diff[:, :, :nchannels].reshape(-1, nchannels)
+    levels = int(input_image.maxval) + 1
+    curve = np.full((levels, nchannels), -np.inf)
+    for c in range(nchannels):
+        np.maximum.at(curve[:, c], codes[:, c], errors[:, c])
+    curve[np.isneginf(curve)] = np.nan
+    return curve
+
+
+def summarize_precision(curve, count=WORST_TILES):
+    """Per channel maximum, mean, worst codes and error histogram (CODE_ERROR_EDGES) of a precision_curve()."""
+    channels = []
+    for c in range(curve.shape[1]):
+        errors = curve[:, c]
+        present = ~np.isnan(errors)
+        values = errors[present]
+        worst = np.argsort(np.where(present, errors, -np.inf))[::-1][:count]
+        channels.append({
+            "codes": int(present.sum()),
+            "max_abs_error_codes": float(values.max()) if len(values) else 0.0,
+            "mean_abs_error_codes": float(values.mean()) if len(values) else 0.0,
+            "worst_codes": [[int(code), float(errors[code])] for code in worst if present[code] and errors[code] > 0],
+            "histogram": np.histogram(values, bins=CODE_ERROR_EDGES)[0].tolist(),
+        })
+    return {
+        "levels": curve.shape[0],
+        "max_abs_error_codes": max((ch["max_abs_error_codes"] for ch in channels), default=0.0),
+        "histogram_edges": CODE_ERROR_EDGES,
+        "channels": channels,
+    }
+
+
+def write_precision_curve(curve, prefix):
+    """Write prefix.npy (the curve as float32) and prefix.json (summarize_precision()). Returns the summary."""
+    summary = dict(summarize_precision(curve), curve=f"{prefix}.npy")
+    np.save(f"{prefix}.npy", curve.astype(np.float32))
+    with open(f"{prefix}.json", "w") as f:
+        json.dump(summary, f, indent=1, default=str)
+    return summary
+
+
+def format_precision(summary, count=5):
+    """Short summary of a precision curve: the error per channel and its worst input codes."""
+    edges = summary["histogram_edges"]
+    labels = [f"<{edges[i + 1]:g}" for i in range(len(edges) - 2)] + [f">={edges[-2]:g}"]
+    lines = [f"Precision sweep over {summary['levels']} input codes: max abs error "
+             f"{summary['max_abs_error_codes']:.3g} codes"]
+    for c, channel in enumerate(summary["channels"]):
+        lines.append(
+            f"  channel {c}: {channel['codes']} codes, max {channel['max_abs_error_codes']:.3g}, "
+            f"mean {channel['mean_abs_error_codes']:.3g} codes"
+        )
+        counts = ", ".join(f"{label}:{n}" for label, n in zip(labels, channel["histogram"]) if n)
+        lines.append(f"    codes per error {counts}")
+        worst = ", ".join(f"{code}:{error:.3g}" for code, error in channel["worst_codes"][:count])
+        if worst:
+            lines.append(f"    worst input codes (code:max error codes) {worst}")
+    return "\n".join(lines) + "\n"
+
+
+def heatmap(tiles, cell=None):
+    """
+    RGB float image of the per tile PSNR (worst channel), black at
+    HEATMAP_PSNR[0] dB or above through red and yellow to white at
+    HEATMAP_PSNR[1] dB, each tile drawn as a cell x cell block.
+    """
+    mse = tiles["mse"].max(axis=2)
+    with np.errstate(divide="ignore"):
+        psnr = np.where(mse > 0, -10.0 * np.log10(np.where(mse > 0, mse, 1.0)), np.inf)
+    high, low = HEATMAP_PSNR
+    t = np.clip((high - psnr) / (high - low), 0.0, 1.0)
+    rgb = np.stack([np.clip(3 * t, 0, 1), np.clip(3 * t - 1, 0, 1), np.clip(3 * t - 2, 0, 1)], axis=-1)
+    if cell is None:
+        cell = max(1, min(16, 1024 // max(mse.shape)))
+    return np.repeat(np.repeat(rgb, cell, axis=0), cell, axis=1)
+
+
+def write_error_map(reference, test, prefix, input_image=None, tile=TILE_SIZE):
+    """
+    Write prefix.png (heatmap()) and prefix.json (the worst tiles and, given
+    the input image, code_value_errors()). Returns the JSON report.
+    """
+    tiles = tile_errors(reference, test, tile)
+    report = {
+        "tile": tile,
+        "rows": tiles["mse"].shape[0],
+        "cols": tiles["mse"].shape[1],
+        "heatmap": f"{prefix}.png",
+        "heatmap_psnr_range": HEATMAP_PSNR,
+        "worst_tiles": worst_tiles(tiles),
+    }
+    if input_image is not None and input_image.pixels.shape[:2] == reference.pixels.shape[:2]:
+        report["code_values"] = code_value_errors(input_image, reference, test)
+    mediagen.write_png(f"{prefix}.png", heatmap(tiles), 8)
+    with open(f"{prefix}.json", "w") as f:
+        json.dump(report, f, indent=1, default=lambda v: v.tolist() if hasattr(v, "tolist") else str(v))
+    return report
+
+
+def format_error_map(report, count=5):
+    """Short summary of a write_error_map() report: the worst tiles and input levels."""
+    lines = [f"Error map: {report['heatmap']} ({report['cols']}x{report['rows']} tiles of {report['tile']}px)"]
+    for tile in report["worst_tiles"][:count]:
+        codes = "/".join(f"{c['max_abs_error_codes']:.3g}" for c in tile["channels"])
+        lines.append(
+            f"  tile at {tile['x']},{tile['y']}: psnr {tile['psnr']:.2f} dB, max abs error {codes} codes"
+        )
+    for c, channel in enumerate(report.get("code_values", {}).get("channels", [])):
+        peak = np.asarray(channel["max_abs_error_codes"])
+        if not len(peak):
+            continue
+        worst = np.argsort(peak)[::-1][:count]
+        step = report["code_values"]["level_step"]
+        levels = ", ".join(f"{channel['level'][i] * step:g}:{peak[i]:.3g}" for i in worst if peak[i] > 0)
+        if levels:
+            lines.append(f"  channel {c} worst input levels (level:max error codes) {levels}")
+    return "\n".join(lines) + "\n"
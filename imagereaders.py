@@ -0,0 +1,408 @@
+"""
+Minimal NumPy decoders for the image types the test suite writes.
+
+TIFF (none/deflate/packbits, strips), OpenEXR (scanline none/rle/zips/zip),
+DPX (8/10/12/16-bit filled) and Y4M (4:4:4 and mono) are decoded in-process.
+Anything else, e.g. the libx265 mp4 outputs, falls back to a single ffmpeg
+rawvideo decode.
+"""
+import collections
+import json
+import mmap
+import os
+import struct
+import subprocess
+import zlib
+
+import numpy as np
+
+# pixels is a (height, width, channels) array in the file's native sample type,
+# maxval is the code value that represents 1.0 (1.0 for float data).
+Image = collections.namedtuple("Image", "pixels maxval")
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+# ffmpeg rawvideo layouts we can wrap directly: (planar, channels, dtype, bits)
+# bits is None for float formats. Planar gbr formats are stored G, B, R.
+PIX_FMTS = {
+    "gray": (False, 1, "u1", 8),
+    "gray10le": (False, 1, "<u2", 10),
+    "gray12le": (False, 1, "<u2", 12),
+    "gray16le": (False, 1, "<u2", 16),
+    "rgb24": (False, 3, "u1", 8),
+    "rgba": (False, 4, "u1", 8),
+    "rgb48le": (False, 3, "<u2", 16),
+    "rgba64le": (False, 4, "<u2", 16),
+    "gbrp": (True, 3, "u1", 8),
+    "gbrp10le": (True, 3, "<u2", 10),
+    "gbrp12le": (True, 3, "<u2", 12),
+    "gbrp16le": (True, 3, "<u2", 16),
+    "gbrap": (True, 4, "u1", 8),
+    "gbrap10le": (True, 4, "<u2", 10),
+    "gbrap12le": (True, 4, "<u2", 12),
+    "gbrap16le": (True, 4, "<u2", 16),
+    "gbrpf16le": (True, 3, "<f2", None),
+    "gbrapf16le": (True, 4, "<f2", None),
+    "gbrpf32le": (True, 3, "<f4", None),
+    "gbrapf32le": (True, 4, "<f4", None),
+    "yuv444p": (True, 3, "u1", 8),
+    "yuv444p10le": (True, 3, "<u2", 10),
+    "yuv444p12le": (True, 3, "<u2", 12),
+    "yuv444p16le": (True, 3, "<u2", 16),
+    "yuva444p": (True, 4, "u1", 8),
+    "yuva444p10le": (True, 4, "<u2", 10),
+    "yuva444p16le": (True, 4, "<u2", 16),
+}
+
+
+def rawvideo_pix_fmt(format):
+    """The rawvideo pixel format matching an ocio filter format= value."""
+    name = {"rgba24": "rgba", "rgba64": "rgba64le"}.get(format, format)
+    if name not in PIX_FMTS and f"{name}le" in PIX_FMTS:
+        name = f"{name}le"
+    return name
+
+
+def frame_bytes(width, height, pix_fmt):
+    _, channels, dtype, _ = PIX_FMTS[pix_fmt]
+    return width * height * channels * np.dtype(dtype).itemsize
+
+
+def frame_from_buffer(buf, width, height, pix_fmt):
+    """Wrap one rawvideo frame as an Image without copying the sample data."""
+    planar, channels, dtype, bits = PIX_FMTS[pix_fmt]
+    data = np.frombuffer(buf, dtype=dtype, count=width * height * channels)
+    if planar:
+        pixels = data.reshape(channels, height, width).transpose(1, 2, 0)
+        if pix_fmt.startswith("gbr"):
+            order = [2, 0, 1, 3][:channels]
+            pixels = pixels[:, :, order]
+    else:
+        pixels = data.reshape(height, width, channels)
+    return Image(pixels, 1.0 if bits is None else float((1 << bits) - 1))
+
+
+def read_image(path, ffmpeg_bin="ffmpeg"):
+    """Decode the first image/frame of path."""
+    with open(path, "rb") as f:
+        buf = f.read()
+    try:
+        return decode_image(buf, os.path.splitext(path)[1])
+    except UnsupportedImage:
+        return decode_with_ffmpeg(path, ffmpeg_bin)
+
+
+def map_image(path, ffmpeg_bin="ffmpeg"):
+    """
+    Decode the first image of path through a read-only memory map, so the
+    pixels of uncompressed files are NumPy views of the mapping rather than copies.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return decode_image(mapped, os.path.splitext(path)[1])
+    except UnsupportedImage:
+        return decode_with_ffmpeg(path, ffmpeg_bin)
+
+
+def decode_image(buf, ext=""):
+    magic = bytes(buf[:4])
+    if magic in (b"II*\x00", b"MM\x00*"):
+        return decode_tiff(buf)
+    if magic == b"\x76\x2f\x31\x01":
+        return decode_exr(buf)
+    if magic in (b"SDPX", b"XPDS"):
+        return decode_dpx(buf)
+    if magic == b"YUV4":
+        return decode_y4m(buf)
+    raise UnsupportedImage(f"No native decoder for '{ext}' files")
+
+
+def decode_with_ffmpeg(path, ffmpeg_bin="ffmpeg"):
+    """Decode the first frame through ffmpeg rawvideo, keeping the native pixel format when possible."""
+    ffprobe_bin = os.path.join(os.path.dirname(ffmpeg_bin), "ffprobe")
+    probe = subprocess.run(
+        [ffprobe_bin, "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height,pix_fmt", "-of", "json", path],
+        capture_output=True, text=True, check=True,
+    )
+    stream = json.loads(probe.stdout)["streams"][0]
+    width, height, pix_fmt = stream["width"], stream["height"], stream["pix_fmt"]
+
+    if pix_fmt not in PIX_FMTS:
+        alpha = any(s in pix_fmt for s in ("rgba", "bgra", "argb", "abgr", "gbrap", "yuva", "ya"))
+        if "f16" in pix_fmt or "f32" in pix_fmt:
+            pix_fmt = "gbrapf32le" if alpha else "gbrpf32le"
+        elif pix_fmt.startswith("yuv"):
+            pix_fmt = "yuva444p16le" if alpha else "yuv444p16le"
+        else:
+            pix_fmt = "rgba64le" if alpha else "rgb48le"
+
+    result = subprocess.run(
+        [ffmpeg_bin, "-v", "error", "-i", path, "-frames:v", "1",
+         "-f", "rawvideo", "-pix_fmt", pix_fmt, "-"],
+        capture_output=True, check=True,
+    )
+    return frame_from_buffer(result.stdout, width, height, pix_fmt)
+
+
+# ---------------------------------------------------------------------------
+# TIFF
+
+_TIFF_TYPES = {1: "B", 2: "c", 3: "H", 4: "I", 5: "II", 6: "b", 8: "h", 9: "i", 11: "f", 12: "d", 16: "Q"}
+
+
+def _unpackbits(data):
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        count = data[i]
+        i += 1
+        if count < 128:
+            out += data[i:i + count + 1]
+            i += count + 1
+        elif count > 128:
+            out += data[i:i + 1] * (257 - count)
+            i += 1
+    return bytes(out)
+
+
+def decode_tiff(buf):
+    endian = "<" if bytes(buf[:2]) == b"II" else ">"
+    (ifd_offset,) = struct.unpack_from(f"{endian}I", buf, 4)
+    (count,) = struct.unpack_from(f"{endian}H", buf, ifd_offset)
+    tags = {}
+    for i in range(count):
+        tag, typ, n, value_offset = struct.unpack_from(f"{endian}HHI4s", buf, ifd_offset + 2 + i * 12)
+        fmt = _TIFF_TYPES.get(typ)
+        if fmt is None:
+            continue
+        size = struct.calcsize(f"{endian}{fmt}") * n
+        raw = value_offset if size <= 4 else bytes(buf[struct.unpack(f"{endian}I", value_offset)[0]:][:size])
+        tags[tag] = struct.unpack_from(f"{endian}{n * fmt}", raw)
+
+    width = tags[256][0]
+    height = tags[257][0]
+    bits = tags.get(258, (1,))[0]
+    compression = tags.get(259, (1,))[0]
+    spp = tags.get(277, (1,))[0]
+    planar_config = tags.get(284, (1,))[0]
+    predictor = tags.get(317, (1,))[0]
+    sample_format = tags.get(339, (1,))[0]
+    if 322 in tags or 273 not in tags:
+        raise UnsupportedImage("Tiled TIFF")
+    if planar_config != 1:
+        raise UnsupportedImage("Planar TIFF")
+    if compression not in (1, 8, 32946, 32773):
+        raise UnsupportedImage(f"TIFF compression {compression}")
+
+    kind = {1: "u", 2: "i", 3: "f"}[sample_format]
+    dtype = np.dtype(f"{endian}{kind}{bits // 8}")
+    row_bytes = width * spp * dtype.itemsize
+
+    offsets, counts = tags[273], tags[279]
+    if compression == 1 and all(o + n == following for o, n, following in zip(offsets, counts, offsets[1:])):
+        # Uncompressed contiguous strips can be wrapped in place.
+        raw = memoryview(buf)[offsets[0]:offsets[0] + row_bytes * height]
+    else:
+        strips = []
+        for offset, nbytes in zip(offsets, counts):
+            data = bytes(buf[offset:offset + nbytes])
+            if compression in (8, 32946):
+                data = zlib.decompress(data)
+            elif compression == 32773:
+                data = _unpackbits(data)
+            strips.append(data)
+        raw = b"".join(strips)[:row_bytes * height]
+
+    if predictor == 3:
+        # Floating point predictor: bytes are differenced along the row and
+        # stored as byte planes, most significant byte first.
+        rows = np.frombuffer(raw, np.uint8).reshape(height, row_bytes)
+        rows = np.cumsum(rows, axis=1, dtype=np.uint8)
+        planes = rows.reshape(height, dtype.itemsize, width * spp)
+        data = planes.transpose(0, 2, 1)[:, :, ::-1].copy().view(dtype.newbyteorder("<"))
+        pixels = data.reshape(height, width, spp)
+    else:
+        pixels = np.frombuffer(raw, dtype).reshape(height, width, spp)
+        if predictor == 2:
+            pixels = np.cumsum(pixels, axis=1, dtype=dtype)
+
+    maxval = 1.0 if kind == "f" else float((1 << bits) - 1)
+    return Image(pixels, maxval)
+
+
+# ---------------------------------------------------------------------------
+# OpenEXR
+
+_EXR_LINES_PER_BLOCK = {0: 1, 1: 1, 2: 1, 3: 16}
+_EXR_DTYPES = {0: np.dtype("<u4"), 1: np.dtype("<f2"), 2: np.dtype("<f4")}
+
+
+def _exr_unrle(data):
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        count = struct.unpack_from("b", data, i)[0]
+        i += 1
+        if count < 0:
+            out += data[i:i - count]
+            i -= count
+        else:
+            out += data[i:i + 1] * (count + 1)
+            i += 1
+    return bytes(out)
+
+
+def _exr_unpredict(data):
+    t = np.frombuffer(data, np.uint8).astype(np.int64)
+    t[1:] -= 128
+    t = (np.cumsum(t) & 0xFF).astype(np.uint8)
+    out = np.empty_like(t)
+    half = (len(t) + 1) // 2
+    out[0::2] = t[:half]
+    out[1::2] = t[half:]
+    return out.tobytes()
+
+
+def decode_exr(buf):
+    (version,) = struct.unpack_from("<I", buf, 4)
+    if version & 0x1200:
+        raise UnsupportedImage("Tiled or multi-part EXR")
+
+    pos = 8
+    channels = []
+    compression = None
+    data_window = None
+    while buf[pos] != 0:
+        end = bytes(buf[pos:pos + 256]).index(b"\x00")
+        name = bytes(buf[pos:pos + end]).decode()
+        pos += end + 1
+        end = bytes(buf[pos:pos + 256]).index(b"\x00")
+        pos += end + 1
+        (size,) = struct.unpack_from("<i", buf, pos)
+        pos += 4
+        value = bytes(buf[pos:pos + size])
+        pos += size
+        if name == "channels":
+            cpos = 0
+            while value[cpos] != 0:
+                end = value.index(b"\x00", cpos)
+                cname = value[cpos:end].decode()
+                (ptype,) = struct.unpack_from("<i", value, end + 1)
+                channels.append((cname, _EXR_DTYPES[ptype]))
+                cpos = end + 1 + 16
+        elif name == "compression":
+            compression = value[0]
+        elif name == "dataWindow":
+            data_window = struct.unpack("<4i", value)
+    pos += 1
+
+    if compression not in _EXR_LINES_PER_BLOCK:
+        raise UnsupportedImage(f"EXR compression {compression}")
+
+    xmin, ymin, xmax, ymax = data_window
+    width = xmax - xmin + 1
+    height = ymax - ymin + 1
+    lines = _EXR_LINES_PER_BLOCK[compression]
+    nblocks = (height + lines - 1) // lines
+    offsets = struct.unpack_from(f"<{nblocks}Q", buf, pos)
+
+    planes = {name: np.empty((height, width), dtype) for name, dtype in channels}
+    line_bytes = sum(width * dtype.itemsize for _, dtype in channels)
+    for offset in offsets:
+        y, size = struct.unpack_from("<ii", buf, offset)
+        y -= ymin
+        nlines = min(lines, height - y)
+        data = bytes(buf[offset + 8:offset + 8 + size])
+        if size < nlines * line_bytes:
+            if compression == 1:
+                data = _exr_unpredict(_exr_unrle(data))
+            else:
+                data = _exr_unpredict(zlib.decompress(data))
+        pos = 0
+        for line in range(nlines):
+            for name, dtype in channels:
+                nbytes = width * dtype.itemsize
+                planes[name][y + line] = np.frombuffer(data, dtype, width, pos)
+                pos += nbytes
+
+    # Channels are stored alphabetically, present them as R, G, B, A.
+    order = [c for c in ("R", "G", "B", "A", "Y") if c in planes]
+    order += sorted(c for c in planes if c not in order)
+    pixels = np.stack([planes[c] for c in order], axis=-1)
+    return Image(pixels, 1.0)
+
+
+# ---------------------------------------------------------------------------
+# DPX
+
+_DPX_CHANNELS = {6: 1, 50: 3, 51: 4}
+
+
+def decode_dpx(buf):
+    endian = ">" if bytes(buf[:4]) == b"SDPX" else "<"
+    (offset,) = struct.unpack_from(f"{endian}I", buf, 4)
+    width, height = struct.unpack_from(f"{endian}II", buf, 772)
+    descriptor = buf[800]
+    bits = buf[803]
+    packing, encoding = struct.unpack_from(f"{endian}HH", buf, 804)
+    if descriptor not in _DPX_CHANNELS or encoding != 0:
+        raise UnsupportedImage(f"DPX descriptor {descriptor} encoding {encoding}")
+    channels = _DPX_CHANNELS[descriptor]
+    samples = width * channels
+
+    if bits == 8:
+        row_words = (samples + 3) // 4
+        rows = np.frombuffer(buf, np.uint8, row_words * 4 * height, offset).reshape(height, -1)
+        pixels = rows[:, :samples]
+    elif bits == 16:
+        row_words = (samples + 1) // 2
+        rows = np.frombuffer(buf, f"{endian}u2", row_words * 2 * height, offset).reshape(height, -1)
+        pixels = rows[:, :samples]
+    elif bits == 12 and packing in (1, 2):
+        row_words = (samples + 1) // 2
+        rows = np.frombuffer(buf, f"{endian}u2", row_words * 2 * height, offset).reshape(height, -1)
+        pixels = rows[:, :samples] >> 4 if packing == 1 else rows[:, :samples] & 0xFFF
+    elif bits == 10 and packing in (1, 2):
+        row_words = (samples + 2) // 3
+        words = np.frombuffer(buf, f"{endian}u4", row_words * height, offset).reshape(height, row_words)
+        shifts = (22, 12, 2) if packing == 1 else (20, 10, 0)
+        unpacked = np.stack([(words >> s) & 0x3FF for s in shifts], axis=-1)
+        pixels = unpacked.reshape(height, -1)[:, :samples].astype(np.uint16)
+    else:
+        raise UnsupportedImage(f"DPX {bits}-bit packing {packing}")
+
+    return Image(pixels.reshape(height, width, channels), float((1 << bits) - 1))
+
+
+# ---------------------------------------------------------------------------
+# Y4M
+
+_Y4M_COLORSPACES = {
+    "mono": "gray",
+    "mono16": "gray16le",
+    "444": "yuv444p",
+    "444p10": "yuv444p10le",
+    "444p12": "yuv444p12le",
+    "444p16": "yuv444p16le",
+    "444alpha": "yuva444p",
+}
+
+
+def decode_y4m(buf):
+    end = bytes(buf[:256]).index(b"\n")
+    tokens = bytes(buf[:end]).decode().split()[1:]
+    params = {t[0]: t[1:] for t in tokens}
+    width = int(params["W"])
+    height = int(params["H"])
+    colorspace = params.get("C", "420jpeg")
+    if colorspace not in _Y4M_COLORSPACES:
+        raise UnsupportedImage(f"Y4M colorspace {colorspace}")
+    frame_start = bytes(buf[end + 1:end + 257]).index(b"\n") + end + 2
+    return frame_from_buffer(memoryview(buf)[frame_start:], width, height, _Y4M_COLORSPACES[colorspace])
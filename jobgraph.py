@@ -0,0 +1,97 @@
+"""
+Tiny dependency-aware job executor.
+
+Each test case is a handful of commands (oiiotool reference, ffmpeg render,
+optional re-encode of the reference) that are mostly independent until the
+final comparison. run_jobs() starts every job whose dependencies are done,
+as long as the CPUs the running jobs claim fit in the CPU budget.
+"""
+import concurrent.futures
+import os
+import time
+
+CPU_BUDGET = int(os.environ.get("OCIOTEST_CPU_BUDGET", "0")) or os.cpu_count() or 1
+
+
+class Job:
+    """
+    A named callable with the names of the jobs it depends on and the number
+    of CPUs it is expected to keep busy (e.g. ffmpeg's threads).
+    """
+
+    def __init__(self, name, func, deps=(), cpus=1):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.cpus = cpus
+        self.result = None
+        self.elapsed = None
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.result = self.func()
+        finally:
+            self.elapsed = time.perf_counter() - start
+        return self.result
+
+
+def run_jobs(jobs, cpu_budget=None, log_file=None):
+    """
+    Run jobs respecting their dependencies and the CPU budget, returns a dict
+    of job name to wall time in seconds. The first failure stops any job that
+    has not started yet and is re-raised once the running jobs have finished.
+    """
+    if cpu_budget is None:
+        cpu_budget = CPU_BUDGET
+    by_name = {job.name: job for job in jobs}
+    for job in jobs:
+        missing = [dep for dep in job.deps if dep not in by_name]
+        assert not missing, f"Job '{job.name}' depends on unknown jobs {missing}"
+
+    pending = list(jobs)
+    done = set()
+    running = {}
+    error = None
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs) or 1) as pool:
+        while pending or running:
+            if error is None:
+                used = sum(min(job.cpus, cpu_budget) for job in running.values())
+                for job in list(pending):
+                    if not all(dep in done for dep in job.deps):
+                        continue
+                    cpus = min(job.cpus, cpu_budget)
+                    # Always let one job run, even if it alone exceeds the budget.
+                    if running and used + cpus > cpu_budget:
+                        continue
+                    pending.remove(job)
+                    running[pool.submit(job._run)] = job
+                    used += cpus
+            if not running:
+                assert error is not None or not pending, (
+                    f"Unresolvable job dependencies: {[job.name for job in pending]}"
+                )
+                break
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    error = error or exc
+                else:
+                    done.add(job.name)
+    wall = time.perf_counter() - start
+
+    timings = {job.name: job.elapsed for job in jobs if job.elapsed is not None}
+    summary = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in timings.items())
+    msg = f"Job timings: {summary} (wall {wall:.2f}s, cpu budget {cpu_budget})\n"
+    print(msg, file=os.sys.stderr)
+    if log_file:
+        with open(log_file, "a") as f:
+            f.write(msg)
+
+    if error is not None:
+        raise error
+    return timings
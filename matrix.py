@@ -0,0 +1,197 @@
+"""
+Loader for the declarative test matrix in matrix.yaml.
+
+Every suite in the spec (one per test function in ociotest.py) expands to a
+list of flat case dicts: explicit cases are taken as they are, "matrix"
+entries are expanded over the cartesian product of their axes, and the
+named inputs, transforms and encodings are resolved into the fields the
+tests take as parameters (input_file, ocio_config, display, ...). Inputs
+with a "generate" entry only resolve to their path in mediagen's cache
+here; the media is synthesized by generate_input() when a case using it
+runs, so collecting or deselecting cases never writes any.
+"""
+import itertools
+import os
+import sys
+import warnings
+
+import pytest
+import yaml
+
+import mediagen
+
+MATRIX_FILE = os.environ.get("OCIOTEST_MATRIX", os.path.join(os.path.dirname(os.path.abspath(__file__)), "matrix.yaml"))
+
+AXES = ("input", "transform", "format", "encoding", "outputext")
+
+# oiiotool -d data type for the ocio filter's format= values (without the le suffix).
+OIIO_FORMATS = {
+    "rgb24": "uint8",
+    "rgba24": "uint8",
+    "rgba": "uint8",
+    "rgb48": "uint16",
+    "rgba64": "uint16",
+    "gbrp10": "uint10",
+    "gbrp12": "uint12",
+    "gbrp16": "uint16",
+    "gbrpf16": "half",
+    "gbrapf16": "half",
+    "gbrpf32": "float",
+    "gbrapf32": "float",
+}
+
+_SPEC = None
+# Path of every generated input -> its mediagen parameters, filled by _resolve().
+GENERATED = {}
+
+
+def oiio_format(format):
+    """The oiiotool -d data type matching an ocio filter format= value, e.g. gbrpf16le -> half."""
+    name = format[:-2] if format.endswith(("le", "be")) else format
+    return OIIO_FORMATS.get(name, "uint8")
+
+
+def load(path=None):
+    """The parsed spec, read once per process."""
+    global _SPEC
+    if path:
+        with open(path) as f:
+            return yaml.safe_load(f)
+    if _SPEC is None:
+        with open(MATRIX_FILE) as f:
+            _SPEC = yaml.safe_load(f)
+    return _SPEC
+
+
+def _expand(entry):
+    """The cases of one entry of a suite's case list."""
+    if "matrix" not in entry:
+        return [dict(entry)]
+    axes = entry["matrix"]
+    unknown = set(axes) - set(AXES)
+    assert not unknown, f"Unknown matrix axes {sorted(unknown)}, expected some of {AXES}"
+    fixed = {k: v for k, v in entry.items() if k not in ("matrix", "name", "exclude")}
+    cases = []
+    for values in itertools.product(*axes.values()):
+        case = dict(fixed, **dict(zip(axes, values)))
+        if any(all(case.get(k) == v for k, v in rule.items()) for rule in entry.get("exclude", [])):
+            continue
+        case["testname"] = entry["name"].format(**case)
+        cases.append(case)
+    return cases
+
+
+def _min_psnr(suite, case):
+    if "min_psnr" in case:
+        return float(case["min_psnr"])
+    matched = [
+        rules[case[axis]]
+        for axis, rules in suite.get("thresholds", {}).items()
+        if case.get(axis) in rules
+    ]
+    if matched:
+        return float(min(matched))
+    assert "min_psnr" in suite, f"No min_psnr for case {case['testname']}"
+    return float(suite["min_psnr"])
+
+
+def _resolve(spec, suite, case):
+    """Replace the named references of a case by the fields the tests use."""
+    resolved = {
+        "outputext": suite.get("outputext"),
+        "reference": suite.get("reference", "oiiotool"),
+        "max_code_error": suite.get("max_code_error"),
+    }
+
+    if "input" in case:
+        source = spec["inputs"][case["input"]]
+        if "generate" in source:
+            path = mediagen.media_path(**source["generate"])
+            GENERATED[path] = source["generate"]
+        elif "env" in source:
+            path = os.environ.get(source["env"], source["file"])
+        else:
+            path = source["file"]
+        resolved.update(input_file=path, source=path, input_space=source.get("colorspace"))
+        resolved.update({k: source[k] for k in ("first", "last") if k in source})
+
+    if "transform" in case:
+        transform = spec["transforms"][case["transform"]]
+        resolved["ocio_config"] = spec["configs"].get(transform["config"], transform["config"])
+        if "input" in transform:
+            resolved["input_space"] = transform["input"]
+        resolved.update(
+            output_space=transform.get("output"),
+            display=transform.get("display"),
+            view=transform.get("view"),
+        )
+
+    if "encoding" in case:
+        encoding = spec["encodings"][case["encoding"]]
+        resolved.update(
+            out_format=encoding["out_format"],
+            compression=encoding.get("compression", ""),
+            yuvoutputext=encoding["ext"],
+        )
+
+    resolved.update({k: v for k, v in case.items() if k not in ("input", "transform", "encoding")})
+    resolved["min_psnr"] = _min_psnr(suite, case)
+    return resolved
+
+
+def generate_input(path):
+    """Synthesize path if it is a generated input that doesn't exist yet (see mediagen.generate)."""
+    if path in GENERATED:
+        mediagen.generate(**GENERATED[path])
+
+
+def cases(suite_name, spec=None):
+    """
+    The expanded, resolved cases of a suite. Exact duplicates are dropped
+    with a warning; two different cases with the same testname are an error.
+    """
+    spec = spec or load()
+    suite = spec["suites"][suite_name]
+    expanded = []
+    by_name = {}
+    for entry in suite["cases"]:
+        for case in _expand(entry):
+            resolved = _resolve(spec, suite, case)
+            name = resolved["testname"]
+            if name in by_name:
+                assert by_name[name] == resolved, f"{suite_name}: two different cases named {name}"
+                warnings.warn(f"{suite_name}: dropping duplicate case {name}")
+                continue
+            by_name[name] = resolved
+            expanded.append(resolved)
+    return expanded
+
+
+def params(suite_name, argnames):
+    """pytest.param()s for @pytest.mark.parametrize(argnames, ...), with the testname as id."""
+    names = [name.strip() for name in argnames.split(",")]
+    result = []
+    for case in cases(suite_name):
+        missing = [name for name in names if name not in case]
+        assert not missing, f"{suite_name}/{case['testname']}: no value for {missing}"
+        result.append(pytest.param(*(case[name] for name in names), id=case["testname"]))
+    return result
+
+
+def parametrize(suite_name, argnames):
+    """@pytest.mark.parametrize(argnames, ...) over the cases of a suite."""
+    return pytest.mark.parametrize(argnames, params(suite_name, argnames))
+
+
+def main():
+    """List the expanded cases of every suite (or the suites given as arguments)."""
+    spec = load()
+    for suite_name in sys.argv[1:] or spec["suites"]:
+        print(suite_name)
+        for case in cases(suite_name, spec):
+            print(f"  {case['testname']:<32} min_psnr {case['min_psnr']:<6} {case.get('format', '')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
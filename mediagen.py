@@ -0,0 +1,368 @@
+"""
+Deterministic synthetic test media at any resolution and length.
+
+Writes EXR (half/float), DPX (10/12/16-bit) and PNG (8/16-bit) stills and
+sequences in pure NumPy, so the bytes only depend on the parameters and not
+on the ffmpeg or OpenImageIO build. Patterns:
+
+    gradient   R ramps left to right, G top to bottom, B along the diagonal
+    hdr-ramp   exposure ramps from 2^-8 up to peak (beyond 1.0), in grey,
+               red, green and blue bands
+    noise      seeded uniform noise in 0-1
+    chips      chip chart: grey steps, primaries and secondaries at two
+               levels and a row of over-range greys
+    mixed      the four above in quadrants
+    code-ramp  every pixel its own level: pixel k (in raster order) is
+               k / (width * height - 1) in R, reversed in G and in a
+               scrambled order in B. At width * height = 2^depth every
+               code value of an integer depth appears once per channel
+               (see code_ramp_size)
+
+Integer formats clip at 1.0. In a sequence the pattern moves FRAME_STEP
+pixels per frame (noise is reseeded) so frames differ like real footage.
+
+Media is written once to MEDIA_DIR/<name>-<hash of the parameters>/ and
+reused from then on:
+
+    python mediagen.py --pattern hdr-ramp --size 3840x2160 --format exr --depth half
+    python mediagen.py --pattern mixed --size 7680x4320 --frames 48
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+MEDIA_DIR = os.environ.get("OCIOTEST_MEDIA_DIR", "./generatedmedia")
+
+# Bump when a pattern or writer changes, so cached media is regenerated.
+GENERATOR_VERSION = 1
+
+FIRST_FRAME = 1
+FRAME_STEP = 8
+
+# Supported depths per format, the first one is the default.
+FORMATS = {
+    "exr": ("half", "float"),
+    "dpx": (10, 12, 16),
+    "png": (16, 8),
+}
+
+
+def _ramp(n):
+    return (np.arange(n, dtype=np.float32) / max(n - 1, 1))
+
+
+def gradient(width, height, frame=0, peak=16.0, seed=0):
+    u = _ramp(width)[None, :]
+    v = _ramp(height)[:, None]
+    rgb = np.empty((height, width, 3), np.float32)
+    rgb[..., 0] = u
+    rgb[..., 1] = v
+    rgb[..., 2] = (u + v) * 0.5
+    return rgb
+
+
+def hdr_ramp(width, height, frame=0, peak=16.0, seed=0):
+    stops = -8.0 + _ramp(width) * (np.log2(peak) + 8.0)
+    values = np.exp2(stops).astype(np.float32)
+    tints = np.array([[1, 1, 1], [1, 0.2, 0.2], [0.2, 1, 0.2], [0.2, 0.2, 1]], np.float32)
+    band = np.minimum(np.arange(height) * len(tints) // max(height, 1), len(tints) - 1)
+    return values[None, :, None] * tints[band][:, None, :]
+
+
+def noise(width, height, frame=0, peak=16.0, seed=0):
+    return np.random.default_rng([seed, frame]).random((height, width, 3), dtype=np.float32)
+
+
+def chips(width, height, frame=0, peak=16.0, seed=0):
+    hues = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 1, 1], [1, 0, 1], [1, 1, 0]]
+    rows = [
+        [[g, g, g] for g in (0.0, 0.02, 0.09, 0.18, 0.45, 0.9)],
+        [[c * 0.18 for c in hue] for hue in hues],
+        [[c * 0.9 for c in hue] for hue in hues],
+        [[g, g, g] for g in (1.0, 1.5, 2.0, 4.0, 8.0, peak)],
+    ]
+    table = np.array(rows, np.float32)
+    nrows, ncols = table.shape[:2]
+    # Each chip is surrounded by a mid grey border of 1/8 of the cell.
+    y = np.arange(height) * nrows / height
+    x = np.arange(width) * ncols / width
+    inside = (np.abs(y % 1 - 0.5) < 0.375)[:, None] & (np.abs(x % 1 - 0.5) < 0.375)[None, :]
+    rgb = table[y.astype(int)[:, None], x.astype(int)[None, :]]
+    rgb[~inside] = 0.18
+    return rgb
+
+
+def code_ramp(width, height, frame=0, peak=16.0, seed=0):
+    levels = width * height
+    k = np.arange(levels, dtype=np.int64)
+    # An odd stride visits every level once when levels is a power of two.
+    stride = int(levels * 0.6180339887) | 1
+    codes = np.stack([k, levels - 1 - k, (k * stride) % levels], axis=-1)
+    return (codes / max(levels - 1, 1)).astype(np.float32).reshape(height, width, 3)
+
+
+def code_ramp_size(bits, width=256):
+    """Width and height of a code-ramp holding every code value of a bits deep integer format."""
+    levels = 1 << bits
+    width = min(width, levels)
+    return width, levels // width
+
+
+def mixed(width, height, frame=0, peak=16.0, seed=0):
+    w2, h2 = width // 2, height // 2
+    rgb = np.empty((height, width, 3), np.float32)
+    rgb[:h2, :w2] = gradient(w2, h2, frame, peak, seed)
+    rgb[:h2, w2:] = hdr_ramp(width - w2, h2, frame, peak, seed)
+    rgb[h2:, :w2] = chips(w2, height - h2, frame, peak, seed)
+    rgb[h2:, w2:] = noise(width - w2, height - h2, frame, peak, seed)
+    return rgb
+
+
+PATTERNS = {
+    "gradient": gradient,
+    "hdr-ramp": hdr_ramp,
+    "noise": noise,
+    "chips": chips,
+    "mixed": mixed,
+    "code-ramp": code_ramp,
+}
+
+
+def render(pattern, width, height, frame=0, peak=16.0, seed=0):
+    """One frame of a pattern as a (height, width, 3) float32 array."""
+    rgb = PATTERNS[pattern](width, height, frame, peak, seed)
+    if frame and pattern != "noise":
+        rgb = np.roll(rgb, frame * FRAME_STEP, axis=1)
+    return rgb
+
+
+def _quantize(rgb, bits):
+    return np.round(np.clip(rgb, 0.0, 1.0) * ((1 << bits) - 1)).astype(np.uint16)
+
+
+# ---------------------------------------------------------------------------
+# EXR
+
+_EXR_COMPRESSIONS = {"none": (0, 1), "zips": (2, 1), "zip": (3, 16)}
+
+
+def _exr_attr(name, type_name, value):
+    return name.encode() + b"\0" + type_name.encode() + b"\0" + struct.pack("<i", len(value)) + value
+
+
+def _exr_predict(data):
+    """The reverse of imagereaders._exr_unpredict: split odd/even bytes, then delta encode."""
+    t = np.frombuffer(data, np.uint8)
+    t = np.concatenate([t[0::2], t[1::2]])
+    d = np.empty_like(t)
+    d[0] = t[0]
+    d[1:] = (t[1:].astype(np.int16) - t[:-1] + 128) & 0xFF
+    return d.tobytes()
+
+
+def write_exr(path, rgb, depth="half", compression="zip"):
+    """Scanline RGB EXR, half or float."""
+    height, width = rgb.shape[:2]
+    ptype, dtype = {"half": (1, "<f2"), "float": (2, "<f4")}[depth]
+    code, lines = _EXR_COMPRESSIONS[compression]
+
+    chlist = b"".join(
+        name.encode() + b"\0" + struct.pack("<iB3xii", ptype, 0, 1, 1) for name in "BGR"
+    ) + b"\0"
+    header = b"".join([
+        b"\x76\x2f\x31\x01", struct.pack("<I", 2),
+        _exr_attr("channels", "chlist", chlist),
+        _exr_attr("compression", "compression", bytes([code])),
+        _exr_attr("dataWindow", "box2i", struct.pack("<4i", 0, 0, width - 1, height - 1)),
+        _exr_attr("displayWindow", "box2i", struct.pack("<4i", 0, 0, width - 1, height - 1)),
+        _exr_attr("lineOrder", "lineOrder", b"\0"),
+        _exr_attr("pixelAspectRatio", "float", struct.pack("<f", 1.0)),
+        _exr_attr("screenWindowCenter", "v2f", struct.pack("<2f", 0.0, 0.0)),
+        _exr_attr("screenWindowWidth", "float", struct.pack("<f", 1.0)),
+        b"\0",
+    ])
+
+    # Each scanline holds the channels in alphabetical order: B, G, R.
+    planes = np.ascontiguousarray(rgb[..., ::-1].transpose(0, 2, 1), dtype=dtype)
+    chunks = []
+    for y in range(0, height, lines):
+        data = planes[y:y + lines].tobytes()
+        if code:
+            packed = zlib.compress(_exr_predict(data), 4)
+            if len(packed) < len(data):
+                data = packed
+        chunks.append(struct.pack("<ii", y, len(data)) + data)
+
+    offset = len(header) + 8 * len(chunks)
+    table = []
+    for chunk in chunks:
+        table.append(offset)
+        offset += len(chunk)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(struct.pack(f"<{len(table)}Q", *table))
+        for chunk in chunks:
+            f.write(chunk)
+
+
+# ---------------------------------------------------------------------------
+# DPX
+
+def write_dpx(path, rgb, bits=10):
+    """Big endian RGB DPX: 10-bit (method A packed), 12-bit (method A filled) or 16-bit."""
+    height, width = rgb.shape[:2]
+    codes = _quantize(rgb, bits)
+    if bits == 10:
+        c = codes.astype(">u4")
+        data = ((c[..., 0] << 22) | (c[..., 1] << 12) | (c[..., 2] << 2)).astype(">u4")
+        packing = 1
+    else:
+        samples = codes.reshape(height, width * 3)
+        if samples.shape[1] % 2:
+            samples = np.pad(samples, ((0, 0), (0, 1)))
+        data = (samples << 4 if bits == 12 else samples).astype(">u2")
+        packing = 1 if bits == 12 else 0
+    data = data.tobytes()
+
+    # Fields that are not set stay 0xFF, which DPX defines as "undefined".
+    header = bytearray(b"\xff" * 2048)
+    header[0:768] = bytes(768)
+    struct.pack_into(">4sI8sIIIII", header, 0,
+                     b"SDPX", 2048, b"V2.0", 2048 + len(data), 1, 1664, 384, 0)
+    header[160:160 + 11] = b"mediagen.py"
+    struct.pack_into(">HHII", header, 768, 0, 1, width, height)
+    struct.pack_into(">IIfIfBBBBHHIII", header, 780,
+                     0, 0, 0.0, (1 << bits) - 1, 1.0, 50, 0, 0, bits, packing, 0, 2048, 0, 0)
+    header[820:852] = bytes(32)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(data)
+
+
+# ---------------------------------------------------------------------------
+# PNG
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def write_png(path, rgb, bits=16):
+    """RGB PNG, 8 or 16-bit, unfiltered."""
+    height, width = rgb.shape[:2]
+    codes = _quantize(rgb, bits).astype(">u2" if bits == 16 else "u1")
+    rows = codes.reshape(height, -1).view(np.uint8)
+    raw = np.concatenate([np.zeros((height, 1), np.uint8), rows], axis=1).tobytes()
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bits, 2, 0, 0, 0)))
+        f.write(_png_chunk(b"IDAT", zlib.compress(raw, 6)))
+        f.write(_png_chunk(b"IEND", b""))
+
+
+WRITERS = {"exr": write_exr, "dpx": write_dpx, "png": write_png}
+
+
+# ---------------------------------------------------------------------------
+
+def media_params(pattern="gradient", width=1920, height=1080, frames=1, format="exr", depth=None,
+                 peak=16.0, seed=0):
+    """The normalized parameters that identify a piece of generated media."""
+    assert pattern in PATTERNS, f"Unknown pattern {pattern}, expected one of {sorted(PATTERNS)}"
+    assert format in FORMATS, f"Unknown format {format}, expected one of {sorted(FORMATS)}"
+    depth = FORMATS[format][0] if depth is None else depth
+    if format != "exr":
+        depth = int(depth)
+    assert depth in FORMATS[format], f"{format} can't be written with depth {depth}"
+    return {
+        "pattern": pattern, "width": int(width), "height": int(height), "frames": int(frames),
+        "format": format, "depth": depth, "peak": float(peak), "seed": int(seed),
+    }
+
+
+def media_path(media_dir=None, **params):
+    """
+    Where media with these parameters lives: a file for a still, a '#'
+    pattern (5 digit frame numbers from FIRST_FRAME) for a sequence.
+    """
+    params = media_params(**params)
+    key = hashlib.sha256(json.dumps(dict(params, version=GENERATOR_VERSION), sort_keys=True).encode())
+    name = f"{params['pattern']}_{params['width']}x{params['height']}_{params['format']}{params['depth']}"
+    if params["frames"] > 1:
+        name += f"_{params['frames']}f"
+    directory = os.path.join(media_dir or MEDIA_DIR, f"{name}-{key.hexdigest()[:12]}")
+    frame = "#." if params["frames"] > 1 else ""
+    return os.path.join(directory, f"{params['pattern']}.{frame}{params['format']}")
+
+
+def generate(media_dir=None, **params):
+    """
+    Write the media (unless it already exists) and return media_path().
+    Frames are written to a private directory that is renamed into place
+    when complete, so concurrent processes never see a partial sequence.
+    An fcntl lock makes concurrent processes (pytest-xdist workers) asking
+    for the same media wait for the first one instead of all writing it.
+    """
+    path = media_path(media_dir, **params)
+    directory = os.path.dirname(path)
+    if os.path.isdir(directory):
+        return path
+
+    params = media_params(**params)
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    with open(f"{directory}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isdir(directory):
+            return path
+        tmp = f"{directory}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            writer = WRITERS[params["format"]]
+            for index in range(params["frames"]):
+                rgb = render(params["pattern"], params["width"], params["height"], index, params["peak"], params["seed"])
+                name = os.path.basename(path).replace("#", f"{FIRST_FRAME + index:05d}")
+                writer(os.path.join(tmp, name), rgb, params["depth"])
+            with open(os.path.join(tmp, "params.json"), "w") as f:
+                json.dump(dict(params, version=GENERATOR_VERSION), f, indent=2)
+            try:
+                os.rename(tmp, directory)
+            except OSError:
+                # Another process finished the same media first (one that doesn't take the lock).
+                if not os.path.isdir(directory):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic test media.")
+    parser.add_argument("--pattern", default="mixed", choices=sorted(PATTERNS))
+    parser.add_argument("--size", default="1920x1080", help="WIDTHxHEIGHT")
+    parser.add_argument("--frames", type=int, default=1, help="More than 1 writes a sequence")
+    parser.add_argument("--format", default="exr", choices=sorted(FORMATS))
+    parser.add_argument("--depth", default=None, help="half/float for exr, 10/12/16 for dpx, 8/16 for png")
+    parser.add_argument("--peak", type=float, default=16.0, help="Brightest value of the HDR patterns")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the noise pattern")
+    parser.add_argument("--media-dir", default=MEDIA_DIR)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    width, height = (int(v) for v in args.size.split("x"))
+    print(generate(args.media_dir, pattern=args.pattern, width=width, height=height, frames=args.frames,
+                   format=args.format, depth=args.depth, peak=args.peak, seed=args.seed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Round trips of the synthetic media writers (mediagen.py) through the native
+decoders (imagereaders.py), which every comparison of the matrix relies on.
+Needs neither ffmpeg nor oiiotool:
+
+    python -m pytest mediatest.py
+"""
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+import imagereaders
+import mediagen
+
+# Odd sizes exercise the DPX row padding and the partial last EXR block (16 lines for zip).
+SIZES = [(7, 5), (33, 17)]
+DEPTHS = [("exr", "half"), ("exr", "float"), ("dpx", 10), ("dpx", 12), ("dpx", 16), ("png", 8), ("png", 16)]
+
+
+def decode(path):
+    """
+    read_image() without its ffmpeg fallback, so a decoder that gives up
+    fails here. imagereaders has no PNG decoder (PNG goes through ffmpeg),
+    so mediagen's PNGs are checked with decode_png().
+    """
+    with open(path, "rb") as f:
+        buf = f.read()
+    if path.endswith(".png"):
+        return decode_png(buf)
+    return imagereaders.decode_image(buf, path)
+
+
+def decode_png(buf):
+    """Just enough PNG for mediagen.write_png: RGB, 8 or 16-bit, unfiltered rows."""
+    assert buf[:8] == b"\x89PNG\r\n\x1a\n"
+    pos, chunks = 8, {}
+    while pos < len(buf):
+        (length,) = struct.unpack_from(">I", buf, pos)
+        kind, data = buf[pos + 4:pos + 8], buf[pos + 8:pos + 8 + length]
+        (crc,) = struct.unpack_from(">I", buf, pos + 8 + length)
+        assert crc == zlib.crc32(kind + data), f"Bad CRC in the {kind} chunk"
+        chunks[kind] = chunks.get(kind, b"") + data
+        pos += length + 12
+    width, height, bits, color = struct.unpack_from(">IIBB", chunks[b"IHDR"])
+    assert color == 2
+    dtype = ">u2" if bits == 16 else "u1"
+    rows = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), np.uint8).reshape(height, -1)
+    assert not rows[:, 0].any(), "Filtered PNG rows"
+    pixels = rows[:, 1:].copy().view(dtype).reshape(height, width, 3)
+    return imagereaders.Image(pixels, float((1 << bits) - 1))
+
+
+def expected(rgb, format, depth):
+    """What the decoder should return for rgb written at depth: (pixels, maxval)."""
+    if format == "exr":
+        return rgb.astype(np.float16 if depth == "half" else np.float32), 1.0
+    return mediagen._quantize(rgb, depth), float((1 << depth) - 1)
+
+
+def assert_decodes_to(image, pixels, maxval):
+    assert image.maxval == maxval
+    assert image.pixels.shape == pixels.shape
+    np.testing.assert_array_equal(image.pixels, pixels)
+
+
+@pytest.mark.parametrize("size", SIZES, ids=lambda s: f"{s[0]}x{s[1]}")
+@pytest.mark.parametrize("format, depth", DEPTHS, ids=[f"{f}{d}" for f, d in DEPTHS])
+@pytest.mark.parametrize("pattern", sorted(mediagen.PATTERNS))
+def test_generate_round_trip(pattern, format, depth, size, tmp_path):
+    width, height = size
+    path = mediagen.generate(str(tmp_path), pattern=pattern, width=width, height=height, format=format, depth=depth)
+    rgb = mediagen.render(pattern, width, height)
+    assert_decodes_to(decode(path), *expected(rgb, format, depth))
+
+
+@pytest.mark.parametrize("format, depth", [("exr", "half"), ("dpx", 10)])
+def test_generate_sequence(format, depth, tmp_path):
+    path = mediagen.generate(str(tmp_path), pattern="mixed", width=33, height=17, frames=3, format=format, depth=depth)
+    for index in range(3):
+        frame = path.replace("#", f"{mediagen.FIRST_FRAME + index:05d}")
+        assert_decodes_to(decode(frame), *expected(mediagen.render("mixed", 33, 17, index), format, depth))
+
+
+@pytest.mark.parametrize("compression", sorted(mediagen._EXR_COMPRESSIONS))
+@pytest.mark.parametrize("depth", ["half", "float"])
+def test_exr_compressions(compression, depth, tmp_path):
+    rgb = mediagen.render("mixed", 33, 37, peak=64.0)
+    path = str(tmp_path / f"{compression}.exr")
+    mediagen.write_exr(path, rgb, depth, compression)
+    assert_decodes_to(decode(path), *expected(rgb, "exr", depth))
+
+
+def test_code_ramp_holds_every_code(tmp_path):
+    for bits in (10, 12, 16):
+        width, height = mediagen.code_ramp_size(bits)
+        path = mediagen.generate(str(tmp_path), pattern="code-ramp", width=width, height=height, format="dpx", depth=bits)
+        pixels = decode(path).pixels.reshape(-1, 3)
+        for c in range(3):
+            assert len(np.unique(pixels[:, c])) == 1 << bits
+
+
+# ---------------------------------------------------------------------------
+# TIFF and Y4M, which mediagen doesn't write: minimal files built here.
+
+def write_tiff(path, codes, bits, compression=1, predictor=1):
+    """Little endian single strip RGB TIFF of an integer (height, width, 3) array."""
+    height, width = codes.shape[:2]
+    samples = codes.astype("<u2" if bits == 16 else "u1")
+    if predictor == 2:
+        samples = np.diff(samples, axis=1, prepend=np.zeros_like(samples[:, :1]))
+    data = samples.tobytes()
+    if compression == 8:
+        data = zlib.compress(data)
+    entries = [
+        (256, 3, 1, width), (257, 3, 1, height), (258, 3, 1, bits), (259, 3, 1, compression),
+        (262, 3, 1, 2), (273, 4, 1, 8), (277, 3, 1, 3), (278, 3, 1, height),
+        (279, 4, 1, len(data)), (284, 3, 1, 1), (317, 3, 1, predictor),
+    ]
+    ifd = struct.pack("<H", len(entries))
+    for tag, typ, count, value in entries:
+        ifd += struct.pack("<HHI", tag, typ, count) + struct.pack("<HH" if typ == 3 else "<I", *((value, 0) if typ == 3 else (value,)))
+    ifd += struct.pack("<I", 0)
+    with open(path, "wb") as f:
+        f.write(b"II*\x00" + struct.pack("<I", 8 + len(data)) + data + ifd)
+
+
+@pytest.mark.parametrize("bits", [8, 16])
+@pytest.mark.parametrize("compression, predictor", [(1, 1), (8, 1), (8, 2)], ids=["none", "deflate", "deflate-predictor"])
+def test_tiff_decode(bits, compression, predictor, tmp_path):
+    codes = mediagen._quantize(mediagen.render("mixed", 33, 17), bits)
+    path = str(tmp_path / "image.tif")
+    write_tiff(path, codes, bits, compression, predictor)
+    assert_decodes_to(decode(path), codes, float((1 << bits) - 1))
+
+
+def test_y4m_decode(tmp_path):
+    width, height = 33, 17
+    planes = mediagen._quantize(mediagen.render("noise", width, height), 10).transpose(2, 0, 1)
+    path = str(tmp_path / "image.y4m")
+    with open(path, "wb") as f:
+        f.write(f"YUV4MPEG2 W{width} H{height} F24:1 Ip A1:1 C444p10\nFRAME\n".encode())
+        f.write(planes.astype("<u2").tobytes())
+    image = decode(path)
+    assert image.maxval == 1023.0
+    np.testing.assert_array_equal(image.pixels, planes.transpose(1, 2, 0))
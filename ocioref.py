@@ -0,0 +1,200 @@
+"""
+In-process reference renders with PyOpenColorIO.
+
+Instead of an oiiotool render written to disk and read back, the input is
+decoded with imagereaders and the OCIO CPU processor is applied to the NumPy
+buffer directly. The transform comes from the same oiiotool arguments as the
+oiiotool reference (see ocioworker.parse_oiio_args). The buffer is split into
+bands of rows that are processed on a thread pool; OCIO releases the GIL
+while it applies a processor.
+
+The processor runs at a bit depth, by default the one of the case's -d data
+type, which is what the ffmpeg ocio filter's format= maps to (see
+matrix.OIIO_FORMATS). The input is quantized to that depth first, as ffmpeg
+does. bitdepth="float" processes in float and only quantizes the result,
+like oiiotool. The optimization level is one of OPTIMIZATIONS.
+
+Cases select this backend with "reference: ocioref" in matrix.yaml, or all
+cases with --reference=ocioref.
+"""
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import cmdrunner
+import imagereaders
+import ocioworker
+
+try:
+    import PyOpenColorIO as OCIO
+except ImportError:
+    OCIO = None
+
+THREADS = int(os.environ.get("OCIOTEST_OCIOREF_THREADS", "0")) or os.cpu_count() or 1
+TILE_ROWS = 64
+OPTIMIZATION = "default"
+
+OPTIMIZATIONS = {
+    "none": "OPTIMIZATION_NONE",
+    "lossless": "OPTIMIZATION_LOSSLESS",
+    "very-good": "OPTIMIZATION_VERY_GOOD",
+    "good": "OPTIMIZATION_GOOD",
+    "draft": "OPTIMIZATION_DRAFT",
+    "default": "OPTIMIZATION_DEFAULT",
+}
+
+# oiiotool -d data type -> (OCIO bit depth, buffer dtype, code value of 1.0)
+BIT_DEPTHS = {
+    "uint8": ("BIT_DEPTH_UINT8", np.uint8, 255.0),
+    "uint10": ("BIT_DEPTH_UINT10", np.uint16, 1023.0),
+    "uint12": ("BIT_DEPTH_UINT12", np.uint16, 4095.0),
+    "uint16": ("BIT_DEPTH_UINT16", np.uint16, 65535.0),
+    "half": ("BIT_DEPTH_F16", np.float16, 1.0),
+    "float": ("BIT_DEPTH_F32", np.float32, 1.0),
+}
+
+_CONFIGS = {}
+_PROCESSORS = {}
+_LOCK = threading.Lock()
+
+
+def available():
+    return OCIO is not None
+
+
+def version():
+    """PyOpenColorIO's version, "" when it isn't installed."""
+    return OCIO.__version__ if OCIO is not None else ""
+
+
+def quantize(pixels, maxval, bitdepth):
+    """RGB of an image (code values up to maxval) as a contiguous buffer of bitdepth."""
+    _, dtype, scale = BIT_DEPTHS[bitdepth]
+    rgb = pixels[..., :3].astype(np.float32)
+    if maxval != 1.0:
+        rgb /= maxval
+    if scale == 1.0:
+        return rgb.astype(dtype)
+    return np.rint(np.clip(rgb, 0.0, 1.0) * scale).astype(dtype)
+
+
+def _config(path):
+    if not path:
+        return OCIO.GetCurrentConfig(), None
+    stamp = os.stat(path).st_mtime_ns if os.path.isfile(path) else None
+    with _LOCK:
+        entry = _CONFIGS.get(path)
+    if entry is None or entry[1] != stamp:
+        entry = (OCIO.Config.CreateFromFile(path), stamp)
+        with _LOCK:
+            _CONFIGS[path] = entry
+    return entry
+
+
+def transform(spec):
+    """The OCIO transform of one entry of a render request's transforms."""
+    if spec["type"] == "colorspace":
+        result = OCIO.ColorSpaceTransform(src=spec["src"], dst=spec["dst"])
+    elif spec["type"] == "display":
+        result = OCIO.DisplayViewTransform(src=spec["src"], display=spec["display"], view=spec["view"])
+    else:
+        result = OCIO.FileTransform(src=spec["src"])
+    if spec.get("inverse"):
+        result.setDirection(OCIO.TRANSFORM_DIR_INVERSE)
+    return result
+
+
+def processor(request, optimization=OPTIMIZATION, bitdepth="float"):
+    """
+    The CPU processor of a render request at bitdepth, built once per
+    (config, transforms, optimization, bit depth). Returns (processor, cached).
+    """
+    config, stamp = _config(request["config"])
+    key = (request["config"], stamp, json.dumps(request["transforms"], sort_keys=True), optimization, bitdepth)
+    with _LOCK:
+        cpu = _PROCESSORS.get(key)
+    if cpu is not None:
+        return cpu, True
+
+    context = config.getCurrentContext()
+    variables = {k: v for spec in request["transforms"] for k, v in spec.get("context", {}).items()}
+    if variables:
+        context = context.createEditableCopy()
+        for name, value in variables.items():
+            context.setStringVar(name, value)
+    group = OCIO.GroupTransform()
+    for spec in request["transforms"]:
+        group.appendTransform(transform(spec))
+    proc = config.getProcessor(context, group, OCIO.TRANSFORM_DIR_FORWARD)
+    if optimization == "default" and bitdepth == "float":
+        cpu = proc.getDefaultCPUProcessor()
+    else:
+        depth = getattr(OCIO, BIT_DEPTHS[bitdepth][0])
+        cpu = proc.getOptimizedCPUProcessor(depth, depth, getattr(OCIO, OPTIMIZATIONS[optimization]))
+    with _LOCK:
+        _PROCESSORS[key] = cpu
+    return cpu, False
+
+
+def apply(cpu, buffer, bitdepth, threads=None):
+    """Apply a CPU processor in place to a (height, width, 3) buffer, in bands of rows on a thread pool."""
+    height, width, channels = buffer.shape
+    threads = threads or THREADS
+    rows = max(1, min(TILE_ROWS, -(-height // threads)))
+    bands = [buffer[y:y + rows] for y in range(0, height, rows)]
+    depth = getattr(OCIO, BIT_DEPTHS[bitdepth][0])
+    item = buffer.dtype.itemsize
+
+    def run(band):
+        if bitdepth == "float":
+            cpu.applyRGB(band)
+        else:
+            cpu.apply(OCIO.PackedImageDesc(
+                band, width, band.shape[0], channels, depth, item, item * channels, item * channels * width
+            ))
+
+    if threads == 1 or len(bands) == 1:
+        for band in bands:
+            run(band)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(threads, len(bands))) as pool:
+        list(pool.map(run, bands))
+
+
+def render(input_file, oiio_args, optimization=None, bitdepth=None, threads=None, log_file=None):
+    """
+    The reference image (imagereaders.Image) for 'oiiotool input_file
+    oiio_args', stored in the data type of its -d argument (float if none).
+    """
+    assert available(), "PyOpenColorIO is not installed"
+    request = ocioworker.parse_oiio_args(oiio_args)
+    assert request is not None, f"ocioref can't render oiiotool arguments {' '.join(oiio_args)}"
+    optimization = optimization or OPTIMIZATION
+    out_depth = request["format"] or "float"
+    bitdepth = bitdepth or out_depth
+    assert bitdepth in BIT_DEPTHS and out_depth in BIT_DEPTHS, f"Unsupported bit depth {bitdepth}/{out_depth}"
+
+    t = time.time()
+    image = imagereaders.read_image(input_file)
+    buffer = quantize(image.pixels, image.maxval, bitdepth)
+    cpu, cached = processor(request, optimization, bitdepth)
+    apply(cpu, buffer, bitdepth, threads)
+    if bitdepth != out_depth:
+        buffer = quantize(buffer, BIT_DEPTHS[bitdepth][2], out_depth)
+    _log(
+        f"ocioref: {input_file} {' '.join(oiio_args)} ({bitdepth}, optimization {optimization})\n"
+        f"  {time.time() - t:.3f}s, processor {'cached' if cached else 'built'}\n",
+        log_file,
+    )
+    return imagereaders.Image(buffer, BIT_DEPTHS[out_depth][2])
+
+
+def _log(msg, log_file):
+    print(msg, file=os.sys.stderr)
+    if log_file:
+        with cmdrunner.LOG_LOCK, open(log_file, "a") as f:
+            f.write(msg)
@@ -0,0 +1,172 @@
+"""
+Scheduling of the test matrix for a quick first signal (a pytest plugin,
+loaded by conftest.py).
+
+--order-by-history
+    Runs the cases in order of expected time to a failure: the median
+    duration of a case divided by its failure probability, both from the
+    last HISTORY_RUNS runs in the results history (resultsdb.py). Cheap
+    cases that failed before come first, slow and always passing cases
+    last. The failure probability is smoothed ((failures + 1) / (runs + 2)),
+    so cases without history sit in between with the median duration; ties
+    keep the matrix order.
+
+--smoke
+    Only runs one case per test function, the one on the smallest media
+    (then the fastest in the history).
+
+--abort-after N
+    Skips every case that hasn't started yet once N cases have failed. The
+    failures are counted in the run's results directory, so this works
+    across pytest-xdist workers, and unlike --maxfail the remaining cases
+    are reported as skipped, with the PSNR summary and the results history
+    written as usual.
+"""
+import os
+import statistics
+
+import pytest
+
+import results
+import resultsdb
+import sequencecheck
+
+HISTORY_RUNS = 20
+# Set from --abort-after, 0 to run every case.
+ABORT_AFTER = 0
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("ociotest")
+    group.addoption(
+        "--order-by-history",
+        action="store_true",
+        default=False,
+        help="Run cheap cases that failed before first, from the durations and failures in the results history.",
+    )
+    group.addoption(
+        "--smoke",
+        action="store_true",
+        default=False,
+        help="Only run one case per test function, on its smallest media.",
+    )
+    group.addoption(
+        "--abort-after",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Skip the remaining cases once N cases have failed (counted across xdist workers).",
+    )
+
+
+def pytest_configure(config):
+    global ABORT_AFTER
+    ABORT_AFTER = config.getoption("--abort-after")
+
+
+def load_history(path=None):
+    """resultsdb.case_stats() of the ociotest runs, empty when there is no results history yet."""
+    path = path or resultsdb.RESULTS_DB
+    if not os.path.exists(path):
+        return {}
+    conn = resultsdb.connect(path)
+    try:
+        return resultsdb.case_stats(conn, "ociotest", HISTORY_RUNS)
+    finally:
+        conn.close()
+
+
+def failure_probability(stats):
+    return (stats.get("failures", 0) + 1) / (stats.get("runs", 0) + 2)
+
+
+def priorities(nodeids, history):
+    """Expected seconds to a failure of every case: median duration / failure probability."""
+    known = [s["duration"] for s in history.values() if s["duration"]]
+    default = statistics.median(known) if known else 1.0
+    return {
+        nodeid: (history.get(nodeid, {}).get("duration") or default) / failure_probability(history.get(nodeid, {}))
+        for nodeid in nodeids
+    }
+
+
+def media_size(params):
+    """Bytes of a case's input (the first frame of a sequence), None when it doesn't exist."""
+    path = params.get("input_file") or params.get("source")
+    if not path:
+        return None
+    if "#" in path:
+        path = sequencecheck.frame_path(path, params.get("first", 1), 5)
+    return os.path.getsize(path) if os.path.isfile(path) else None
+
+
+def smoke_cases(items, history):
+    """One item per test function: the one on the smallest existing media, then the fastest."""
+    best = {}
+    for index, item in enumerate(items):
+        params = item.callspec.params if hasattr(item, "callspec") else {}
+        size = media_size(params)
+        duration = history.get(item.nodeid, {}).get("duration")
+        key = (size is None, size or 0, duration is None, duration or 0.0, index)
+        name = (item.path, getattr(item, "originalname", item.name))
+        if name not in best or key < best[name][0]:
+            best[name] = (key, item)
+    chosen = {id(item) for _, item in best.values()}
+    return [item for item in items if id(item) in chosen]
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(config, items):
+    smoke = config.getoption("--smoke")
+    order = config.getoption("--order-by-history")
+    if not smoke and not order:
+        return
+    history = load_history()
+
+    if smoke:
+        selected = smoke_cases(items, history)
+        chosen = {id(item) for item in selected}
+        deselected = [item for item in items if id(item) not in chosen]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
+        print(f"--smoke: running {len(items)} cases, one per test function", file=os.sys.stderr)
+
+    if order:
+        priority = priorities([item.nodeid for item in items], history)
+        position = {id(item): i for i, item in enumerate(items)}
+        items.sort(key=lambda item: (priority[item.nodeid], position[id(item)]))
+        known = sum(1 for item in items if item.nodeid in history)
+        print(
+            f"--order-by-history: {known} of {len(items)} cases have history (last {HISTORY_RUNS} runs)",
+            file=os.sys.stderr,
+        )
+
+
+def _failures_file():
+    return os.path.join(results.run_dir(), "failures")
+
+
+def failed_cases():
+    """The node ids of the cases that failed so far in this run, by any worker."""
+    try:
+        with open(_failures_file()) as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def pytest_runtest_setup(item):
+    if ABORT_AFTER:
+        failed = failed_cases()
+        if len(failed) >= ABORT_AFTER:
+            pytest.skip(f"aborted after {len(failed)} failed cases (--abort-after {ABORT_AFTER})")
+
+
+def pytest_runtest_logreport(report):
+    # Under xdist the controller sees the workers' reports as well, the set of node ids removes the duplicates.
+    if not ABORT_AFTER or not report.failed:
+        return
+    os.makedirs(results.run_dir(), exist_ok=True)
+    with open(_failures_file(), "a") as f:
+        f.write(report.nodeid + "\n")
@@ -1,442 +1,722 @@
-import subprocess
 import os
+import math
 import pytest
 import re
-
-testoutputdir = "./output"
-if not os.path.exists(testoutputdir):
-    os.makedirs(testoutputdir)
-
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+
+import batchrender
+import cmdrunner
+import imagecompare
+import imagereaders
+import jobgraph
+import matrix
+import ocioref
+import ocioworker
+import refcache
+import results
+import sequencecheck
+import workunits
+
+testoutputdir = results.OUTPUT_DIR
+
+# Results of this process only, the merged results of all workers are in output/psnr_summary.json.
 PSNR_RESULTS = []
 FFMPEG_BIN = "/Users/sam/roots/ffmpeg-ocio-8.0/bin/ffmpeg"
+# Allowed difference (dB) between the in-process PSNR and the ffmpeg psnr filter when cross-checking.
+PSNR_CROSSCHECK_TOLERANCE = 0.5
+# Scratch location for --in-memory runs, tmpfs where there is one.
+MEMORY_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+# Threads of each oiiotool/ffmpeg job (ocio threads=, ffmpeg -threads and -filter_threads, oiiotool
+# --threads), so the two jobs a case runs side by side share the CPU budget instead of each using every core.
+JOB_CPUS = max(1, jobgraph.CPU_BUDGET // 2)
+FFMPEG_THREADS = f"-threads {JOB_CPUS} -filter_threads {JOB_CPUS}"
+OIIOTOOL_THREADS = f"--threads {JOB_CPUS}"
+
+_LOG_LOCK = cmdrunner.LOG_LOCK
 
 import sys
 
 
-def run_cmd(cmd, log_file=None):
-    msg = f"Running command: {cmd}\n"
-    print(msg, file=os.sys.stderr)
-    
-    if log_file:
-        with open(log_file, "a") as f:
-            f.write(msg)
-
-    result = subprocess.run(cmd, shell=True, capture_output=True)
-    
-    output_log = f"Return Code: {result.returncode}\nSTDOUT:\n{result.stdout.decode()}\nSTDERR:\n{result.stderr.decode()}\n"
-    
-    if log_file:
-        with open(log_file, "a") as f:
-            f.write(output_log)
-
-    assert result.returncode == 0, f"Command failed: {cmd}\n{result.stderr.decode()}"
+@pytest.fixture
+def case_dir(request):
+    """
+    A per-case output directory. The node id is part of the name so duplicate
+    parameter sets and concurrent xdist workers never share files.
+    """
+    testname = request.node.callspec.params.get("testname", request.node.originalname)
+    digest = hashlib.sha1(request.node.nodeid.encode()).hexdigest()[:8]
+    path = os.path.join(testoutputdir, request.node.originalname, f"{testname}-{digest}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+@pytest.fixture(autouse=True)
+def generated_inputs(request):
+    """Synthesize the generated inputs (see matrix.yaml) of a case when it runs rather than at collection."""
+    params = request.node.callspec.params if hasattr(request.node, "callspec") else {}
+    for name in ("input_file", "source"):
+        if params.get(name):
+            matrix.generate_input(params[name])
+
+def run_cmd(cmd, log_file=None, log_stdout=True):
+    # log_stdout=False is for binary output (rawvideo), which is captured but not split into lines.
+    result = cmdrunner.run(cmd, log_file, log_stdout=log_stdout, stdout_lines=log_stdout, progress_interval=1.0)
+    results.record_command(cmd, result)
     return result
 
-def psnr_comparison(file1, file2, max_psnr_allowed, testname, log_file=None):
+def run_oiiotool(input_file, oiio_args, output, log_file=None):
     """
-    Compares two Y4M video files using FFmpeg's psnr filter and checks if
-    the average Mean Squared Error (MSE) is below a specified threshold.
+    Render a reference image with oiiotool, reusing a cached render when the
+    input, config, arguments and oiiotool version are all unchanged.
     """
-    assert os.path.isfile(file1), f"psnr_comparison:File not found: {file1}"
-    assert os.path.isfile(file2), f"psnr_comparison:File not found: {file2}"
-    
-    msg = f"Comparing '{file1}' with '{file2}' for MSE > {max_psnr_allowed}\n"
-    print(msg, file=os.sys.stderr)
-    if log_file:
-        with open(log_file, "a") as f:
-            f.write(msg)
+    renderer = ocioworker.renderer(oiio_args)
+    key = refcache.reference_key(input_file, oiio_args, os.path.splitext(output)[1], renderer)
+    if refcache.fetch(key, output):
+        msg = f"Reference cache hit ({key[:12]}): {output}\n"
+        print(msg, file=os.sys.stderr)
+        if log_file:
+            with _LOG_LOCK, open(log_file, "a") as f:
+                f.write(msg)
+        return
+
+    if renderer:
+        # The persistent worker has the config and processors loaded already.
+        ocioworker.render(input_file, oiio_args, output, log_file)
+    else:
+        oiiotool_cmd = (
+            f"{refcache.OIIOTOOL_BIN} {OIIOTOOL_THREADS} {input_file} "
+            f"{' '.join(oiio_args)} "
+            f"-o {output}"
+        )
+        run_cmd(oiiotool_cmd, log_file)
+    refcache.store(key, output)
+
+def shared_oiiotool(input_file, oiio_args, output, log_file=None):
+    """
+    run_oiiotool() rendered once per session for every case that needs the
+    same reference, linked to output. Returns the shared render's path.
+    """
+    ext = os.path.splitext(output)[1]
+    renderer = ocioworker.renderer(oiio_args)
+    key = workunits.unit_key("oiiotool", refcache.reference_key(input_file, oiio_args, ext, renderer))
+    if renderer is None:
+        batchrender.ensure("oiiotool", batchrender.oiiotool_group(input_file, oiio_args), key, run_cmd, log_file)
+    unit = workunits.shared_output(key, ext[1:], lambda out: run_oiiotool(input_file, oiio_args, out, log_file), log_file)
+    workunits.link(unit, output)
+    return unit
+
+def ffmpeg_unit_key(input_file, ffmpeg_args, ext):
+    return workunits.unit_key("ffmpeg", FFMPEG_BIN, input_file, ffmpeg_args.strip(), ext)
+
+def shared_ffmpeg(input_file, ffmpeg_args, output, log_file=None):
+    """
+    ffmpeg on input_file with the output options ffmpeg_args, run once per
+    session for every case with the same render and linked to output. Renders
+    registered for the same input are made together (see batchrender).
+    """
+    ext = os.path.splitext(output)[1][1:]
+    key = ffmpeg_unit_key(input_file, ffmpeg_args, ext)
+    batchrender.ensure("ffmpeg", input_file, key, run_cmd, log_file)
+    unit = workunits.shared_output(
+        key, ext, lambda out: run_cmd(f"{FFMPEG_BIN} -y {FFMPEG_THREADS} -i {input_file} {ffmpeg_args} {out}", log_file), log_file
+    )
+    workunits.link(unit, output)
+    return unit
+
+def register_render(tool, input_file, args, ext):
+    """Tell batchrender about a render a selected case will ask for."""
+    if tool == "ffmpeg":
+        batchrender.register("ffmpeg", input_file, ffmpeg_unit_key(input_file, args, ext),
+                             {"input_file": input_file, "args": args, "ext": ext})
+        return
+    group = batchrender.oiiotool_group(input_file, args)
+    # References made by the worker don't start oiiotool at all.
+    if group is None or ocioworker.renderer(args):
+        return
+    refkey = refcache.reference_key(input_file, args, f".{ext}")
+    batchrender.register("oiiotool", group, workunits.unit_key("oiiotool", refkey),
+                         {"input_file": input_file, "args": args, "ext": ext, "refkey": refkey})
+
+def shared_cmd(cmd, output, log_file=None):
+    """
+    run_cmd() of cmd followed by its output file, run once per session for
+    every case with the same command, linked to output.
+    """
+    ext = os.path.splitext(output)[1]
+    key = workunits.unit_key("cmd", cmd.strip(), ext)
+    unit = workunits.shared_output(key, ext[1:], lambda out: run_cmd(f"{cmd} {out}", log_file), log_file)
+    workunits.link(unit, output)
+    return unit
 
+def ffmpeg_psnr(file1, file2, log_file=None):
+    """
+    Compute the average PSNR of two files with FFmpeg's psnr filter.
+    Only used as a cross-check of the in-process comparison.
+    """
     ffmpeg_cmd_str = (            
         f"{FFMPEG_BIN} -i {file1} -i {file2} "
         f"-filter_complex \"[0:v][1:v]psnr\" -f null -"
     )
 
 
-    msg = f"Running command: {ffmpeg_cmd_str}\n"
-    print(msg, file=os.sys.stderr)
-    if log_file:
-        with open(log_file, "a") as f:
-            f.write(msg)
-            
     # Execute FFmpeg. We capture stderr to parse the PSNR/MSE output.
-    # We use shell=True for consistency with other run_cmd calls in this file.
-    # text=True ensures stdout/stderr are strings.
-    result = subprocess.run(ffmpeg_cmd_str, shell=True, capture_output=True, text=True)
-
-    output_log = f"Return Code: {result.returncode}\nSTDOUT:\n{result.stdout}\nSTDERR:\n{result.stderr}\n"
-    if log_file:
-        with open(log_file, "a") as f:
-            f.write(output_log)
+    result = cmdrunner.run(ffmpeg_cmd_str, log_file, check=False)
 
     # Check if FFmpeg command itself failed (e.g., file not found, invalid arguments)
     if result.returncode != 0:
         pytest.fail(f"FFmpeg command failed with exit code {result.returncode}:\n"
                      f"Command: {ffmpeg_cmd_str}\n"
-                     f"STDOUT:\n{result.stdout}\n"
-                     f"STDERR:\n{result.stderr}")
+                     f"STDOUT:\n{result.stdout.decode()}\n"
+                     f"STDERR:\n{result.stderr.decode()}")
 
-    ffmpeg_output = result.stderr
+    ffmpeg_output = result.stderr.decode()
 
-    mse_avg = None
-    # The psnr filter output line containing MSE looks like:
-    # [Parsed_psnr_0 @ 0x...] PSNR y:XX.XX u:YY.YY v:ZZ.ZZ average:AA.AA min:BB.BB max:CC.CC mse_y:D.D mse_u:E.E mse_v:F.F mse_avg:G.G
+    # The psnr filter output line looks like:
+    # [Parsed_psnr_0 @ 0x...] PSNR y:XX.XX u:YY.YY v:ZZ.ZZ average:AA.AA min:BB.BB max:CC.CC
     match = re.search(r"average:(\S+)", ffmpeg_output)
 
-    if match:
-        mse_avg = float(match.group(1))
-
-    assert mse_avg is not None, (
-        f"Could not extract average PSNR from FFmpeg output. "
-        f"Ensure input files are valid Y4M and FFmpeg's psnr filter produced output.\n"
+    assert match is not None, (
+        f"Could not extract average PSNR from FFmpeg output.\n"
         f"FFmpeg STDERR:\n{ffmpeg_output}"
     )
+    return float(match.group(1))
 
-    msg = f"Calculated average PSNR: {mse_avg}\n"
+def psnr_comparison(file1, file2, max_psnr_allowed, testname, log_file=None, input_file=None):
+    """
+    Decodes both files into NumPy arrays and checks that the average PSNR
+    between them is above the specified threshold. On failure an error map
+    is written next to file2 (see check_psnr).
+    """
+    assert os.path.isfile(file1), f"psnr_comparison:File not found: {file1}"
+    assert os.path.isfile(file2), f"psnr_comparison:File not found: {file2}"
+    
+    msg = f"Comparing '{file1}' with '{file2}' for PSNR > {max_psnr_allowed}\n"
     print(msg, file=os.sys.stderr)
     if log_file:
         with open(log_file, "a") as f:
             f.write(msg)
 
-    passed = mse_avg > max_psnr_allowed
-    PSNR_RESULTS.append({
-        'file': os.path.basename(file2),
-        'psnr': mse_avg,
-        'test': testname,
-        'min_psnr': max_psnr_allowed,
-        'passed': passed
-    })
+    check_psnr(
+        imagereaders.read_image(file1, FFMPEG_BIN),
+        imagereaders.read_image(file2, FFMPEG_BIN),
+        max_psnr_allowed, testname, os.path.basename(file2), log_file, files=(file1, file2),
+        error_map=f"{os.path.splitext(file2)[0]}_errors", input_file=input_file,
+    )
+
+def check_psnr(reference, test, max_psnr_allowed, testname, output_name, log_file=None, files=None,
+               error_map=None, input_file=None):
+    """
+    Checks the average PSNR between two decoded images (imagereaders.Image)
+    and records the result. files are the paths of both images on disk, when
+    there are any, for the optional ffmpeg psnr filter cross-check.
+
+    When the check fails and error_map is given, a per tile heatmap
+    (error_map.png) and the worst tiles and input code values (error_map.json,
+    binned by the levels of input_file) are written to locate the error.
+    """
+    stats = imagecompare.compare_images(reference, test)
+    psnr = stats["psnr"]
+
+    msg = imagecompare.format_report(stats)
+    print(msg, file=os.sys.stderr)
+    if log_file:
+        with open(log_file, "a") as f:
+            f.write(msg)
+
+    if os.environ.get("OCIOTEST_PSNR_CROSSCHECK") and files:
+        ffmpeg_value = ffmpeg_psnr(*files, log_file)
+        msg = f"ffmpeg psnr filter average: {ffmpeg_value} (in-process: {psnr})\n"
+        print(msg, file=os.sys.stderr)
+        if log_file:
+            with open(log_file, "a") as f:
+                f.write(msg)
+        if not (math.isinf(psnr) and math.isinf(ffmpeg_value)):
+            assert abs(psnr - ffmpeg_value) < PSNR_CROSSCHECK_TOLERANCE, (
+                f"In-process PSNR ({psnr}) disagrees with the ffmpeg psnr filter ({ffmpeg_value})"
+            )
+
+    passed = psnr > max_psnr_allowed
+    if not passed and error_map:
+        input_image = None
+        if input_file and os.path.isfile(input_file):
+            input_image = imagereaders.read_image(input_file, FFMPEG_BIN)
+        report = imagecompare.write_error_map(reference, test, error_map, input_image)
+        msg = imagecompare.format_error_map(report)
+        print(msg, file=os.sys.stderr)
+        if log_file:
+            with open(log_file, "a") as f:
+                f.write(msg)
+
+    extra = {'error_map': f"{error_map}.json"} if not passed and error_map else {}
+    record_result(testname, output_name, psnr, max_psnr_allowed, passed, channels=stats['channels'], **extra)
 
     if passed:
-        msg = f"Comparison passed: Average PSNR ({mse_avg}) is greater than {max_psnr_allowed}.\n"
+        msg = f"Comparison passed: Average PSNR ({psnr}) is greater than {max_psnr_allowed}.\n"
         print(msg, file=os.sys.stderr)
         if log_file:
             with open(log_file, "a") as f:
                 f.write(msg)
     
     assert passed, (
-        f"Comparison failed: Average PSNR ({mse_avg}) is not greater than "
+        f"Comparison failed: Average PSNR ({psnr}) is not greater than "
         f"the allowed threshold ({max_psnr_allowed})."
     )
 
+def record_result(testname, file, psnr, min_psnr, passed, **extra):
+    """Record the result of one comparison for the PSNR summary and the results history."""
+    result = {
+        'file': file,
+        'psnr': psnr,
+        'test': testname,
+        'nodeid': os.environ.get("PYTEST_CURRENT_TEST", testname).rsplit(" ", 1)[0],
+        'min_psnr': min_psnr,
+        'passed': passed,
+        **extra,
+    }
+    PSNR_RESULTS.append(result)
+    results.record(result)
+
+
+def reference_backend(reference):
+    """The reference backend of a case, unless --reference overrides it for every case."""
+    return os.environ.get("OCIOTEST_REFERENCE") or reference
+
+def compare_renders(testname, input_file, oiio_args, ffmpeg_args, oiiotool_out, ffmpeg_out, pix_fmt, min_psnr, log_file,
+                    reference="oiiotool"):
+    """
+    Render the oiiotool reference and the ffmpeg output (ffmpeg_args being
+    the output options) concurrently and compare them.
+
+    With --in-memory ffmpeg writes rawvideo to stdout, the reference is
+    written to tmpfs, and both are compared without a copy. The images are
+    only saved to the case directory when the comparison fails.
 
+    With reference "ocioref" the reference is computed in-process from the
+    same oiiotool arguments (see compare_ocioref).
+    """
+    if reference_backend(reference) == "ocioref":
+        compare_ocioref(testname, input_file, oiio_args, ffmpeg_args, oiiotool_out, ffmpeg_out, pix_fmt, min_psnr, log_file)
+        return
+
+    if not os.environ.get("OCIOTEST_IN_MEMORY"):
+        jobgraph.run_jobs([
+            jobgraph.Job("oiiotool", lambda: shared_oiiotool(input_file, oiio_args, oiiotool_out, log_file), cpus=JOB_CPUS),
+            jobgraph.Job("ffmpeg", lambda: shared_ffmpeg(input_file, ffmpeg_args, ffmpeg_out, log_file), cpus=JOB_CPUS),
+        ], log_file=log_file)
+        psnr_comparison(oiiotool_out, ffmpeg_out, max_psnr_allowed=min_psnr, testname=testname, log_file=log_file,
+                        input_file=input_file)
+        return
+
+    ffmpeg_cmd = f"{FFMPEG_BIN} -y {FFMPEG_THREADS} -i {input_file} {ffmpeg_args} "
+    with tempfile.TemporaryDirectory(prefix="ociotest-", dir=MEMORY_DIR) as tmp:
+        reference_out = os.path.join(tmp, os.path.basename(oiiotool_out))
+        ffmpeg_job = jobgraph.Job(
+            "ffmpeg", lambda: run_cmd(f"{ffmpeg_cmd} -f rawvideo -pix_fmt {pix_fmt} -", log_file, log_stdout=False),
+            cpus=JOB_CPUS,
+        )
+        jobgraph.run_jobs([
+            jobgraph.Job("oiiotool", lambda: run_oiiotool(input_file, oiio_args, reference_out, log_file), cpus=JOB_CPUS),
+            ffmpeg_job,
+        ], log_file=log_file)
+
+        reference = imagereaders.map_image(reference_out)
+        height, width = reference.pixels.shape[:2]
+        raw = ffmpeg_job.result.stdout
+        try:
+            assert len(raw) >= imagereaders.frame_bytes(width, height, pix_fmt), (
+                f"ffmpeg produced {len(raw)} bytes, expected a {width}x{height} {pix_fmt} frame"
+            )
+            check_psnr(reference, imagereaders.frame_from_buffer(raw, width, height, pix_fmt),
+                       min_psnr, testname, os.path.basename(ffmpeg_out), log_file,
+                       error_map=f"{os.path.splitext(ffmpeg_out)[0]}_errors", input_file=input_file)
+        except AssertionError:
+            raw_out = f"{ffmpeg_out}.{width}x{height}.{pix_fmt}.raw"
+            shutil.copyfile(reference_out, oiiotool_out)
+            with open(raw_out, "wb") as f:
+                f.write(raw)
+            msg = (
+                f"Saved failing renders: {oiiotool_out} and {raw_out} "
+                f"(view with: ffmpeg -f rawvideo -pix_fmt {pix_fmt} -s {width}x{height} -i {raw_out} ...)\n"
+            )
+            print(msg, file=os.sys.stderr)
+            if log_file:
+                with open(log_file, "a") as f:
+                    f.write(msg)
+            raise
+
+
+
+def compare_ocioref(testname, input_file, oiio_args, ffmpeg_args, reference_out, ffmpeg_out, pix_fmt, min_psnr, log_file):
+    """
+    compare_renders() with the reference applied by PyOpenColorIO to the
+    decoded input (ocioref) instead of an oiiotool render. The reference is
+    only saved, as reference_out.npy, when the comparison fails.
+    """
+    if not ocioref.available():
+        pytest.skip("PyOpenColorIO is not installed (reference: ocioref)")
+    in_memory = os.environ.get("OCIOTEST_IN_MEMORY")
+    if in_memory:
+        ffmpeg_job = jobgraph.Job(
+            "ffmpeg",
+            lambda: run_cmd(f"{FFMPEG_BIN} -y {FFMPEG_THREADS} -i {input_file} {ffmpeg_args} -f rawvideo -pix_fmt {pix_fmt} -",
+                            log_file, log_stdout=False),
+            cpus=JOB_CPUS,
+        )
+    else:
+        ffmpeg_job = jobgraph.Job(
+            "ffmpeg", lambda: shared_ffmpeg(input_file, ffmpeg_args, ffmpeg_out, log_file), cpus=JOB_CPUS
+        )
+    reference_job = jobgraph.Job(
+        "ocioref", lambda: ocioref.render(input_file, oiio_args, threads=JOB_CPUS, log_file=log_file), cpus=JOB_CPUS
+    )
+    jobgraph.run_jobs([reference_job, ffmpeg_job], log_file=log_file)
+
+    reference = reference_job.result
+    height, width = reference.pixels.shape[:2]
+    try:
+        if in_memory:
+            raw = ffmpeg_job.result.stdout
+            assert len(raw) >= imagereaders.frame_bytes(width, height, pix_fmt), (
+                f"ffmpeg produced {len(raw)} bytes, expected a {width}x{height} {pix_fmt} frame"
+            )
+            test = imagereaders.frame_from_buffer(raw, width, height, pix_fmt)
+        else:
+            test = imagereaders.read_image(ffmpeg_out, FFMPEG_BIN)
+        check_psnr(reference, test, min_psnr, testname, os.path.basename(ffmpeg_out), log_file,
+                   error_map=f"{os.path.splitext(ffmpeg_out)[0]}_errors", input_file=input_file)
+    except AssertionError:
+        np.save(f"{reference_out}.npy", reference.pixels)
+        msg = f"Saved the ocioref reference: {reference_out}.npy (maxval {reference.maxval})\n"
+        print(msg, file=os.sys.stderr)
+        if log_file:
+            with open(log_file, "a") as f:
+                f.write(msg)
+        raise
+
+def colorspace_args(ocio_config, input_space, output_space, format, **_):
+    """The oiiotool arguments and ffmpeg output options of a colorspace conversion case."""
+    oiio_args = [
+        "--colorconfig", ocio_config,
+        "--colorconvert", f"'{input_space}'", f"'{output_space}'",
+        "-d", matrix.oiio_format(format),
+    ]
+    ffmpeg_args = (
+        f"-sws_dither none "
+        f"-vf \"ocio=config={ocio_config}:input={input_space}:output={output_space}:format={format}:threads={JOB_CPUS}\""
+    )
+    return oiio_args, ffmpeg_args
+
+def display_args(ocio_config, input_space, display, view, format, inverse=False, **_):
+    """The oiiotool arguments and ffmpeg output options of a display/view case."""
+    oiio_args = [
+        "--colorconfig", ocio_config,
+        "--iscolorspace", f"'{input_space}'",
+        "--ociodisplay:inverse=1" if inverse else "--ociodisplay", f"'{display}'", f"'{view}'",
+        "-d", matrix.oiio_format(format),
+    ]
+    ffmpeg_args = (
+        f"-sws_dither none "
+        f"-vf \"ocio=config={ocio_config}:input={input_space}:display={display}:view={view}"
+        f"{':inverse=1' if inverse else ''}:format={format}:threads={JOB_CPUS}\""
+    )
+    return oiio_args, ffmpeg_args
 
-@pytest.mark.parametrize("testname, input_file, outputext, ocio_config, input_space, output_space, format, min_psnr", [
-    ("exr16ACEScct24", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "ACEScct", "rgb24", 52.0),
-    ("exr16ACEScct48", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "ACEScct", "rgb48", 100.0),
-    ("exr32ACEScct", "sourcemedia/ocean_clean_32.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "ACEScct", "rgb48", 100.0),
-    ("dpx16ACEScct", "sourcemedia/ocean_clean_16_ACEScct.dpx", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScc", "ACEScct", "rgba24", 52.0),
-    ("png8simpleocean", "sourcemedia/ocean_oiio_raw8.png", "tif", "sourcemedia/simpleconfig.ocio", "Linear", "Gamma2.2", "rgb24", 100.0),
-    ("dpx16simpleocean", "sourcemedia/ocean_clean_16_ACEScct.dpx", "tif", "sourcemedia/simpleconfig.ocio", "Linear", "Gamma2.2", "rgb48", 100.0),
-    ("dpx16simpleocean2", "sourcemedia/ocean_clean_16_ACEScct.dpx", "tif", "sourcemedia/simpleconfig.ocio", "Linear", "TestCDL", "rgb48", 100.0),
-    ("dpx16simpleocean3", "sourcemedia/ocean_clean_16_ACEScct.dpx", "tif", "sourcemedia/simpleconfig.ocio", "Linear", "TestCDL2", "rgb48", 100.0),
-    #("png16simple", "/Users/sam/git/EncodingGuidelines/sourceimages/chip-chart-1080-16bit-noicc.png", "tif", "sourcemedia/simpleconfig.ocio", "Linear", "TestCDL", "rgba64", 100.0),
-    ("dpx16simple", "sourcemedia/chip-chart-1080-16bit-noicc.dpx", "tif", "sourcemedia/simpleconfig.ocio", "Linear", "TestCDL", "rgb48", 100.0),
-    ("dpx16simple2", "sourcemedia/chip-chart-1080-16bit-noicc.dpx", "tif", "sourcemedia/simpleconfig.ocio", "Linear", "TestCDL2", "rgb48", 100.0),
-    ## Add more parameter sets as needed
-])
-def test_ocio_colorspace_vs_oiiotool(testname, input_file, outputext, ocio_config, input_space, output_space, format, min_psnr):
+def yuv_args(ocio_config, input_space, display, view, format, out_format, compression, **_):
+    """
+    The oiiotool arguments and ffmpeg output options of a YUV round trip
+    case, plus the scale filter converting to YUV ("" for RGB outputs).
+    """
+    oiio_args = display_args(ocio_config, input_space, display, view, format)[0]
+    yuvconvert = "scale=in_color_matrix=bt709:sws_dither=none:out_color_matrix=bt709," if "yuv" in out_format else ""
+    ffmpeg_args = (
+        f"-vf \"ocio=config={ocio_config}:input={input_space}:display={display}:view={view}:format={format}:threads={JOB_CPUS},{yuvconvert}format={out_format}\" "
+        f" -strict -1 {compression}"
+    )
+    return oiio_args, ffmpeg_args, yuvconvert
+
+def _compare_renders(case, oiio_args, ffmpeg_args, ffmpeg_ext=None, reference=None):
+    renders = [("ffmpeg", case["input_file"], ffmpeg_args, ffmpeg_ext or case["outputext"])]
+    if (reference or reference_backend(case["reference"])) == "oiiotool":
+        renders.append(("oiiotool", case["input_file"], oiio_args, case["outputext"]))
+    return renders
+
+# The shared renders each test function will ask for, from its parameters.
+CASE_RENDERS = {
+    "test_ocio_colorspace_vs_oiiotool": lambda case: _compare_renders(case, *colorspace_args(**case)),
+    "test_ocio_vs_oiiotool": lambda case: _compare_renders(case, *display_args(**case)),
+    "test_ocio_invert_vs_oiiotool": lambda case: _compare_renders(case, *display_args(inverse=True, **case)),
+    "test_ocio_args_vs_oiiotool": lambda case: _compare_renders(case, case["ocio_params"], " ".join(case["ffmpeg_params"])),
+    # The YUV round trip re-encodes the oiiotool render, it always needs one.
+    "test_ocio_vs_oiiotool_2_yuv444": lambda case: _compare_renders(
+        case, *yuv_args(**case)[:2], case["yuvoutputext"], reference="oiiotool"
+    ),
+    "test_reference_backends_agree": lambda case: [
+        ("oiiotool", case["input_file"], agreement_args(**case), case["outputext"]),
+    ],
+    "test_ocio_precision_sweep": lambda case: _compare_renders(case, *transform_args(**case)),
+}
+
+@pytest.fixture(scope="session", autouse=True)
+def register_renders(request):
+    """
+    Register the renders of every selected case before the first one runs,
+    so renders of the same input can be batched into one invocation.
+    """
+    batchrender.FFMPEG_BIN = FFMPEG_BIN
+    batchrender.THREADS = JOB_CPUS
+    if os.environ.get("OCIOTEST_IN_MEMORY"):
+        return
+    for item in request.session.items:
+        renders = CASE_RENDERS.get(getattr(item, "originalname", None))
+        if renders is None or not hasattr(item, "callspec"):
+            continue
+        # Cases skipped before they run (e.g. --changed-only) must not make the batch render their outputs.
+        if item.get_closest_marker("skip"):
+            continue
+        for tool, input_file, args, ext in renders(item.callspec.params):
+            # The selected cases' generated inputs are written now, so their renders can be batched.
+            matrix.generate_input(input_file)
+            # Missing media fails in the case itself, with a clearer message.
+            if os.path.exists(input_file):
+                register_render(tool, input_file, args, ext)
+
+
+@matrix.parametrize("test_ocio_colorspace_vs_oiiotool", "testname, input_file, outputext, ocio_config, input_space, output_space, format, min_psnr, reference")
+def test_ocio_colorspace_vs_oiiotool(testname, input_file, outputext, ocio_config, input_space, output_space, format, min_psnr, reference, case_dir):
     """Compare OpenColorIO color transformations between FFmpeg and oiiotool."""
-    oiiotool_out = os.path.join(testoutputdir, f"{testname}_oiiotool_{format}_{output_space}.{outputext}")
-    ffmpeg_out = os.path.join(testoutputdir, f"{testname}_ffmpeg_{format}_{output_space}.{outputext}")
-    log_file = os.path.join(testoutputdir, f"{testname}_{format}_{output_space.replace(' ', '_')}.log")
+    oiiotool_out = os.path.join(case_dir, f"{testname}_oiiotool_{format}_{output_space}.{outputext}")
+    ffmpeg_out = os.path.join(case_dir, f"{testname}_ffmpeg_{format}_{output_space}.{outputext}")
+    log_file = os.path.join(case_dir, f"{testname}_{format}_{output_space.replace(' ', '_')}.log")
     
     # Clear log file
     with open(log_file, "w") as f:
         f.write(f"Test: {testname}\nFormat: {format}\n\n")
 
-    if format in ("rgb48", "rgba64"):
-        oiioformat = "uint16"
-    elif format in ("gbrpf16", "gbrapf16"):
-        oiioformat = "half"
-    elif format in ("gbrpf32", "gbrapf32"):
-        oiioformat = "float"
-    else:
-        oiioformat = "uint8"
-
-    # oiiotool command
-    oiiotool_cmd = (
-        f"oiiotool {input_file} "
-        f"--colorconfig {ocio_config} "
-        f"--colorconvert '{input_space}' '{output_space}' "
-        f"-d {oiioformat} "
-        f"-o {oiiotool_out}"
-    )
-    run_cmd(oiiotool_cmd, log_file)
-
-    # ffmpeg command
-    ffmpeg_cmd = (
-        f"{FFMPEG_BIN} -y -i {input_file} -sws_dither none "
-        f"-vf \"ocio=config={ocio_config}:input={input_space}:output={output_space}:format={format}\" "
-        f"{ffmpeg_out}"
-    )
-    run_cmd(ffmpeg_cmd, log_file)
+    oiio_args, ffmpeg_args = colorspace_args(ocio_config, input_space, output_space, format)
 
-    psnr_comparison(oiiotool_out, ffmpeg_out, max_psnr_allowed=min_psnr, testname=testname, log_file=log_file)
+    compare_renders(testname, input_file, oiio_args, ffmpeg_args, oiiotool_out, ffmpeg_out,
+                    imagereaders.rawvideo_pix_fmt(format), min_psnr, log_file, reference)
 
 
 
-@pytest.mark.parametrize("testname, input_file, outputext, ocio_config, input_space, display, view, format, min_psnr", [
-    ("exr16rgb24", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb24", 52.0),
-    ("exr16rgb48", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", 100.0),
-    #("exr16", "sourcemedia/ocean_clean_16.exr", "exr", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "gbrapf32le", 100.0),
-    ("exr32rgb48", "sourcemedia/ocean_clean_32.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", 100.0),
-    ("exr32exr32", "sourcemedia/ocean_clean_32.exr", "exr", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "gbrpf32le", 100.0),
-    #("exr32rgb48le", "sourcemedia/ocean_clean_32.exr", "exr", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "gbrapf32le", 100.0),
-    ("dpx10rgb48le", "sourcemedia/ocean_clean_10_ACEScct.dpx", "tif","sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", 95.0),
-    ("dpx12rgb48le", "sourcemedia/ocean_clean_12_ACEScct.dpx", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", 95.0),
-    ("dpx16rgb48le", "sourcemedia/ocean_clean_16_ACEScct.dpx", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", 100.0),
-    # Add more parameter sets as needed
-])
-def test_ocio_vs_oiiotool(testname, input_file, outputext, ocio_config, input_space, display, view, format, min_psnr):
+@matrix.parametrize("test_ocio_vs_oiiotool", "testname, input_file, outputext, ocio_config, input_space, display, view, format, min_psnr, reference")
+def test_ocio_vs_oiiotool(testname, input_file, outputext, ocio_config, input_space, display, view, format, min_psnr, reference, case_dir):
     """Compare OpenColorIO color transformations between FFmpeg and oiiotool."""
-    oiiotool_out = os.path.join(testoutputdir, f"{testname}_oiiotool_{format}.{outputext}")
-    ffmpeg_out = os.path.join(testoutputdir, f"{testname}_ffmpeg_{format}.{outputext}")
-    log_file = os.path.join(testoutputdir, f"{testname}_{format}_display.log")
+    oiiotool_out = os.path.join(case_dir, f"{testname}_oiiotool_{format}.{outputext}")
+    ffmpeg_out = os.path.join(case_dir, f"{testname}_ffmpeg_{format}.{outputext}")
+    log_file = os.path.join(case_dir, f"{testname}_{format}_display.log")
 
     # Clear log file
     with open(log_file, "w") as f:
         f.write(f"Test: {testname}\nFormat: {format}\n\n")
 
-    if format in ("rgb48", "rgba64"):
-        oiioformat = "uint16"
-    elif format in ("gbrpf16le", "gbrapf16le"):
-        oiioformat = "half"
-    elif format in ("gbrpf32le", "gbrapf32le"):
-        oiioformat = "float"
-    else:
-        oiioformat = "uint8"
-
-    # oiiotool command
-    oiiotool_cmd = (
-        f"oiiotool {input_file} "
-        f"--colorconfig {ocio_config} "
-        f"--iscolorspace '{input_space}' "
-        f"--ociodisplay '{display}' '{view}' "
-        f"-d {oiioformat} "
-        f"-o {oiiotool_out}"
-    )
-    run_cmd(oiiotool_cmd, log_file)
+    oiio_args, ffmpeg_args = display_args(ocio_config, input_space, display, view, format)
 
-    # ffmpeg command
-    ffmpeg_cmd = (
-        f"{FFMPEG_BIN} -y -i {input_file}  -sws_dither none "
-        f"-vf \"ocio=config={ocio_config}:input={input_space}:display={display}:view={view}:format={format}\" "
-        f"{ffmpeg_out}"
-    )
-    run_cmd(ffmpeg_cmd, log_file)
-
-    psnr_comparison(oiiotool_out, ffmpeg_out, max_psnr_allowed=min_psnr, testname=testname, log_file=log_file)
-
-@pytest.mark.parametrize("testname, input_file, outputext, ocio_config, input_space, display, view, format, min_psnr", [
-    #("exr32rgb48le", "sourcemedia/ocean_clean_32.exr", "exr", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "gbrapf32le", 100.0),
-    ("dpx10rgb48leinvert", "sourcemedia/ocean_clean_10_ACEScct.dpx", "tif","sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", 95.0),
-    ("dpx12rgb48leinvert", "sourcemedia/ocean_clean_12_ACEScct.dpx", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", 95.0),
-    ("dpx16rgb48leinvert", "sourcemedia/ocean_clean_16_ACEScct.dpx", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", 100.0),
-    # Add more parameter sets as needed
-])
-def test_ocio_invert_vs_oiiotool(testname, input_file, outputext, ocio_config, input_space, display, view, format, min_psnr):
+    compare_renders(testname, input_file, oiio_args, ffmpeg_args, oiiotool_out, ffmpeg_out,
+                    imagereaders.rawvideo_pix_fmt(format), min_psnr, log_file, reference)
+
+@matrix.parametrize("test_ocio_invert_vs_oiiotool", "testname, input_file, outputext, ocio_config, input_space, display, view, format, min_psnr, reference")
+def test_ocio_invert_vs_oiiotool(testname, input_file, outputext, ocio_config, input_space, display, view, format, min_psnr, reference, case_dir):
     """Compare OpenColorIO color transformations between FFmpeg and oiiotool."""
-    oiiotool_out = os.path.join(testoutputdir, f"{testname}_oiiotool_{format}.{outputext}")
-    ffmpeg_out = os.path.join(testoutputdir, f"{testname}_ffmpeg_{format}.{outputext}")
-    log_file = os.path.join(testoutputdir, f"{testname}_{format}_display.log")
+    oiiotool_out = os.path.join(case_dir, f"{testname}_oiiotool_{format}.{outputext}")
+    ffmpeg_out = os.path.join(case_dir, f"{testname}_ffmpeg_{format}.{outputext}")
+    log_file = os.path.join(case_dir, f"{testname}_{format}_display.log")
 
     # Clear log file
     with open(log_file, "w") as f:
         f.write(f"Test: {testname}\nFormat: {format}\n\n")
 
-    if format in ("rgb48", "rgba64"):
-        oiioformat = "uint16"
-    elif format in ("gbrpf16le", "gbrapf16le"):
-        oiioformat = "half"
-    elif format in ("gbrpf32le", "gbrapf32le"):
-        oiioformat = "float"
-    else:
-        oiioformat = "uint8"
-
-    # oiiotool command
-    oiiotool_cmd = (
-        f"oiiotool {input_file} "
-        f"--colorconfig {ocio_config} "
-        f"--iscolorspace '{input_space}' "
-        f"--ociodisplay:inverse=1 '{display}' '{view}' "
-        f"-d {oiioformat} "
-        f"-o {oiiotool_out}"
-    )
-    run_cmd(oiiotool_cmd, log_file)
-
-    # ffmpeg command
-    ffmpeg_cmd = (
-        f"{FFMPEG_BIN} -y -i {input_file}  -sws_dither none "
-        f"-vf \"ocio=config={ocio_config}:input={input_space}:display={display}:view={view}:inverse=1:format={format}\" "
-        f"{ffmpeg_out}"
-    )
-    run_cmd(ffmpeg_cmd, log_file)
+    oiio_args, ffmpeg_args = display_args(ocio_config, input_space, display, view, format, inverse=True)
 
-    psnr_comparison(oiiotool_out, ffmpeg_out, max_psnr_allowed=min_psnr, testname=testname, log_file=log_file)
+    compare_renders(testname, input_file, oiio_args, ffmpeg_args, oiiotool_out, ffmpeg_out,
+                    imagereaders.rawvideo_pix_fmt(format), min_psnr, log_file, reference)
 
 # This is the most generic test, it should work for any types of arguments
-@pytest.mark.parametrize("testname, input_file, outputext, ocio_params, ffmpeg_params, min_psnr", [
-    ("dpx10rgb48leinvert", "sourcemedia/ocean_clean_10_ACEScct.dpx", "tif", 
-     [
-         "--colorconfig", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio",
-         "--iscolorspace", "ACEScct",
-         "--ociodisplay:key=SHOT:value=100", "'sRGB - Display'", "'ACES 1.0 - SDR Video'",
-         "-d", "uint16"
-     ],
-     [
-         "-sws_dither", "none",
-         "-pix_fmt", "rgb48le",
-         "-vf", "\"ocio=config=sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio:input=ACEScct:display=sRGB - Display:view=ACES 1.0 - SDR Video:context_params='SHOT=100':format=rgb48\""
-     ], 
-     95.0),
-    ("dpx12rgb48leinvert", "sourcemedia/ocean_clean_12_ACEScct.dpx", "tif", 
-     [
-         "--colorconfig", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio",
-         "--iscolorspace", "ACEScct",
-         "--ociodisplay:key=SHOT:value=120", "'sRGB - Display'", "'ACES 1.0 - SDR Video'",
-         "-d", "uint16"
-     ],
-     [
-         "-sws_dither", "none",
-         "-pix_fmt", "rgb48le",
-         "-vf", "\"ocio=config=sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio:input=ACEScct:display=sRGB - Display:view=ACES 1.0 - SDR Video:context_params='SHOT=120':format=rgb48\""
-     ],
-     95.0),
-    ("dpx16rgb48leinvert", "sourcemedia/ocean_clean_16_ACEScct.dpx", "tif", 
-     [
-         "--colorconfig", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio",
-         "--iscolorspace", "ACEScct",
-         "--ociodisplay:key=SHOT:value=160", "'sRGB - Display'", "'ACES 1.0 - SDR Video'",
-         "-d", "uint16"
-     ],
-     [
-         "-sws_dither", "none",
-         "-pix_fmt", "rgb48le",
-         "-vf", "\"ocio=config=sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio:input=ACEScct:display=sRGB - Display:view=ACES 1.0 - SDR Video:context_params='SHOT=160':format=rgb48\""
-     ],
-     100.0),
-     ("dpx16rgb48leFileTransform", "sourcemedia/ocean_clean_16_ACEScct.dpx", "tif", 
-     [
-         "--ociofiletransform", "sourcemedia/redcontrast.spi1d",
-         "-d", "uint16"
-     ],
-     [
-         "-sws_dither", "none",
-         "-pix_fmt", "rgb48le",
-         "-vf", "ocio=filetransform=sourcemedia/redcontrast.spi1d:format=rgb48"
-     ],
-     100.0),
-])
-def test_ocio_args_vs_oiiotool(testname, input_file, outputext, ocio_params, ffmpeg_params, min_psnr):
+@matrix.parametrize("test_ocio_args_vs_oiiotool", "testname, input_file, outputext, ocio_params, ffmpeg_params, min_psnr, reference")
+def test_ocio_args_vs_oiiotool(testname, input_file, outputext, ocio_params, ffmpeg_params, min_psnr, reference, case_dir):
     """Compare OpenColorIO color transformations between FFmpeg and oiiotool."""
     
-    oiiotool_out = os.path.join(testoutputdir, f"{testname}_oiiotool.{outputext}")
-    ffmpeg_out = os.path.join(testoutputdir, f"{testname}_ffmpeg.{outputext}")
-    log_file = os.path.join(testoutputdir, f"{testname}_display.log")
+    oiiotool_out = os.path.join(case_dir, f"{testname}_oiiotool.{outputext}")
+    ffmpeg_out = os.path.join(case_dir, f"{testname}_ffmpeg.{outputext}")
+    log_file = os.path.join(case_dir, f"{testname}_display.log")
 
     # Clear log file
     with open(log_file, "w") as f:
         f.write(f"Test: {testname}\n\n")
 
-    # oiiotool command
-    oiiotool_cmd = (
-        f"oiiotool {input_file} "
-        f"{' '.join(ocio_params)} "
-        f"-o {oiiotool_out}"
-    )
-    run_cmd(oiiotool_cmd, log_file)
+    ffmpeg_args = " ".join(ffmpeg_params)
+    # The rawvideo format for --in-memory is the -pix_fmt the case asks for.
+    pix_fmt = ffmpeg_params[ffmpeg_params.index("-pix_fmt") + 1] if "-pix_fmt" in ffmpeg_params else "rgb48le"
 
-    # ffmpeg command
-    ffmpeg_cmd = (
-        f"{FFMPEG_BIN} -y -i {input_file} "
-        f"{' '.join(ffmpeg_params)} "
-        f"{ffmpeg_out}"
-    )
-    run_cmd(ffmpeg_cmd, log_file)
-
-    psnr_comparison(oiiotool_out, ffmpeg_out, max_psnr_allowed=min_psnr, testname=testname, log_file=log_file)
-
-
-@pytest.mark.parametrize("testname, input_file, outputext, ocio_config, input_space, display, view, format, out_format, min_psnr, compression, yuvoutputext", [
-    ("exr162y4m10", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", "yuv444p10", 100.0, "", "y4m"),
-    ("exr162y4m12", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", "yuv444p12", 100.0, "", "y4m"),
-    #("exr162mp410", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", "yuv444p10", 100.0, "-c:v libx265 -x265-params -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc iec61966-2-1 ", "mp4"),
-    ("exr162mp410h265yuv444p10", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", "yuv444p10", 100.0, "-c:v libx265 -x265-params lossless=1 -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc iec61966-2-1 ", "mp4"),
-    ("exr162mp412h265yuv444p12", "sourcemedia/ocean_clean_16.exr", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScg", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48", "yuv444p12", 100.0, "-c:v libx265 -x265-params lossless=1 -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc iec61966-2-1 ", "mp4"),
-    ("dpx102y4m10", "sourcemedia/ocean_clean_10_ACEScct.dpx", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48" ,  "yuv444p10" , 82.0, "", "y4m"),
-    ("dpx102y4m10", "sourcemedia/ocean_clean_10_ACEScct.dpx", "tif", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48" ,  "yuv444p10" , 82.0, "", "y4m"),
-    ("dpx122y4m10" , "sourcemedia/ocean_clean_12_ACEScct.dpx" , "tif" , "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48" ,  "yuv444p10" , 82.0, "", "y4m"),
-    ("dpx102mp410", "sourcemedia/ocean_clean_10_ACEScct.dpx", "dpx", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48" ,  "rgb48" , 82.0, "-c:v libx265 -x265-params lossless=1 ", "mp4"),
-    ("dpx102mp4yuv10", "sourcemedia/ocean_clean_10_ACEScct.dpx", "dpx", "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48" ,  "yuv444p10le" , 82.0, "-c:v libx265 -x265-params lossless=1 -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc iec61966-2-1 ", "mp4"),
-    #("dpx122mp410" , "sourcemedia/ocean_clean_12_ACEScct.dpx" , "dpx" , "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "gbrp10le" ,  "gbrp10le" , 82.0, "-c:v ffv1", "mp4"),
-    #("tif122mp412" , "sourcemedia/ocean_clean_12_ACEScct.tif" , "tif" , "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "gbrp10le" ,  "gbrp12le" , 82.0, "-c:v ffv1", "mp4"),
-    #("dpx162mp416" , "sourcemedia/ocean_clean_16_ACEScct.dpx" , "dpx" , "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48" ,  "gbrp16le" , 82.0, "-c:v libx265 -x265-params -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc iec61966-2-1 ", "mp4"),
-    #("png162mp4yuv16" , "sourcemedia/ocean_clean_16_ACEScct.png" , "png" , "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48" ,  "yuv444p16le" , 82.0, "-c:v libx265 -x265-params -color_range tv -colorspace bt709 -color_primaries bt709 -color_trc iec61966-2-1 ", "mp4"),
-    #("y4m2tif" , "sourcemedia/ocean_clean_16_ACEScct.y4m" , "tif" , "sourcemedia/studio-config-v1.0.0_aces-v1.3_ocio-v2.1_ns.ocio", "ACEScct", "sRGB - Display", "ACES 1.0 - SDR Video", "rgb48" ,  "yuv444p12" , 82.0, "", "y4m"),
-    # Add more parameter sets as needed
-])
-def test_ocio_vs_oiiotool_2_yuv444(testname, input_file, outputext, ocio_config, input_space, display, view, format, out_format, min_psnr, compression, yuvoutputext):
-    """Compare OpenColorIO color transformations between FFmpeg and oiiotool."""
-    oiiotool_out = os.path.join(testoutputdir, f"{testname}_oiiotool_{format}.{outputext}")
-    yuv_oiiotool_out = os.path.join(testoutputdir, f"{testname}_oiiotool_{format}.{yuvoutputext}")
-    ffmpeg_out = os.path.join(testoutputdir, f"{testname}_ffmpeg_{format}.{yuvoutputext}")
-    log_file = os.path.join(testoutputdir, f"{testname}_{format}_yuv.log")
+    compare_renders(testname, input_file, ocio_params, ffmpeg_args, oiiotool_out, ffmpeg_out,
+                    pix_fmt, min_psnr, log_file, reference)
 
-    # Clear log file
+
+def transform_args(ocio_config, input_space, output_space, display, view, format, **_):
+    """colorspace_args() or display_args(), whichever kind of transform the case has."""
+    if output_space:
+        return colorspace_args(ocio_config, input_space, output_space, format)
+    return display_args(ocio_config, input_space, display, view, format)
+
+def agreement_args(ocio_config, input_space, output_space, display, view, format, **_):
+    return transform_args(ocio_config, input_space, output_space, display, view, format)[0]
+
+@matrix.parametrize("test_reference_backends_agree", "testname, input_file, outputext, ocio_config, input_space, output_space, display, view, format, min_psnr")
+def test_reference_backends_agree(testname, input_file, outputext, ocio_config, input_space, output_space, display, view, format, min_psnr, case_dir):
+    """The in-process PyOpenColorIO reference (ocioref) must match oiiotool's render of the same arguments."""
+    if not ocioref.available():
+        pytest.skip("PyOpenColorIO is not installed")
+    oiiotool_out = os.path.join(case_dir, f"{testname}_oiiotool_{format}.{outputext}")
+    log_file = os.path.join(case_dir, f"{testname}_{format}_agree.log")
+    with open(log_file, "w") as f:
+        f.write(f"Test: {testname}\nFormat: {format}\n\n")
+
+    oiio_args = agreement_args(ocio_config, input_space, output_space, display, view, format)
+    jobs = [
+        jobgraph.Job("oiiotool", lambda: shared_oiiotool(input_file, oiio_args, oiiotool_out, log_file), cpus=JOB_CPUS),
+        # oiiotool processes in float and only quantizes the result.
+        jobgraph.Job("ocioref", lambda: ocioref.render(input_file, oiio_args, bitdepth="float", threads=JOB_CPUS,
+                                                       log_file=log_file), cpus=JOB_CPUS),
+    ]
+    jobgraph.run_jobs(jobs, log_file=log_file)
+    check_psnr(imagereaders.read_image(oiiotool_out, FFMPEG_BIN), jobs[1].result, min_psnr, testname,
+               f"{testname}_ocioref", log_file, error_map=f"{os.path.splitext(oiiotool_out)[0]}_ocioref_errors",
+               input_file=input_file)
+
+
+@matrix.parametrize("test_ocio_precision_sweep", "testname, input_file, outputext, ocio_config, input_space, output_space, display, view, format, max_code_error, min_psnr, reference")
+def test_ocio_precision_sweep(testname, input_file, outputext, ocio_config, input_space, output_space, display, view, format, max_code_error, min_psnr, reference, case_dir):
+    """
+    Exhaustive precision check on a code-ramp input holding every code value
+    of an integer format: the error of every input code must stay within
+    max_code_error output codes. The per-code error curve is written to
+    <testname>_precision.npy/.json.
+    """
+    reference_out = os.path.join(case_dir, f"{testname}_oiiotool_{format}.{outputext}")
+    ffmpeg_out = os.path.join(case_dir, f"{testname}_ffmpeg_{format}.{outputext}")
+    log_file = os.path.join(case_dir, f"{testname}_{format}_precision.log")
     with open(log_file, "w") as f:
         f.write(f"Test: {testname}\nFormat: {format}\n\n")
 
-    if format in ("rgb48", "rgba64", "gbrp16le"):
-        oiioformat = "uint16"
-    elif format in ("gbrp10le"):
-        oiioformat = "uint10"
-    elif format in ("gbrp12le"):
-        oiioformat = "uint12"
-    elif format in ("gbrpf16le", "gbrapf16le"):
-        oiioformat = "half"
-    elif format in ("gbrpf32le", "gbrapf32le"):
-        oiioformat = "float"
+    oiio_args, ffmpeg_args = transform_args(ocio_config, input_space, output_space, display, view, format)
+    if reference_backend(reference) == "ocioref":
+        if not ocioref.available():
+            pytest.skip("PyOpenColorIO is not installed (reference: ocioref)")
+        reference_job = jobgraph.Job(
+            "ocioref", lambda: ocioref.render(input_file, oiio_args, threads=JOB_CPUS, log_file=log_file), cpus=JOB_CPUS
+        )
     else:
-        oiioformat = "uint8"
-
-    yuvconvert = "scale=in_color_matrix=bt709:sws_dither=none:out_color_matrix=bt709,"
-    if "yuv" not in out_format:
-        yuvconvert = ""
-
-    # ffmpeg command
-    ffmpeg_cmd = (
-        f"{FFMPEG_BIN} -y -i {input_file} "
-        f"-vf \"ocio=config={ocio_config}:input={input_space}:display={display}:view={view}:format={format},{yuvconvert}format={out_format}\" "
-        f" -strict -1 {compression} "
-        f"{ffmpeg_out}"
+        reference_job = jobgraph.Job(
+            "oiiotool",
+            lambda: imagereaders.read_image(shared_oiiotool(input_file, oiio_args, reference_out, log_file), FFMPEG_BIN),
+            cpus=JOB_CPUS,
+        )
+    jobgraph.run_jobs([
+        reference_job,
+        jobgraph.Job("ffmpeg", lambda: shared_ffmpeg(input_file, ffmpeg_args, ffmpeg_out, log_file), cpus=JOB_CPUS),
+    ], log_file=log_file)
+
+    reference_image = reference_job.result
+    test_image = imagereaders.read_image(ffmpeg_out, FFMPEG_BIN)
+    curve = imagecompare.precision_curve(imagereaders.read_image(input_file, FFMPEG_BIN), reference_image, test_image)
+    summary = imagecompare.write_precision_curve(curve, os.path.join(case_dir, f"{testname}_precision"))
+    psnr = imagecompare.compare_images(reference_image, test_image)["psnr"]
+    msg = imagecompare.format_precision(summary) + f"Average PSNR: {psnr:.4f} dB\n"
+    print(msg, file=os.sys.stderr)
+    with open(log_file, "a") as f:
+        f.write(msg)
+
+    missing = [channel["codes"] for channel in summary["channels"] if channel["codes"] != summary["levels"]]
+    assert not missing, f"{input_file} is not a full code ramp: {missing} of {summary['levels']} codes"
+    passed = summary["max_abs_error_codes"] <= max_code_error and psnr > min_psnr
+    record_result(testname, os.path.basename(ffmpeg_out), psnr, min_psnr, passed,
+                  max_code_error=summary['max_abs_error_codes'], precision_curve=summary['curve'])
+
+    assert summary["max_abs_error_codes"] <= max_code_error, (
+        f"Precision sweep failed: max error {summary['max_abs_error_codes']:.3g} codes is above "
+        f"the allowed {max_code_error} (worst input codes in {summary['curve']})"
     )
-    run_cmd(ffmpeg_cmd, log_file)
+    assert psnr > min_psnr, f"Average PSNR ({psnr}) is not greater than the allowed threshold ({min_psnr})."
 
 
-    # oiiotool command
-    oiiotool_cmd = (
-        f"oiiotool {input_file} "
-        f"--colorconfig {ocio_config} "
-        f"--iscolorspace '{input_space}' "
-        f"--ociodisplay '{display}' '{view}' "
-        f"-d {oiioformat} "
-        f"-o {oiiotool_out}"
-    )
-    run_cmd(oiiotool_cmd, log_file)
+@matrix.parametrize("test_ocio_vs_oiiotool_2_yuv444", "testname, input_file, outputext, ocio_config, input_space, display, view, format, out_format, min_psnr, compression, yuvoutputext")
+def test_ocio_vs_oiiotool_2_yuv444(testname, input_file, outputext, ocio_config, input_space, display, view, format, out_format, min_psnr, compression, yuvoutputext, case_dir):
+    """Compare OpenColorIO color transformations between FFmpeg and oiiotool."""
+    oiiotool_out = os.path.join(case_dir, f"{testname}_oiiotool_{format}.{outputext}")
+    yuv_oiiotool_out = os.path.join(case_dir, f"{testname}_oiiotool_{format}.{yuvoutputext}")
+    ffmpeg_out = os.path.join(case_dir, f"{testname}_ffmpeg_{format}.{yuvoutputext}")
+    log_file = os.path.join(case_dir, f"{testname}_{format}_yuv.log")
+
+    # Clear log file
+    with open(log_file, "w") as f:
+        f.write(f"Test: {testname}\nFormat: {format}\n\n")
+
+    oiio_args, ffmpeg_args, yuvconvert = yuv_args(ocio_config, input_space, display, view, format, out_format, compression)
 
     if yuvconvert != "":
         yuvconvert = f" -vf {yuvconvert[0:-1]} "
 
-    ffmpeg_oiio_cmd = (
-        f"{FFMPEG_BIN} -y -i {oiiotool_out} "
-        f"-pix_fmt {out_format} {yuvconvert} {compression} -strict -1 "
-        f"{yuv_oiiotool_out}"
+    # The re-encode reads the shared reference render, so cases with the same
+    # reference and encoding also share the re-encode.
+    def ffmpeg_oiio_cmd(reference):
+        return (
+            f"{FFMPEG_BIN} -y {FFMPEG_THREADS} -i {reference} "
+            f"-pix_fmt {out_format} {yuvconvert} {compression} -strict -1 "
+        )
+
+    # Only the re-encode of the oiiotool reference depends on another job.
+    oiiotool_job = jobgraph.Job(
+        "oiiotool", lambda: shared_oiiotool(input_file, oiio_args, oiiotool_out, log_file), cpus=JOB_CPUS
     )
-    run_cmd(ffmpeg_oiio_cmd, log_file)
-
+    jobgraph.run_jobs([
+        jobgraph.Job("ffmpeg", lambda: shared_ffmpeg(input_file, ffmpeg_args, ffmpeg_out, log_file), cpus=JOB_CPUS),
+        oiiotool_job,
+        jobgraph.Job(
+            "ffmpeg_oiiotool",
+            lambda: shared_cmd(ffmpeg_oiio_cmd(oiiotool_job.result), yuv_oiiotool_out, log_file),
+            deps=["oiiotool"], cpus=JOB_CPUS,
+        ),
+    ], log_file=log_file)
+
+    # Both outputs decode as Y/U/V planes, which can't be binned by the RGB input's code values.
     psnr_comparison(yuv_oiiotool_out, ffmpeg_out, max_psnr_allowed=min_psnr, testname=testname, log_file=log_file)
 
 
+@matrix.parametrize("test_ocio_sequence_vs_oiiotool", "testname, source, first, last, ocio_config, input_space, display, view, format, pix_fmt, min_psnr")
+def test_ocio_sequence_vs_oiiotool(testname, source, first, last, ocio_config, input_space, display, view, format, pix_fmt, min_psnr, case_dir):
+    """Compare a whole image sequence frame by frame, streaming both sides."""
+    if not os.path.exists(sequencecheck.frame_path(source, first, 5)):
+        pytest.skip(f"Sequence not found: {source} (set OCIOTEST_SPARKS_EXRS)")
+
+    log_file = os.path.join(case_dir, f"{testname}_sequence.log")
+    with open(log_file, "w") as f:
+        f.write(f"Test: {testname}\nFrames: {first}-{last}\n\n")
+
+    sequencecheck.FFMPEG_BIN = FFMPEG_BIN
+    sequencecheck.THREADS = JOB_CPUS
+    vf = f"ocio=config={ocio_config}:input={input_space}:display={display}:view={view}:format={format}:threads={JOB_CPUS}"
+    oiio_args = ["--colorconfig", ocio_config, "--iscolorspace", input_space, "--ociodisplay", display, view]
+    result = sequencecheck.validate_sequence(
+        source, first, last, vf, oiio_args, os.path.join(case_dir, "frames"), min_psnr,
+        pix_fmt=pix_fmt, log_file=log_file,
+    )
+
+    record_result(testname, os.path.basename(source), result['worst_psnr'], min_psnr, result['passed'],
+                  worst_frame=result['worst_frame'], frames=result['frames'])
+
+    assert not result["error"], f"Sequence failed: {result['error']}"
+    assert not result["aborted"], (
+        f"Frame {result['frames'][-1]['frame']} PSNR ({result['frames'][-1]['psnr']}) is not greater than "
+        f"the allowed threshold ({min_psnr}), aborted after {result['compared']} frames."
+    )
+    assert result["passed"], (
+        f"Sequence failed: compared {result['compared']}/{result['expected']} frames, "
+        f"worst frame {result['worst_frame']} PSNR {result['worst_psnr']}"
+    )
+
+
 if __name__ == "__main__":
     import sys
     sys.exit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,345 @@
+"""
+Persistent reference renderer built on the PyOpenColorIO and OpenImageIO
+bindings.
+
+Every oiiotool reference pays process startup and parses the OCIO config and
+bakes its processors from scratch, for the ACES studio config on every case.
+This worker stays up for the whole session instead: configs are loaded once
+and CPU processors are cached, keyed by (config, transform, context,
+direction). The tests send reference renders to it over a unix socket
+(one JSON line per request and reply), see --ocio-worker in conftest:
+
+    python ocioworker.py serve --socket /tmp/ocioworker.sock
+    OCIOTEST_WORKER_SOCKET=/tmp/ocioworker.sock pytest ociotest.py
+    python ocioworker.py stats --socket /tmp/ocioworker.sock
+
+Only the oiiotool arguments the tests use are understood (--colorconfig,
+--iscolorspace, --colorconvert, --ociodisplay, --ociofiletransform, -d); cases
+with any other argument still run oiiotool.
+"""
+import argparse
+import collections
+import functools
+import json
+import os
+import shlex
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import cmdrunner
+
+SOCKET = os.environ.get("OCIOTEST_WORKER_SOCKET")
+PROCESSOR_CACHE_SIZE = 64
+CONNECT_TIMEOUT = 30
+RENDER_TIMEOUT = 600
+
+
+# ---------------------------------------------------------------------------
+# Client
+
+def parse_oiio_args(oiio_args):
+    """
+    The render request (config, transforms, output data type) equivalent to
+    an oiiotool argument list, or None when it uses anything else.
+    """
+    tokens = shlex.split(" ".join(oiio_args))
+    request = {"config": os.environ.get("OCIO"), "transforms": [], "format": None}
+    colorspace = None
+    i = 0
+    while i < len(tokens):
+        option, _, modifiers = tokens[i].partition(":")
+        mods = dict(m.split("=", 1) for m in modifiers.split(":") if "=" in m)
+        context = dict(zip(mods.get("key", "").split(","), mods.get("value", "").split(","))) if "key" in mods else {}
+        inverse = mods.get("inverse", "0") not in ("0", "")
+        if option == "--colorconfig":
+            request["config"] = tokens[i + 1]
+            i += 2
+        elif option == "--iscolorspace":
+            colorspace = tokens[i + 1]
+            i += 2
+        elif option == "--colorconvert":
+            request["transforms"].append(
+                {"type": "colorspace", "src": tokens[i + 1], "dst": tokens[i + 2], "context": context}
+            )
+            colorspace = tokens[i + 2]
+            i += 3
+        elif option == "--ociodisplay":
+            if colorspace is None:
+                return None
+            request["transforms"].append({
+                "type": "display", "src": colorspace, "display": tokens[i + 1], "view": tokens[i + 2],
+                "inverse": inverse, "context": context,
+            })
+            i += 3
+        elif option == "--ociofiletransform":
+            request["transforms"].append(
+                {"type": "file", "src": os.path.abspath(tokens[i + 1]), "inverse": inverse, "context": context}
+            )
+            i += 2
+        elif option == "-d":
+            request["format"] = tokens[i + 1]
+            i += 2
+        else:
+            return None
+    if not request["transforms"]:
+        return None
+    if request["config"] and os.path.isfile(request["config"]):
+        request["config"] = os.path.abspath(request["config"])
+    return request
+
+
+def active():
+    return bool(SOCKET)
+
+
+def call(request, timeout=RENDER_TIMEOUT):
+    """Send one request to the worker and return its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(SOCKET)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    assert line, f"ocioworker at {SOCKET} closed the connection"
+    return json.loads(line)
+
+
+@functools.lru_cache(maxsize=None)
+def renderer_version():
+    reply = call({"op": "ping"}, CONNECT_TIMEOUT)
+    return f"ocioworker OCIO {reply['ocio']} OIIO {reply['oiio']}"
+
+
+def renderer(oiio_args):
+    """
+    The name of the worker build when it will render oiio_args (it is part
+    of the reference cache key), None when oiiotool has to.
+    """
+    if not active() or parse_oiio_args(oiio_args) is None:
+        return None
+    return renderer_version()
+
+
+def render(input_file, oiio_args, output, log_file=None):
+    """The worker's equivalent of 'oiiotool input_file oiio_args -o output'."""
+    request = parse_oiio_args(oiio_args)
+    request.update(op="render", input=os.path.abspath(input_file), output=os.path.abspath(output))
+    t = time.time()
+    reply = call(request)
+    _log(
+        f"ocioworker: {input_file} {' '.join(oiio_args)} -o {output}\n"
+        f"  {time.time() - t:.3f}s, processors {'cached' if reply.get('cached') else 'built'}\n",
+        log_file,
+    )
+    assert reply["ok"], f"ocioworker failed to render {output}: {reply.get('error')}"
+
+
+def start(socket_path, log_file=None):
+    """Start a worker serving socket_path, returns the process once it answers (None if it can't start)."""
+    with open(log_file or os.devnull, "a") as log:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", "--socket", socket_path],
+            stdout=subprocess.DEVNULL, stderr=log,
+        )
+    global SOCKET
+    SOCKET = socket_path
+    deadline = time.time() + CONNECT_TIMEOUT
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            renderer_version()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    proc.wait()
+    SOCKET = None
+    return None
+
+
+def stop(proc):
+    try:
+        call({"op": "shutdown"}, CONNECT_TIMEOUT)
+        proc.wait(timeout=CONNECT_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        proc.kill()
+        proc.wait()
+
+
+def _log(msg, log_file):
+    print(msg, file=os.sys.stderr)
+    if log_file:
+        with cmdrunner.LOG_LOCK, open(log_file, "a") as f:
+            f.write(msg)
+
+
+# ---------------------------------------------------------------------------
+# Server
+
+class Renderer:
+    """Config and CPU processor caches shared by every connection of the worker."""
+
+    def __init__(self, cache_size=PROCESSOR_CACHE_SIZE):
+        import OpenImageIO
+        import PyOpenColorIO
+
+        self.ocio = PyOpenColorIO
+        self.oiio = OpenImageIO
+        self.cache_size = cache_size
+        self.configs = {}
+        self.processors = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def config(self, path):
+        """The config at path (or an ocio:// URI), reloaded when the file changes."""
+        stamp = os.stat(path).st_mtime_ns if os.path.isfile(path) else None
+        with self.lock:
+            entry = self.configs.get(path)
+            if entry and entry[0] == stamp:
+                return entry[1]
+        config = self.ocio.Config.CreateFromFile(path)
+        with self.lock:
+            self.configs[path] = (stamp, config)
+            self.stats["config_loads"] += 1
+        return config
+
+    def transform(self, spec):
+        ocio = self.ocio
+        if spec["type"] == "colorspace":
+            return ocio.ColorSpaceTransform(src=spec["src"], dst=spec["dst"])
+        if spec["type"] == "display":
+            return ocio.DisplayViewTransform(src=spec["src"], display=spec["display"], view=spec["view"])
+        return ocio.FileTransform(src=spec["src"])
+
+    def processor(self, config_path, spec):
+        """
+        The CPU processor of one transform, built once per (config, transform,
+        context, direction); an edited config file gets new processors.
+        """
+        stamp = os.stat(config_path).st_mtime_ns if config_path and os.path.isfile(config_path) else None
+        key = (
+            config_path,
+            stamp,
+            json.dumps({k: v for k, v in spec.items() if k not in ("context", "inverse")}, sort_keys=True),
+            tuple(sorted(spec.get("context", {}).items())),
+            bool(spec.get("inverse")),
+        )
+        with self.lock:
+            cpu = self.processors.get(key)
+            if cpu is not None:
+                self.processors.move_to_end(key)
+                self.stats["processor_hits"] += 1
+                return cpu, True
+        config = self.config(config_path) if config_path else self.ocio.GetCurrentConfig()
+        context = config.getCurrentContext()
+        if spec.get("context"):
+            context = context.createEditableCopy()
+            for name, value in spec["context"].items():
+                context.setStringVar(name, value)
+        direction = self.ocio.TRANSFORM_DIR_INVERSE if spec.get("inverse") else self.ocio.TRANSFORM_DIR_FORWARD
+        cpu = config.getProcessor(context, self.transform(spec), direction).getDefaultCPUProcessor()
+        with self.lock:
+            self.processors[key] = cpu
+            while len(self.processors) > self.cache_size:
+                self.processors.popitem(last=False)
+            self.stats["processor_builds"] += 1
+        return cpu, False
+
+    def render(self, request):
+        oiio = self.oiio
+        buf = oiio.ImageBuf(request["input"])
+        # Work in float like oiiotool, keeping the metadata of the input.
+        if not buf.read(0, 0, True, oiio.FLOAT):
+            raise RuntimeError(buf.geterror())
+        pixels = buf.get_pixels(oiio.FLOAT)
+        if pixels.shape[-1] < 3:
+            raise RuntimeError(f"{request['input']}: {pixels.shape[-1]} channels, need RGB")
+        rgb = pixels[..., :3].copy()
+        cached = True
+        for spec in request["transforms"]:
+            cpu, hit = self.processor(request["config"], spec)
+            cached = cached and hit
+            # Applied in place, with the GIL released.
+            cpu.applyRGB(rgb)
+        pixels[..., :3] = rgb
+        buf.set_pixels(buf.roi, pixels)
+        fmt = oiio.TypeDesc(request["format"]) if request["format"] else buf.nativespec().format
+        if not buf.write(request["output"], fmt):
+            raise RuntimeError(buf.geterror())
+        self.stats["renders"] += 1
+        return cached
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            request = json.loads(line)
+            renderer = self.server.renderer
+            op = request.get("op")
+            try:
+                if op == "ping":
+                    reply = {"ok": True, "ocio": renderer.ocio.__version__, "oiio": renderer.oiio.__version__}
+                elif op == "stats":
+                    with renderer.lock:
+                        reply = {"ok": True, **renderer.stats, "configs": len(renderer.configs),
+                                 "processors": len(renderer.processors)}
+                elif op == "render":
+                    reply = {"ok": True, "cached": renderer.render(request)}
+                elif op == "shutdown":
+                    reply = {"ok": True}
+                    threading.Thread(target=self.server.shutdown).start()
+                else:
+                    reply = {"ok": False, "error": f"unknown op {op!r}"}
+            except Exception as exc:
+                reply = {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, cache_size=PROCESSOR_CACHE_SIZE):
+    renderer = Renderer(cache_size)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with Server(socket_path, _Handler) as server:
+        server.renderer = renderer
+        print(f"ocioworker serving on {socket_path}", file=os.sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Persistent OCIO reference renderer.")
+    parser.add_argument("command", choices=["serve", "stats", "stop"])
+    parser.add_argument("--socket", default=SOCKET or "./output/ocioworker.sock")
+    parser.add_argument("--cache-size", type=int, default=PROCESSOR_CACHE_SIZE,
+                        help="Number of CPU processors to keep")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global SOCKET
+    args = parse_args(argv)
+    if args.command == "serve":
+        os.makedirs(os.path.dirname(os.path.abspath(args.socket)), exist_ok=True)
+        serve(args.socket, args.cache_size)
+        return 0
+    SOCKET = args.socket
+    reply = call({"op": args.command if args.command == "stats" else "shutdown"}, CONNECT_TIMEOUT)
+    print(json.dumps(reply, indent=2))
+    return 0 if reply["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Per-stage profiling of the ffmpeg ocio pipeline.
+
+The same input is run through progressively larger filter graphs, all with
+-benchmark and -progress pipe:1:
+
+    decode   decode only, to the null muxer
+    ocio     decode + ocio filter, to null
+    scale    decode + ocio + scale to the output pixel format, to null
+    encode   the full graph, encoded to a file
+
+Each stage's cost is the difference between its run and the previous one.
+Progress is parsed live while ffmpeg runs, which gives the time to the
+first frame (startup, OCIO processor creation) separately from the steady
+state frame rate. With --benchmark-all the per-frame decode/encode timings
+ffmpeg prints are summed as well.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+import benchmark
+import cmdrunner
+
+STAGES = ("decode", "ocio", "scale", "encode")
+
+# "bench: utime=1.234s stime=0.123s rtime=2.345s" and "bench: maxrss=123456KiB"
+BENCH_RE = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s")
+MAXRSS_RE = re.compile(r"bench: maxrss=(\d+)\s*KiB")
+# -benchmark_all: "bench:     1234 user      56 sys     7890 real decode_video 0.0"
+BENCH_ALL_RE = re.compile(r"bench:\s+(\d+) user\s+(\d+) sys\s+(\d+) real (\w+)")
+
+
+def stage_command(stage, source, first, frames, threads, pix_fmt, codec, resolution, output, benchmark_all=False,
+                  ffmpeg_args=()):
+    """
+    ffmpeg command for one stage, every stage includes the ones before it.
+    ffmpeg_args (e.g. -threads, -filter_threads) go before the input.
+    """
+    filters = []
+    if resolution:
+        filters.append(f"scale={resolution.replace('x', ':')}")
+    if stage != "decode":
+        filters.append(
+            f"ocio=config={benchmark.OCIO_CONFIG}:input={benchmark.INPUT_SPACE}:display={benchmark.DISPLAY}:"
+            f"view={benchmark.VIEW}:format={pix_fmt}:threads={threads}"
+        )
+    if stage in ("scale", "encode"):
+        filters.append(benchmark.SCALE)
+
+    codec_args = benchmark.CODECS[codec][0].split()
+    if stage == "encode":
+        tail = codec_args + [output]
+    elif stage == "scale":
+        # Convert to the encoder's pixel format, but don't encode.
+        tail = ["-pix_fmt", codec_args[codec_args.index("-pix_fmt") + 1], "-f", "null", "-"]
+    else:
+        tail = ["-f", "null", "-"]
+
+    cmd = [benchmark.FFMPEG_BIN, "-y", "-nostats", "-benchmark"]
+    if benchmark_all:
+        cmd.append("-benchmark_all")
+    cmd += list(ffmpeg_args)
+    cmd += ["-progress", "pipe:1", "-stats_period", "0.05",
+            "-framerate", "24", "-start_number", str(first), "-i", source.replace("#", "%05d"),
+            "-frames:v", str(frames)]
+    if filters:
+        cmd += ["-vf", ",".join(filters)]
+    return cmd + tail
+
+
+def run_profiled(cmd, log_file=None):
+    """
+    Run one ffmpeg command, parsing -progress from stdout and the -benchmark
+    lines from stderr as they arrive.
+    """
+    bench = {"utime": None, "stime": None, "rtime": None, "maxrss_kib": None, "steps": {}}
+    progress = {"frames": 0, "first_frame_time": None}
+    start = time.perf_counter()
+
+    def on_line(stream, line):
+        if stream == "stdout":
+            key, _, value = line.strip().partition("=")
+            if key == "frame" and int(value) > progress["frames"]:
+                progress["frames"] = int(value)
+                if progress["first_frame_time"] is None:
+                    progress["first_frame_time"] = time.perf_counter() - start
+            return
+        m = BENCH_ALL_RE.search(line)
+        if m:
+            user, system, real, label = m.groups()
+            step = bench["steps"].setdefault(label, {"count": 0, "user": 0.0, "sys": 0.0, "real": 0.0})
+            step["count"] += 1
+            step["user"] += int(user) / 1e6
+            step["sys"] += int(system) / 1e6
+            step["real"] += int(real) / 1e6
+            return
+        m = BENCH_RE.search(line)
+        if m:
+            bench["utime"], bench["stime"], bench["rtime"] = (float(v) for v in m.groups())
+            return
+        m = MAXRSS_RE.search(line)
+        if m:
+            bench["maxrss_kib"] = int(m.group(1))
+
+    result = cmdrunner.run(cmd, log_file, on_line=on_line, progress_interval=1.0)
+    frames = progress["frames"]
+    first_frame_time = progress["first_frame_time"]
+
+    # ffmpeg's own rtime leaves out process startup; everything after the
+    # first progress update counts as steady state.
+    wall = bench["rtime"] or result.elapsed
+    steady_time = result.elapsed - (first_frame_time or 0.0)
+    return {
+        "wall": wall,
+        "frames_done": frames,
+        "fps": frames / wall if wall else 0.0,
+        "startup": first_frame_time,
+        "steady_fps": (frames - 1) / steady_time if frames > 1 and steady_time > 0 else None,
+        "utime": bench["utime"] if bench["utime"] is not None else result.cpu_user,
+        "stime": bench["stime"] if bench["stime"] is not None else result.cpu_sys,
+        "maxrss_kib": bench["maxrss_kib"] or result.max_rss_kib,
+        "steps": bench["steps"],
+    }
+
+
+def profile(source, first, frames, threads, pix_fmt, codec, resolution, output_dir, repeat=3, benchmark_all=False):
+    """
+    Run every stage repeat times and return the median cumulative measurements
+    per stage plus the derived per-stage cost.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    log_file = os.path.join(output_dir, "profiling.log")
+    ext = benchmark.CODECS[codec][1] or "nut"
+    output = os.path.join(output_dir, f"profile.{ext}")
+
+    stages = {}
+    for stage in STAGES:
+        cmd = stage_command(stage, source, first, frames, threads, pix_fmt, codec, resolution, output, benchmark_all)
+        runs = [run_profiled(cmd, log_file) for _ in range(repeat)]
+        stages[stage] = {
+            key: statistics.median(r[key] for r in runs)
+            for key in ("wall", "fps", "startup", "steady_fps", "utime", "stime", "maxrss_kib")
+            if all(r[key] is not None for r in runs)
+        }
+        stages[stage]["frames_done"] = runs[0]["frames_done"]
+        stages[stage]["steps"] = runs[-1]["steps"]
+
+    previous = 0.0
+    for stage in STAGES:
+        cumulative = stages[stage]
+        cost = max(cumulative["wall"] - previous, 0.0)
+        cumulative["stage_time"] = cost
+        cumulative["stage_ms_per_frame"] = 1000.0 * cost / frames if frames else None
+        cumulative["stage_fps"] = frames / cost if cost else None
+        previous = cumulative["wall"]
+    return stages
+
+
+def format_profile(stages):
+    def num(value, fmt):
+        return "-" if value is None else format(value, fmt)
+
+    header = ("Stage", "Wall", "fps", "Startup", "Stage time", "ms/frame", "Stage fps", "CPU")
+    rows = [
+        (
+            stage,
+            num(s.get("wall"), ".3f"),
+            num(s.get("fps"), ".2f"),
+            num(s.get("startup"), ".3f"),
+            num(s.get("stage_time"), ".3f"),
+            num(s.get("stage_ms_per_frame"), ".2f"),
+            num(s.get("stage_fps"), ".2f"),
+            num(s["utime"] + s["stime"] if "utime" in s and "stime" in s else None, ".2f"),
+        )
+        for stage, s in stages.items()
+    ]
+    widths = [max(len(v) for v in column) for column in zip(header, *rows)]
+    lines = ["  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip() for row in [header] + rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+
+    steps = stages["encode"].get("steps")
+    if steps:
+        lines.append("")
+        lines.append("ffmpeg -benchmark_all totals (full graph):")
+        for label, step in sorted(steps.items()):
+            lines.append(f"  {label}: {step['real']:.3f}s real over {step['count']} calls")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=os.environ.get("OCIOTEST_SPARKS_EXRS"),
+                        help="EXR sequence with '#' for the frame number (default: synthetic)")
+    parser.add_argument("--first", type=int, default=6100)
+    parser.add_argument("--frames", type=int, default=48)
+    parser.add_argument("--threads", type=int, default=4, help="ocio threads=")
+    parser.add_argument("--pix-fmt", default="rgb48", help="ocio format=")
+    parser.add_argument("--codec", default="prores_ks", choices=sorted(benchmark.CODECS))
+    parser.add_argument("--resolution", default=None, help="Scale the source to WIDTHxHEIGHT first")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--benchmark-all", action="store_true", help="Also collect ffmpeg's per-frame timings")
+    parser.add_argument("--output-dir", default="./outputbenchmark")
+    parser.add_argument("--json", default=None, help="Write the breakdown to this file")
+    parser.add_argument("--ffmpeg", default=benchmark.FFMPEG_BIN)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    benchmark.FFMPEG_BIN = args.ffmpeg
+    source, first = args.source, args.first
+    if not source or not os.path.exists(source.replace("#", f"{first:05d}")):
+        source, first = benchmark.synthetic_sequence(1920, 1080, args.frames)
+
+    stages = profile(source, first, args.frames, args.threads, args.pix_fmt, args.codec,
+                     args.resolution, args.output_dir, args.repeat, args.benchmark_all)
+    print(format_profile(stages))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(stages, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Content-addressed cache of oiiotool reference renders.
+
+A reference image only depends on the input media, the OCIO config (and any
+LUTs it pulls in), the oiiotool arguments and the oiiotool build, so when none
+of those change we can reuse the previous render and only re-run FFmpeg.
+"""
+import functools
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import subprocess
+
+REFCACHE_DIR = os.environ.get("OCIOTEST_REFCACHE_DIR", "./refcache")
+REFCACHE_MAX_BYTES = int(float(os.environ.get("OCIOTEST_REFCACHE_MAX_MB", "4096")) * 1024 * 1024)
+OIIOTOOL_BIN = "oiiotool"
+
+# Set from the --refresh-references pytest option, forces every reference to be re-rendered.
+REFRESH = False
+
+_DIGESTS = {}
+
+
+def file_digest(path):
+    """sha256 of a file's contents, memoized on (path, size, mtime)."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _DIGESTS.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _DIGESTS[memo_key] = digest
+    return digest
+
+
+def config_files(config):
+    """
+    Return the files an OCIO config references (FileTransform src entries),
+    resolved against its search_path. Unresolvable entries (e.g. ones using
+    context variables) are returned as-is so they still take part in a key.
+    """
+    with open(config) as f:
+        text = f.read()
+    config_dir = os.path.dirname(os.path.abspath(config))
+
+    search_path = []
+    match = re.search(r"^search_path:[ \t]*(.*)$", text, re.MULTILINE)
+    if match:
+        value = match.group(1).strip().strip("\"'")
+        if value:
+            search_path = value.split(":")
+        else:
+            # YAML list form:
+            #   search_path:
+            #     - luts
+            for line in text[match.end():].lstrip("\n").splitlines():
+                item = re.match(r"^\s+-\s*(.+)$", line)
+                if not item:
+                    break
+                search_path.append(item.group(1).strip().strip("\"'"))
+    search_dirs = [os.path.join(config_dir, p) for p in search_path] or [config_dir]
+
+    files = []
+    for match in re.finditer(r"\bsrc:\s*(\"[^\"]*\"|'[^']*'|[^,}\n]+)", text):
+        src = match.group(1).strip().strip("\"'")
+        resolved = None
+        for directory in search_dirs:
+            candidate = os.path.join(directory, src)
+            if os.path.isfile(candidate):
+                resolved = os.path.normpath(candidate)
+                break
+        files.append(resolved or src)
+    return files
+
+
+def _describe_file(path):
+    parts = [f"file:{path}:{file_digest(path)}"]
+    if path.endswith(".ocio"):
+        for dep in config_files(path):
+            if os.path.isfile(dep):
+                parts.append(f"dep:{dep}:{file_digest(dep)}")
+            else:
+                parts.append(f"dep:{dep}:unresolved")
+    return parts
+
+
+@functools.lru_cache(maxsize=None)
+def oiiotool_version():
+    try:
+        result = subprocess.run([OIIOTOOL_BIN, "--version"], capture_output=True, text=True)
+    except FileNotFoundError:
+        return "unavailable"
+    return result.stdout.strip() or result.stderr.strip()
+
+
+def reference_key(input_file, oiio_args, outputext, renderer=None):
+    """
+    Hash everything that can influence an oiiotool render: the input media,
+    the argument list, any file named in the arguments (configs, LUTs and the
+    files those configs reference), $OCIO, the output type and oiiotool version
+    (or the version of the renderer standing in for oiiotool, see ocioworker).
+    """
+    parts = [
+        f"oiiotool:{oiiotool_version()}" if renderer is None else f"renderer:{renderer}",
+        f"input:{file_digest(input_file)}",
+        f"args:{chr(0).join(oiio_args)}",
+        f"ext:{outputext.lstrip('.')}",
+    ]
+    for token in shlex.split(" ".join(oiio_args)):
+        if os.path.isfile(token):
+            parts.extend(_describe_file(token))
+    env_config = os.environ.get("OCIO", "")
+    parts.append(f"env:{env_config}")
+    if os.path.isfile(env_config):
+        parts.extend(_describe_file(env_config))
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def _entry_path(key, outputext):
+    return os.path.join(REFCACHE_DIR, key[:2], f"{key}.{outputext.lstrip('.')}")
+
+
+def fetch(key, output):
+    """Copy a cached render to output, returns False on a miss (or when refreshing)."""
+    if REFRESH:
+        return False
+    entry = _entry_path(key, os.path.splitext(output)[1])
+    if not os.path.isfile(entry):
+        return False
+    # Touch the entry so eviction is least-recently-used rather than least-recently-written.
+    os.utime(entry)
+    shutil.copyfile(entry, output)
+    return True
+
+
+def store(key, output):
+    """Add a freshly rendered reference to the cache, then trim the cache to size."""
+    entry = _entry_path(key, os.path.splitext(output)[1])
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = f"{entry}.{os.getpid()}.tmp"
+    shutil.copyfile(output, tmp)
+    os.replace(tmp, entry)
+    evict()
+
+
+def evict(max_bytes=None):
+    """Remove least recently used entries until the cache fits in max_bytes."""
+    if max_bytes is None:
+        max_bytes = REFCACHE_MAX_BYTES
+    entries = []
+    total = 0
+    for root, _, names in os.walk(REFCACHE_DIR):
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
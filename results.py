@@ -0,0 +1,114 @@
+"""
+Per-worker PSNR result collection.
+
+Every worker process (or the single pytest process) appends its results as
+JSON lines to its own file under output/results/<run id>/ (and the timings
+of the commands it ran to a .commands file next to it), the controller
+merges them at the end of the session. Nothing is shared between processes
+except the run id, which is passed down through the environment.
+"""
+import glob
+import json
+import math
+import os
+import time
+
+import cmdrunner
+
+OUTPUT_DIR = os.environ.get("OCIOTEST_OUTPUT_DIR", "./output")
+
+
+def run_id():
+    """Identifier shared by the controller and all workers of one pytest session."""
+    return os.environ.setdefault("OCIOTEST_RUN_ID", f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+
+def worker_id():
+    return os.environ.get("PYTEST_XDIST_WORKER", "main")
+
+
+def run_dir(run=None):
+    """The directory of a run's (default: this run's) result files."""
+    return os.path.join(OUTPUT_DIR, "results", run or run_id())
+
+
+def record(result):
+    """Append one result dict to this worker's result file."""
+    directory = run_dir()
+    os.makedirs(directory, exist_ok=True)
+    line = json.dumps(result, default=_json_default)
+    with open(os.path.join(directory, f"{worker_id()}.jsonl"), "a") as f:
+        f.write(line + "\n")
+
+
+def command_timing(cmd, result):
+    """The wall time and resource usage of one command (a cmdrunner.CommandResult) as a dict."""
+    command = cmd if isinstance(cmd, str) else " ".join(cmd)
+    return {
+        "nodeid": os.environ.get("PYTEST_CURRENT_TEST", "").rsplit(" ", 1)[0] or None,
+        "tool": os.path.basename(command.split(None, 1)[0]) if command.strip() else None,
+        "command": command,
+        "elapsed": result.elapsed,
+        "cpu_user": result.cpu_user,
+        "cpu_sys": result.cpu_sys,
+        "max_rss_kib": result.max_rss_kib,
+        "rss_peak_sampled_kib": result.sampled_peak_rss_kib,
+        "rss_timeline": cmdrunner.downsample_rss(result.rss_samples),
+    }
+
+
+def record_command(cmd, result):
+    """Append the timing of one command to this worker's command file."""
+    directory = run_dir()
+    os.makedirs(directory, exist_ok=True)
+    line = json.dumps(command_timing(cmd, result))
+    with open(os.path.join(directory, f"{worker_id()}.commands"), "a") as f:
+        f.write(line + "\n")
+
+
+def collect_commands(run=None):
+    """The command timings written by every worker of a run."""
+    merged = []
+    for path in sorted(glob.glob(os.path.join(run_dir(run), "*.commands"))):
+        with open(path) as f:
+            merged.extend(json.loads(line) for line in f if line.strip())
+    return merged
+
+
+def collect(run=None):
+    """Merge the results written by every worker of a run, sorted by test id."""
+    merged = []
+    for path in sorted(glob.glob(os.path.join(run_dir(run), "*.jsonl"))):
+        with open(path) as f:
+            merged.extend(json.loads(line) for line in f if line.strip())
+    return sorted(merged, key=lambda r: r.get("nodeid", r["test"]))
+
+
+def write_summary(merged, path):
+    with open(path, "w") as f:
+        json.dump(merged, f, indent=2, default=_json_default)
+
+
+def format_table(merged):
+    """The PSNR summary table shown at the end of a run."""
+    header = ("Test", "Output file", "PSNR", "Min PSNR", "Result")
+    rows = [
+        (
+            r["test"],
+            r["file"],
+            "inf" if math.isinf(r["psnr"]) else f"{r['psnr']:.3f}",
+            f"{r['min_psnr']:.1f}",
+            "PASS" if r["passed"] else "FAIL",
+        )
+        for r in merged
+    ]
+    widths = [max(len(str(v)) for v in column) for column in zip(header, *rows)]
+    lines = ["  ".join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip() for row in [header] + rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return "\n".join(lines)
+
+
+def _json_default(value):
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Cannot serialize {type(value)}")
@@ -0,0 +1,439 @@
+"""
+SQLite history of test and timing results.
+
+Every pytest session (see conftest) and every timingtest.py run is stored in
+runs, together with the host, the ffmpeg and oiiotool builds and the git
+commit. results holds one row per test case (outcome, duration, PSNR and
+threshold), timings one row per command (wall and CPU time, peak RSS and
+the sampled RSS timeline as JSON [[seconds, KiB], ...]).
+
+    python resultsdb.py runs                  # the stored runs
+    python resultsdb.py report --last 5       # PSNR and runtime trends, drifting cases flagged
+    python resultsdb.py history <nodeid>      # one case across all runs
+
+A case is flagged when its PSNR moved by more than PSNR_DRIFT dB, its
+runtime by more than RUNTIME_DRIFT (relative, and RUNTIME_DRIFT_MIN seconds)
+against the median of its earlier runs, or its outcome changed; the report
+names the ffmpeg build of both runs so a change can be traced to a build.
+"""
+import argparse
+import datetime
+import functools
+import json
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+
+import refcache
+import results
+
+RESULTS_DB = os.environ.get("OCIOTEST_RESULTS_DB", "./resultsdb.sqlite")
+
+PSNR_DRIFT = 0.01
+RUNTIME_DRIFT = 0.25
+RUNTIME_DRIFT_MIN = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    started TEXT NOT NULL,
+    host TEXT,
+    platform TEXT,
+    cpu_count INTEGER,
+    git_commit TEXT,
+    ffmpeg_bin TEXT,
+    ffmpeg_version TEXT,
+    ffmpeg_sha256 TEXT,
+    oiiotool_version TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    nodeid TEXT NOT NULL,
+    test TEXT,
+    file TEXT,
+    outcome TEXT,
+    duration REAL,
+    psnr REAL,
+    min_psnr REAL,
+    passed INTEGER,
+    channels TEXT
+);
+CREATE TABLE IF NOT EXISTS timings (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    nodeid TEXT,
+    tool TEXT,
+    command TEXT,
+    elapsed REAL,
+    cpu_user REAL,
+    cpu_sys REAL,
+    max_rss_kib INTEGER,
+    rss_peak_sampled_kib INTEGER,
+    rss_timeline TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_kind_started ON runs(kind, started);
+CREATE INDEX IF NOT EXISTS runs_ffmpeg ON runs(ffmpeg_sha256);
+CREATE INDEX IF NOT EXISTS results_nodeid_run ON results(nodeid, run);
+CREATE INDEX IF NOT EXISTS results_run ON results(run);
+CREATE INDEX IF NOT EXISTS timings_run_nodeid ON timings(run, nodeid);
+CREATE INDEX IF NOT EXISTS timings_tool ON timings(tool, run);
+"""
+
+# nodeid -> {"outcome", "duration", "ffmpeg_bin"} for the cases of this session (see conftest).
+_CASES = {}
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or RESULTS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    # Columns added since the first version of the schema.
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(timings)")}
+    for column, kind in (("rss_peak_sampled_kib", "INTEGER"), ("rss_timeline", "TEXT")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE timings ADD COLUMN {column} {kind}")
+    return conn
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_version(ffmpeg_bin):
+    try:
+        result = subprocess.run([ffmpeg_bin, "-version"], capture_output=True, text=True)
+    except OSError:
+        return "unavailable"
+    lines = result.stdout.splitlines()
+    return lines[0] if lines else "unavailable"
+
+
+def binary_sha256(binary):
+    path = shutil.which(binary) or binary
+    return refcache.file_digest(path) if os.path.isfile(path) else None
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def add_run(conn, run_id, kind, ffmpeg_bin="ffmpeg"):
+    """Insert (or replace) a run with the host and build details, returns its row id."""
+    conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+    cursor = conn.execute(
+        "INSERT INTO runs (run_id, kind, started, host, platform, cpu_count, git_commit,"
+        " ffmpeg_bin, ffmpeg_version, ffmpeg_sha256, oiiotool_version)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            run_id, kind, datetime.datetime.now().isoformat(timespec="seconds"),
+            platform.node(), platform.platform(), os.cpu_count(), git_commit(),
+            ffmpeg_bin, ffmpeg_version(ffmpeg_bin), binary_sha256(ffmpeg_bin), refcache.oiiotool_version(),
+        ),
+    )
+    return cursor.lastrowid
+
+
+def add_timings(conn, run, commands):
+    conn.executemany(
+        "INSERT INTO timings (run, nodeid, tool, command, elapsed, cpu_user, cpu_sys, max_rss_kib,"
+        " rss_peak_sampled_kib, rss_timeline) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (run, c.get("nodeid"), c.get("tool"), c.get("command"), c.get("elapsed"),
+             c.get("cpu_user"), c.get("cpu_sys"), c.get("max_rss_kib"), c.get("rss_peak_sampled_kib"),
+             json.dumps(c["rss_timeline"]) if c.get("rss_timeline") else None)
+            for c in commands
+        ],
+    )
+
+
+def record_report(report):
+    """Track the outcome and duration of every case of the session (called for every report)."""
+    case = _CASES.setdefault(report.nodeid, {"outcome": "passed", "duration": None, "ffmpeg_bin": None})
+    case["ffmpeg_bin"] = case["ffmpeg_bin"] or dict(report.user_properties).get("ffmpeg_bin")
+    if report.when == "call":
+        case["duration"] = report.duration
+    if report.failed:
+        case["outcome"] = "failed" if report.when == "call" else "error"
+    elif report.skipped and case["outcome"] == "passed":
+        case["outcome"] = "skipped"
+
+
+def store_session(merged, commands, run_id=None, path=None):
+    """Store this session's cases, their PSNR results (results.collect()) and command timings."""
+    if not _CASES and not merged:
+        return None
+    ffmpeg_bin = next((c["ffmpeg_bin"] for c in _CASES.values() if c["ffmpeg_bin"]), "ffmpeg")
+    by_nodeid = {r.get("nodeid", r["test"]): r for r in merged}
+    nodeids = sorted(set(_CASES) | set(by_nodeid))
+    conn = connect(path)
+    with conn:
+        run = add_run(conn, run_id or results.run_id(), "ociotest", ffmpeg_bin)
+        rows = []
+        for nodeid in nodeids:
+            case = _CASES.get(nodeid, {})
+            result = by_nodeid.get(nodeid, {})
+            rows.append((
+                run, nodeid, result.get("test", nodeid.rsplit("[", 1)[-1].rstrip("]")), result.get("file"),
+                case.get("outcome"), case.get("duration"), result.get("psnr"), result.get("min_psnr"),
+                None if "passed" not in result else int(result["passed"]),
+                json.dumps(result.get("channels"), default=results._json_default) if "channels" in result else None,
+            ))
+        conn.executemany(
+            "INSERT INTO results (run, nodeid, test, file, outcome, duration, psnr, min_psnr, passed, channels)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        add_timings(conn, run, commands)
+    conn.close()
+    _CASES.clear()
+    return run
+
+
+def store_timings(kind, timings, commands=(), ffmpeg_bin="ffmpeg", path=None):
+    """
+    Store a script run such as timingtest.py: its named wall times
+    ({name: seconds}) and the timings of its commands (results.command_timing()).
+    """
+    conn = connect(path)
+    with conn:
+        run = add_run(conn, f"{kind}-{datetime.datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}", kind, ffmpeg_bin)
+        add_timings(conn, run, [{"tool": name, "elapsed": seconds} for name, seconds in timings.items()])
+        add_timings(conn, run, commands)
+    conn.close()
+    return run
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+
+def _table(header, rows):
+    widths = [max(len(str(v)) for v in column) for column in zip(header, *rows)]
+    lines = ["  ".join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip() for row in [header] + rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return "\n".join(lines)
+
+
+def _psnr(value):
+    if value is None:
+        return "-"
+    return "inf" if math.isinf(value) else f"{value:.3f}"
+
+
+def _build(run):
+    sha = (run["ffmpeg_sha256"] or "")[:8]
+    return f"{run['ffmpeg_version'] or '?'}" + (f" [{sha}]" if sha else "")
+
+
+def last_runs(conn, kind="ociotest", count=5):
+    rows = conn.execute(
+        "SELECT * FROM runs WHERE kind = ? ORDER BY started DESC, id DESC LIMIT ?", (kind, count)
+    ).fetchall()
+    return rows[::-1]
+
+
+def runtime_drift(durations):
+    """A flag when the last of durations (oldest first) is off the median of the earlier ones."""
+    earlier = [d for d in durations[:-1] if d]
+    if not durations or not durations[-1] or not earlier:
+        return None
+    median = statistics.median(earlier)
+    change = durations[-1] - median
+    if abs(change) > RUNTIME_DRIFT_MIN and abs(change) > RUNTIME_DRIFT * median:
+        return f"{'slower' if change > 0 else 'faster'} {median:.2f}s -> {durations[-1]:.2f}s"
+    return None
+
+
+def tool_timings(conn, ids):
+    """
+    {name: {run: seconds}}: the named timings of scripts and the total time
+    spent in each tool's commands, for the runs ids.
+    """
+    placeholders = ",".join("?" * len(ids))
+    timings = {}
+    for row in conn.execute(
+        f"SELECT run, tool, command IS NULL AS named, SUM(elapsed) AS elapsed, COUNT(*) AS count"
+        f" FROM timings WHERE run IN ({placeholders}) GROUP BY run, tool, named ORDER BY tool",
+        ids,
+    ):
+        name = row["tool"] if row["named"] else f"{row['tool']} commands"
+        timings.setdefault(name, {})[row["run"]] = row["elapsed"]
+    return timings
+
+
+def drift(history):
+    """
+    Flags for the latest entry of a case's history (results rows, oldest
+    first) against its earlier runs.
+    """
+    if len(history) < 2:
+        return []
+    latest, earlier = history[-1], history[:-1]
+    flags = []
+    previous = next((r for r in reversed(earlier) if r["psnr"] is not None), None)
+    if latest["psnr"] is not None and previous is not None:
+        old, new = previous["psnr"], latest["psnr"]
+        if math.isinf(old) != math.isinf(new) or (not math.isinf(old) and abs(new - old) > PSNR_DRIFT):
+            flags.append(f"psnr {_psnr(old)} -> {_psnr(new)}")
+    runtime = runtime_drift([r["duration"] for r in history])
+    if runtime:
+        flags.append(runtime)
+    if earlier[-1]["outcome"] != latest["outcome"]:
+        flags.append(f"{earlier[-1]['outcome']} -> {latest['outcome']}")
+    return flags
+
+
+def report(conn, kind="ociotest", count=5, match=None):
+    """PSNR and runtime trend tables over the last count runs, and the cases that drifted."""
+    runs = last_runs(conn, kind, count)
+    if not runs:
+        return "No runs stored."
+    ids = [run["id"] for run in runs]
+    placeholders = ",".join("?" * len(ids))
+    cases = {}
+    for row in conn.execute(
+        f"SELECT * FROM results WHERE run IN ({placeholders}) ORDER BY nodeid", ids
+    ):
+        if match and match not in row["nodeid"]:
+            continue
+        cases.setdefault(row["nodeid"], {})[row["run"]] = row
+
+    lines = ["Runs:"]
+    lines.append(_table(
+        ("#", "run", "started", "host", "commit", "ffmpeg"),
+        [(i + 1, r["run_id"], r["started"], r["host"], r["git_commit"] or "-", _build(r)) for i, r in enumerate(runs)],
+    ))
+
+    headers = ("Case",) + tuple(f"#{i + 1}" for i in range(len(runs)))
+    psnr_rows, time_rows, flagged = [], [], []
+    for nodeid, by_run in cases.items():
+        name = nodeid.split("::", 1)[-1]
+        psnr_rows.append((name,) + tuple(_psnr(by_run[i]["psnr"]) if i in by_run else "" for i in ids))
+        time_rows.append((name,) + tuple(
+            f"{by_run[i]['duration']:.2f}" if i in by_run and by_run[i]["duration"] else "" for i in ids
+        ))
+        history = [by_run[i] for i in ids if i in by_run]
+        flags = drift(history)
+        if flags and history[-1]["run"] == ids[-1]:
+            before = next(r for r in runs if r["id"] == history[-2]["run"])
+            build = "" if _build(before) == _build(runs[-1]) else f" (ffmpeg {_build(before)} -> {_build(runs[-1])})"
+            flagged.append(f"  {name}: {'; '.join(flags)}{build}")
+
+    for name, by_run in tool_timings(conn, ids).items():
+        time_rows.append((name,) + tuple(f"{by_run[i]:.2f}" if by_run.get(i) else "" for i in ids))
+        flag = runtime_drift([by_run[i] for i in ids if i in by_run]) if ids[-1] in by_run else None
+        if flag:
+            flagged.append(f"  {name}: {flag}")
+
+    if psnr_rows:
+        lines += ["", "PSNR (dB):", _table(headers, psnr_rows)]
+    if time_rows:
+        lines += ["", "Runtime (s):", _table(headers, time_rows)]
+    lines.append("")
+    lines.append("Drift in the latest run:" if flagged else "No drift in the latest run.")
+    lines += flagged
+    return "\n".join(lines)
+
+
+def case_stats(conn, kind="ociotest", count=20):
+    """
+    Runs, failures and median duration of every case over the last count
+    runs of kind: {nodeid: {"runs", "failures", "duration"}}. Skipped cases
+    don't count as runs.
+    """
+    ids = [r["id"] for r in last_runs(conn, kind, count)]
+    if not ids:
+        return {}
+    rows = conn.execute(
+        f"SELECT nodeid, outcome, duration FROM results WHERE run IN ({', '.join('?' * len(ids))})", ids
+    )
+    cases = {}
+    for row in rows:
+        if row["outcome"] not in ("passed", "failed", "error"):
+            continue
+        case = cases.setdefault(row["nodeid"], {"runs": 0, "failures": 0, "durations": []})
+        case["runs"] += 1
+        case["failures"] += row["outcome"] != "passed"
+        if row["duration"] is not None:
+            case["durations"].append(row["duration"])
+    return {
+        nodeid: {
+            "runs": case["runs"],
+            "failures": case["failures"],
+            "duration": statistics.median(case["durations"]) if case["durations"] else None,
+        }
+        for nodeid, case in cases.items()
+    }
+
+
+def history(conn, nodeid):
+    rows = conn.execute(
+        "SELECT runs.run_id, runs.started, runs.ffmpeg_version, runs.ffmpeg_sha256, results.*"
+        " FROM results JOIN runs ON runs.id = results.run"
+        " WHERE results.nodeid = ? ORDER BY runs.started, runs.id",
+        (nodeid,),
+    ).fetchall()
+    if not rows:
+        return f"No results for {nodeid}"
+    return _table(
+        ("run", "started", "outcome", "psnr", "min psnr", "duration", "ffmpeg"),
+        [
+            (r["run_id"], r["started"], r["outcome"], _psnr(r["psnr"]), _psnr(r["min_psnr"]),
+             f"{r['duration']:.2f}" if r["duration"] else "-", _build(r))
+            for r in rows
+        ],
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query the results history.")
+    parser.add_argument("--db", default=RESULTS_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+    runs = sub.add_parser("runs", help="List the stored runs")
+    runs.add_argument("--kind", default=None, help="Only runs of this kind (ociotest, timingtest)")
+    rep = sub.add_parser("report", help="Trend tables with drift flags")
+    rep.add_argument("--last", type=int, default=5, help="Number of runs to show")
+    rep.add_argument("--kind", default="ociotest")
+    rep.add_argument("--match", default=None, help="Only cases whose node id contains this")
+    hist = sub.add_parser("history", help="One case across all runs")
+    hist.add_argument("nodeid")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    conn = connect(args.db)
+    if args.command == "runs":
+        query = "SELECT runs.*, (SELECT COUNT(*) FROM results WHERE run = runs.id) AS cases FROM runs"
+        params = ()
+        if args.kind:
+            query += " WHERE kind = ?"
+            params = (args.kind,)
+        rows = conn.execute(query + " ORDER BY started, id", params).fetchall()
+        print(_table(
+            ("run", "kind", "started", "host", "commit", "cases", "ffmpeg"),
+            [(r["run_id"], r["kind"], r["started"], r["host"], r["git_commit"] or "-", r["cases"], _build(r))
+             for r in rows],
+        ))
+    elif args.command == "report":
+        print(report(conn, args.kind, args.last, args.match))
+    else:
+        print(history(conn, args.nodeid))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Thread scaling study of the ocio filter.
+
+Runs the ocio filter with threads=1..N, combined with ffmpeg's own -threads
+(decoder) and -filter_threads settings, and reports how well it scales:
+
+    speedup(T)     time of the ocio stage with 1 thread / time with T threads
+    efficiency(T)  speedup(T) / T
+
+The ocio stage is isolated as in profiling.py: every repetition decodes to
+the null muxer with and without the ocio filter, and the stage time is the
+difference. By default the steady state time (after the first frame) is
+used, so OCIO processor creation doesn't count against the threads.
+
+Each ratio gets a bootstrap confidence interval over the repetitions. The
+saturation point is the smallest thread count whose speedup can't be told
+apart from (is within SATURATION_TOLERANCE of) the best one: more threads
+per job than that only take cores away from other jobs on the node.
+
+    python scaling.py --threads 1 2 4 8 16 --ffmpeg-threads 0 1 --filter-threads 0 1 --repeat 5
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import benchmark
+import profiling
+
+BOOTSTRAP_SAMPLES = 2000
+CONFIDENCE = 0.95
+SATURATION_TOLERANCE = 0.05
+
+
+def default_threads(cpus=None):
+    """1, 2, 4, ... up to the number of CPUs, and the number of CPUs itself."""
+    cpus = cpus or os.cpu_count() or 1
+    threads = []
+    t = 1
+    while t < cpus:
+        threads.append(t)
+        t *= 2
+    return threads + [cpus]
+
+
+def ffmpeg_args(ffmpeg_threads, filter_threads):
+    """ffmpeg options of one setting, None meaning ffmpeg's default."""
+    args = []
+    if ffmpeg_threads is not None:
+        args += ["-threads", str(ffmpeg_threads)]
+    if filter_threads is not None:
+        args += ["-filter_threads", str(filter_threads)]
+    return args
+
+
+def stage_time(run, metric):
+    """Seconds of one profiling.run_profiled() measurement, whole run or steady state."""
+    if metric == "steady" and run["steady_fps"]:
+        return (run["frames_done"] - 1) / run["steady_fps"]
+    return run["wall"]
+
+
+def bootstrap_ratio(numerator, denominator, rng, samples=BOOTSTRAP_SAMPLES, confidence=CONFIDENCE):
+    """
+    mean(numerator) / mean(denominator) with a percentile bootstrap
+    confidence interval, resampling both sets of repetitions.
+    """
+    ratio = statistics.mean(numerator) / statistics.mean(denominator)
+    ratios = sorted(
+        statistics.mean(rng.choices(numerator, k=len(numerator)))
+        / statistics.mean(rng.choices(denominator, k=len(denominator)))
+        for _ in range(samples)
+    )
+    tail = (1.0 - confidence) / 2
+    low = ratios[int(tail * (samples - 1))]
+    high = ratios[int((1.0 - tail) * (samples - 1))]
+    return ratio, low, high
+
+
+def scaling_curve(times, rng):
+    """
+    Speedup and efficiency per thread count from the ocio stage times of
+    each repetition ({threads: [seconds]}, must include 1 thread).
+    """
+    base = times[1]
+    curve = []
+    for threads in sorted(times):
+        speedup, low, high = bootstrap_ratio(base, times[threads], rng)
+        curve.append({
+            "threads": threads,
+            "stage_time": statistics.mean(times[threads]),
+            "stage_time_stdev": statistics.stdev(times[threads]) if len(times[threads]) > 1 else 0.0,
+            "speedup": speedup,
+            "speedup_low": low,
+            "speedup_high": high,
+            "efficiency": speedup / threads,
+            "efficiency_low": low / threads,
+            "efficiency_high": high / threads,
+        })
+    return curve
+
+
+def saturation(curve, tolerance=SATURATION_TOLERANCE):
+    """The smallest thread count whose speedup reaches the best speedup, within tolerance and its interval."""
+    best = max(point["speedup"] for point in curve)
+    for point in curve:
+        if point["speedup_high"] >= best * (1.0 - tolerance):
+            return point["threads"]
+    return curve[-1]["threads"]
+
+
+def study(source, first, frames, threads, ffmpeg_threads, filter_threads, pix_fmt, resolution,
+          output_dir, repeat=5, warmup=1, metric="steady", seed=0):
+    """Run the scaling study, returns one result per (ffmpeg -threads, -filter_threads) setting."""
+    os.makedirs(output_dir, exist_ok=True)
+    log_file = os.path.join(output_dir, "scaling.log")
+    threads = sorted(set(threads) | {1})
+    rng = random.Random(seed)
+    results = []
+    for ff_threads, flt_threads in itertools.product(ffmpeg_threads, filter_threads):
+        extra = ffmpeg_args(ff_threads, flt_threads)
+
+        def measure(stage, ocio_threads):
+            cmd = profiling.stage_command(stage, source, first, frames, ocio_threads, pix_fmt, "null",
+                                          resolution, "-", ffmpeg_args=extra)
+            for _ in range(warmup):
+                profiling.run_profiled(cmd, log_file)
+            return [stage_time(profiling.run_profiled(cmd, log_file), metric) for _ in range(repeat)]
+
+        decode = statistics.mean(measure("decode", 1))
+        times = {}
+        for ocio_threads in threads:
+            # Keep a floor so a stage lost in the noise doesn't divide by zero.
+            times[ocio_threads] = [max(t - decode, 1e-6) for t in measure("ocio", ocio_threads)]
+            print(
+                f"-threads {ff_threads if ff_threads is not None else 'default'} "
+                f"-filter_threads {flt_threads if flt_threads is not None else 'default'} "
+                f"ocio threads={ocio_threads}: {1000.0 * statistics.mean(times[ocio_threads]) / frames:.2f} ms/frame",
+                file=os.sys.stderr,
+            )
+        curve = scaling_curve(times, rng)
+        results.append({
+            "ffmpeg_threads": ff_threads,
+            "filter_threads": flt_threads,
+            "decode_time": decode,
+            "curve": curve,
+            "saturation": saturation(curve),
+        })
+    return results
+
+
+def format_study(results, frames):
+    lines = []
+    for result in results:
+        setting = " ".join(
+            f"{name} {'default' if value is None else value}"
+            for name, value in (("-threads", result["ffmpeg_threads"]), ("-filter_threads", result["filter_threads"]))
+        )
+        lines.append(f"{setting} (decode {result['decode_time']:.3f}s):")
+        header = ("threads", "ocio ms/frame", "speedup", f"{CONFIDENCE:.0%} CI", "efficiency", "")
+        rows = [
+            (
+                str(p["threads"]),
+                f"{1000.0 * p['stage_time'] / frames:.2f}",
+                f"{p['speedup']:.2f}",
+                f"{p['speedup_low']:.2f}-{p['speedup_high']:.2f}",
+                f"{p['efficiency']:.0%}",
+                "#" * int(round(20 * min(p["efficiency"], 1.0))),
+            )
+            for p in result["curve"]
+        ]
+        widths = [max(len(v) for v in column) for column in zip(header, *rows)]
+        table = ["  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip() for row in [header] + rows]
+        table.insert(1, "  ".join("-" * w for w in widths))
+        lines += table
+        point = next(p for p in result["curve"] if p["threads"] == result["saturation"])
+        lines.append(
+            f"Saturates at threads={result['saturation']} "
+            f"(speedup {point['speedup']:.2f}, efficiency {point['efficiency']:.0%})"
+        )
+        lines.append("")
+    return "\n".join(lines).rstrip()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=os.environ.get("OCIOTEST_SPARKS_EXRS"),
+                        help="EXR sequence with '#' for the frame number (default: synthetic)")
+    parser.add_argument("--first", type=int, default=6100)
+    parser.add_argument("--frames", type=int, default=48)
+    parser.add_argument("--size", default="1920x1080", help="Size of the synthetic source")
+    parser.add_argument("--threads", type=int, nargs="+", default=default_threads(), help="ocio threads= values")
+    parser.add_argument("--ffmpeg-threads", type=int, nargs="+", default=[None],
+                        help="ffmpeg -threads values (default: ffmpeg's own)")
+    parser.add_argument("--filter-threads", type=int, nargs="+", default=[None],
+                        help="ffmpeg -filter_threads values (default: ffmpeg's own)")
+    parser.add_argument("--pix-fmt", default="rgb48", help="ocio format=")
+    parser.add_argument("--resolution", default=None, help="Scale the source to WIDTHxHEIGHT first")
+    parser.add_argument("--metric", default="steady", choices=["steady", "wall"],
+                        help="Time after the first frame, or the whole run")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output-dir", default="./outputbenchmark")
+    parser.add_argument("--json", default=None, help="Write the curves to this file (default: <output-dir>/scaling-<timestamp>.json)")
+    parser.add_argument("--ffmpeg", default=benchmark.FFMPEG_BIN)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    benchmark.FFMPEG_BIN = args.ffmpeg
+    source, first = args.source, args.first
+    if not source or not os.path.exists(source.replace("#", f"{first:05d}")):
+        width, height = (int(v) for v in args.size.split("x"))
+        source, first = benchmark.synthetic_sequence(width, height, args.frames)
+
+    results = study(source, first, args.frames, args.threads, args.ffmpeg_threads, args.filter_threads,
+                    args.pix_fmt, args.resolution, args.output_dir, args.repeat, args.warmup, args.metric)
+    print(format_study(results, args.frames))
+    json_path = args.json or os.path.join(args.output_dir, f"scaling-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(json_path, "w") as f:
+        json.dump({"host": benchmark.host_info(), "source": source, "frames": args.frames,
+                   "pix_fmt": args.pix_fmt, "metric": args.metric, "results": results}, f, indent=2)
+    print(f"Wrote {json_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
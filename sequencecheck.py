@@ -0,0 +1,219 @@
+"""
+Frame by frame validation of image sequences.
+
+ffmpeg's ocio output is read as rawvideo from a pipe and oiiotool renders the
+reference in small chunks of frames (with --parallel-frames) into a scratch
+directory that is emptied as the frames are compared. At most two chunks of
+reference frames are ever on disk and one ffmpeg frame is held in memory, so
+full shot lengths can be validated without writing the whole sequence out.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import imagecompare
+import imagereaders
+
+FFMPEG_BIN = "ffmpeg"
+OIIOTOOL_BIN = "oiiotool"
+# Threads of each of the ffmpeg and oiiotool processes, 0 for the tools' defaults.
+THREADS = 0
+
+# Lines of ffmpeg's log quoted when it fails.
+LOG_TAIL_LINES = 20
+
+# oiiotool output depth matching the rawvideo pixel format requested from ffmpeg.
+OIIO_FORMATS = {"rgb24": "uint8", "rgb48le": "uint16", "gbrpf32le": "float"}
+
+
+def frame_path(pattern, frame, padding):
+    """Expand a '#' frame pattern (oiiotool style) for one frame number."""
+    return pattern.replace("#", f"{frame:0{padding}d}")
+
+
+def ffmpeg_frames(source, first, count, vf, width, height, pix_fmt="rgb48le", padding=5, log_file=None):
+    """
+    Yield ffmpeg's output frames as imagereaders.Image objects read from a
+    rawvideo pipe. The frame buffer is reused, so each frame is only valid
+    until the next one is requested. When the stream ends because ffmpeg
+    failed, subprocess.CalledProcessError is raised with the tail of its log.
+    """
+    ffmpeg_source = source.replace("#", f"%0{padding}d")
+    threads = ["-threads", str(THREADS), "-filter_threads", str(THREADS)] if THREADS else []
+    cmd = [
+        FFMPEG_BIN, "-v", "error", *threads, "-framerate", "24", "-start_number", str(first),
+        "-i", ffmpeg_source, "-frames:v", str(count), "-vf", vf,
+        "-f", "rawvideo", "-pix_fmt", pix_fmt, "-",
+    ]
+    print(f"Running command: {subprocess.list2cmdline(cmd)}", file=sys.stderr)
+    # Without a log file stderr goes to a temporary file, so a failure can still be reported.
+    stderr = open(log_file, "a+") if log_file else tempfile.TemporaryFile("w+")
+    log_start = stderr.tell()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+    buf = bytearray(imagereaders.frame_bytes(width, height, pix_fmt))
+    view = memoryview(buf)
+    try:
+        while True:
+            filled = 0
+            while filled < len(buf):
+                n = proc.stdout.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+            if filled < len(buf):
+                break
+            yield imagereaders.frame_from_buffer(buf, width, height, pix_fmt)
+        # The stream ended: a short or empty read is only fine if ffmpeg exited cleanly.
+        if proc.wait() != 0:
+            stderr.flush()
+            stderr.seek(log_start)
+            tail = "".join(stderr.readlines()[-LOG_TAIL_LINES:])
+            raise subprocess.CalledProcessError(proc.returncode, subprocess.list2cmdline(cmd), stderr=tail)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+        stderr.close()
+
+
+def oiiotool_frames(source, first, last, oiio_args, scratch_dir, oiioformat="uint16", padding=5, chunk=8, log_file=None):
+    """
+    Yield oiiotool reference frames. Frames are rendered chunk by chunk with
+    --parallel-frames; the next chunk renders while the current one is being
+    compared, and each frame file is deleted as soon as it has been read.
+    """
+    os.makedirs(scratch_dir, exist_ok=True)
+    output = os.path.join(scratch_dir, "reference.#.tif")
+    log = open(log_file, "a") if log_file else subprocess.DEVNULL
+
+    def start(a):
+        b = min(a + chunk - 1, last)
+        cmd = (
+            [OIIOTOOL_BIN] + (["--threads", str(THREADS)] if THREADS else [])
+            + ["--framepadding", str(padding), "--parallel-frames", "--frames", f"{a}-{b}", source]
+            + list(oiio_args)
+            + ["-d", oiioformat, "--compression", "none", "-o", output]
+        )
+        print(f"Running command: {subprocess.list2cmdline(cmd)}", file=sys.stderr)
+        return a, b, subprocess.Popen(cmd, stdout=log, stderr=log)
+
+    pending = start(first)
+    try:
+        while pending:
+            a, b, proc = pending
+            returncode = proc.wait()
+            assert returncode == 0, f"oiiotool failed rendering frames {a}-{b}"
+            pending = start(b + 1) if b < last else None
+            for frame in range(a, b + 1):
+                path = frame_path(output, frame, padding)
+                image = imagereaders.read_image(path)
+                os.remove(path)
+                yield image
+    finally:
+        if pending and pending[2].poll() is None:
+            pending[2].kill()
+            pending[2].wait()
+        for name in os.listdir(scratch_dir):
+            if name.startswith("reference."):
+                os.remove(os.path.join(scratch_dir, name))
+        if log_file:
+            log.close()
+
+
+def validate_sequence(source, first, last, vf, oiio_args, scratch_dir, min_psnr,
+                      pix_fmt="rgb48le", padding=5, chunk=8, abort_on_failure=True, log_file=None):
+    """
+    Compare ffmpeg and oiiotool frame by frame. Returns a dict with the per
+    frame PSNR, the worst frame, whether the run was aborted on the first
+    frame below min_psnr, and the error when ffmpeg failed (else None).
+    """
+    first_frame = imagereaders.read_image(frame_path(source, first, padding), FFMPEG_BIN)
+    height, width = first_frame.pixels.shape[:2]
+    del first_frame
+
+    reference = oiiotool_frames(source, first, last, oiio_args, scratch_dir,
+                                OIIO_FORMATS[pix_fmt], padding, chunk, log_file)
+    candidate = ffmpeg_frames(source, first, last - first + 1, vf, width, height, pix_fmt, padding, log_file)
+
+    frames = []
+    aborted = False
+    error = None
+    try:
+        for frame, (ref, test) in enumerate(zip(reference, candidate), start=first):
+            psnr = imagecompare.compare_images(ref, test)["psnr"]
+            frames.append({"frame": frame, "psnr": psnr})
+            msg = f"frame {frame}: PSNR {psnr:.4f}\n"
+            print(msg, end="", file=sys.stderr)
+            if log_file:
+                with open(log_file, "a") as f:
+                    f.write(msg)
+            if psnr <= min_psnr and abort_on_failure:
+                aborted = True
+                break
+    except subprocess.CalledProcessError as exc:
+        error = f"ffmpeg exited with code {exc.returncode} after {len(frames)} frames:\n{exc.stderr}"
+        print(error, file=sys.stderr)
+    finally:
+        reference.close()
+        candidate.close()
+
+    assert frames, error or "No frames were compared"
+    worst = min(frames, key=lambda f: f["psnr"])
+    return {
+        "frames": frames,
+        "compared": len(frames),
+        "expected": last - first + 1,
+        "worst_frame": worst["frame"],
+        "worst_psnr": worst["psnr"],
+        "aborted": aborted,
+        "error": error,
+        "passed": not aborted and not error and len(frames) == last - first + 1 and worst["psnr"] > min_psnr,
+    }
+
+
+def main():
+    global FFMPEG_BIN, OIIOTOOL_BIN
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Image sequence with '#' for the frame number, e.g. SPARKS_ACES_#.exr")
+    parser.add_argument("--frames", required=True, help="Frame range, e.g. 6100-6299")
+    parser.add_argument("--config", required=True, help="OCIO config")
+    parser.add_argument("--input-space", required=True)
+    parser.add_argument("--display", required=True)
+    parser.add_argument("--view", required=True)
+    parser.add_argument("--format", default="rgb48", help="ocio filter format= (default rgb48)")
+    parser.add_argument("--pix-fmt", default="rgb48le", choices=sorted(OIIO_FORMATS))
+    parser.add_argument("--min-psnr", type=float, default=95.0)
+    parser.add_argument("--padding", type=int, default=5)
+    parser.add_argument("--chunk", type=int, default=8, help="Reference frames rendered per oiiotool call")
+    parser.add_argument("--scratch-dir", default="./output/sequencecheck")
+    parser.add_argument("--no-abort", action="store_true", help="Keep going after the first failing frame")
+    parser.add_argument("--ffmpeg", default=FFMPEG_BIN)
+    parser.add_argument("--oiiotool", default=OIIOTOOL_BIN)
+    args = parser.parse_args()
+
+    FFMPEG_BIN = args.ffmpeg
+    OIIOTOOL_BIN = args.oiiotool
+    first, last = (int(v) for v in args.frames.split("-"))
+    vf = (
+        f"ocio=config={args.config}:input={args.input_space}:"
+        f"display={args.display}:view={args.view}:format={args.format}"
+    )
+    oiio_args = ["--colorconfig", args.config, "--iscolorspace", args.input_space,
+                 "--ociodisplay", args.display, args.view]
+    result = validate_sequence(args.source, first, last, vf, oiio_args, args.scratch_dir, args.min_psnr,
+                               args.pix_fmt, args.padding, args.chunk, not args.no_abort)
+
+    print(f"Compared {result['compared']}/{result['expected']} frames")
+    if result["error"]:
+        print(result["error"])
+    print(f"Worst frame: {result['worst_frame']} (PSNR {result['worst_psnr']:.4f})")
+    if result["aborted"]:
+        print(f"Aborted: frame {result['frames'][-1]['frame']} is below {args.min_psnr} dB")
+    return 0 if result["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
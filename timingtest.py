@@ -1,9 +1,10 @@
 import time
-import subprocess
 import os
 import sys
-import threading
-import io
+
+import cmdrunner
+import results
+import resultsdb
 
 os.environ["OCIO"] = "ocio://studio-config-v1.0.0_aces-v1.3_ocio-v2.1"
 
@@ -20,65 +21,14 @@ codec_params = "-c:v prores_videotoolbox -profile:v 3 -pix_fmt yuv422p10le -vend
 #codec_params = "-c:v ffv1 -pix_fmt yuv444p10le"
 
 ffmpeg_threads = [ 4 ] #1,2,4, 6, 8]
+commands = []
 def run_cmd(cmd, log_file=None):
-    msg = f"Running command: {cmd}\n"
-    print(msg, file=os.sys.stderr)
-
-    if log_file:
-        with open(log_file, "a") as f:
-            f.write(msg)
-
-    process = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        bufsize=1,
-        universal_newlines=True,
-    )
-
-    stdout_buf = io.StringIO()
-    stderr_buf = io.StringIO()
-
-    def _reader(pipe, buf, label):
-        try:
-            for line in iter(pipe.readline, ''):
-                # Print live to stderr and append to buffers/log
-                print(line, end='', file=os.sys.stderr)
-                buf.write(line)
-                if log_file:
-                    with open(log_file, "a") as lf:
-                        lf.write(f"{label}: {line}")
-        finally:
-            try:
-                pipe.close()
-            except Exception:
-                pass
-
-    t_out = threading.Thread(target=_reader, args=(process.stdout, stdout_buf, "STDOUT"), daemon=True)
-    t_err = threading.Thread(target=_reader, args=(process.stderr, stderr_buf, "STDERR"), daemon=True)
-    t_out.start()
-    t_err.start()
-
-    returncode = process.wait()
-
-    t_out.join()
-    t_err.join()
-
-    output_log = (
-        f"Return Code: {returncode}\n"
-        f"STDOUT:\n{stdout_buf.getvalue()}\n"
-        f"STDERR:\n{stderr_buf.getvalue()}\n"
-    )
-
-    if log_file:
-        with open(log_file, "a") as f:
-            f.write(output_log)
-
-    assert returncode == 0, f"Command failed: {cmd}\n{stderr_buf.getvalue()}"
-
-    # Return a CompletedProcess-like object for compatibility
-    return subprocess.CompletedProcess(args=cmd, returncode=returncode, stdout=stdout_buf.getvalue().encode(), stderr=stderr_buf.getvalue().encode())
+    # Streams the output live, ffmpeg's progress lines at most once a second.
+    result = cmdrunner.run(cmd, log_file, echo=True, progress_interval=1.0)
+    print(f"CPU: user {result.cpu_user:.2f}s sys {result.cpu_sys:.2f}s, max RSS {result.max_rss_kib / 1024:.0f} MiB",
+          file=os.sys.stderr)
+    commands.append(results.command_timing(cmd, result))
+    return result
 
 
 
@@ -121,3 +71,8 @@ for threads, thread_time in thread_timing.items():
     print(f"Elapsed time for ffmpeg with {threads} threads: {thread_time} seconds")
 
 #print(f"Elapsed time for parallel ffmpeg only: {parallel_ffmpeg_elapsed} seconds")
+
+# Keep the history, see "python resultsdb.py report --kind timingtest".
+timings = {"oiiotool": oiiotool_elapsed, "basic ffmpeg": basic_ffmpeg_elapsed, "oiiotool + ffmpeg": elapsed}
+timings.update({f"ffmpeg threads={threads}": thread_time for threads, thread_time in thread_timing.items()})
+resultsdb.store_timings("timingtest", timings, commands)
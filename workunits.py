@@ -0,0 +1,124 @@
+"""
+Run identical renders only once per pytest session.
+
+Many cases share work: the same oiiotool reference feeds several YUV round
+trips, and the same ffmpeg command can appear in more than one suite. A
+work unit is identified by a hash of what it runs (the command line, or
+the reference cache key for oiiotool); its output is written once to
+output/units/<run id>/<hash>.<ext> and every case that needs it links it
+into its own directory. A per-process memo skips units this process has
+already produced, an fcntl lock on the unit serializes pytest-xdist
+workers that need the same unit at the same time.
+"""
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+
+import cmdrunner
+import results
+
+_DONE = set()
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+
+def units_dir(run=None):
+    return os.path.join(results.OUTPUT_DIR, "units", run or results.run_id())
+
+
+def unit_key(*parts):
+    return hashlib.sha256("\0".join(str(p) for p in parts).encode()).hexdigest()[:20]
+
+
+def _thread_lock(key):
+    with _LOCKS_LOCK:
+        return _LOCKS.setdefault(key, threading.Lock())
+
+
+def unit_path(key, ext):
+    return os.path.join(units_dir(), f"{key}.{ext}")
+
+
+def is_done(key, ext):
+    """True when the unit has already been rendered by any process of this run."""
+    return key in _DONE or os.path.exists(unit_path(key, ext))
+
+
+def shared_output(key, ext, produce, log_file=None):
+    """
+    Return the path of the output of work unit key, calling produce(path) to
+    render it if no process of this run has done so yet. produce writes to a
+    temporary name that keeps the extension, so tools still pick the format
+    from it; the file is renamed into place once complete.
+    """
+    return shared_outputs({key: ext}, lambda paths: produce(paths[key]), log_file)[key]
+
+
+def shared_outputs(units, produce, log_file=None):
+    """
+    shared_output() for several units rendered by one command: units maps
+    keys to extensions, produce gets a dict of key to temporary path for the
+    units that still need rendering. Returns a dict of key to unit path.
+    """
+    keys = sorted(units)
+    paths = {key: unit_path(key, units[key]) for key in keys}
+    thread_locks = [_thread_lock(key) for key in keys]
+    for lock in thread_locks:
+        lock.acquire()
+    try:
+        missing = [key for key in keys if key not in _DONE]
+        if not missing:
+            for key in keys:
+                _log(f"Shared render reused: {paths[key]}\n", log_file)
+            return paths
+        os.makedirs(units_dir(), exist_ok=True)
+        # Always lock in key order so two processes locking overlapping sets can't deadlock.
+        with contextlib.ExitStack() as stack:
+            for key in missing:
+                lock = stack.enter_context(open(f"{paths[key]}.lock", "w"))
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            todo = {}
+            for key in missing:
+                if os.path.exists(paths[key]):
+                    _log(f"Shared render reused: {paths[key]}\n", log_file)
+                else:
+                    todo[key] = os.path.join(units_dir(), f"{key}.tmp-{os.getpid()}.{units[key]}")
+            if todo:
+                try:
+                    produce(todo)
+                    for key, tmp in todo.items():
+                        os.replace(tmp, paths[key])
+                finally:
+                    for tmp in todo.values():
+                        if os.path.exists(tmp):
+                            os.remove(tmp)
+        _DONE.update(missing)
+    finally:
+        for lock in thread_locks:
+            lock.release()
+    return paths
+
+
+def link(unit_path, path):
+    """Make a unit's output visible in a case directory under the name the case expects."""
+    if os.path.lexists(path):
+        os.remove(path)
+    try:
+        os.link(unit_path, path)
+    except OSError:
+        shutil.copyfile(unit_path, path)
+
+
+def cleanup(run=None):
+    """Remove a run's unit directory; the case directories keep their links."""
+    shutil.rmtree(units_dir(run), ignore_errors=True)
+
+
+def _log(msg, log_file):
+    print(msg, file=os.sys.stderr)
+    if log_file:
+        with cmdrunner.LOG_LOCK, open(log_file, "a") as f:
+            f.write(msg)